@@ -1,3 +1,7 @@
+# 启动耗时统计（需在导入其他模块之前开始）
+from startup_profile import startup_profile
+startup_profile.begin()
+
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context, session, redirect, url_for, send_file, make_response
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -6,24 +10,15 @@ from werkzeug.utils import secure_filename
 import os
 import json
 from datetime import datetime, timedelta
-import openai
 from typing import Generator
 import secrets
+import base64
 import io
 import requests
-from PIL import Image
-from PyPDF2 import PdfReader, PdfWriter
 import pymysql
 import uuid
 import subprocess
 import threading
-import smtplib
-import redis
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from contextlib import contextmanager
 
 # 导入 skills 模块
 from skills import register_all_skills
@@ -31,12 +26,61 @@ from skills import register_all_skills
 # 导入调度器模块
 from scheduler import scheduler
 
+# 导入共享数据库连接池
+from db import get_db_connection, get_pool_stats, init_app as init_db_scope
+
+# 导入数据库迁移模块
+from migrations import ensure_schema
+
+# 导入共享的大模型客户端
+from llm_clients import StreamedCompletion, get_llm_client_stats
+
+# 导入大模型调用网关（并发限制、重试、熔断、对冲）
+from llm_gateway import (call as llm_call, chat_completion, stream_chat_completion, get_gateway_stats,
+                         cached_prompt_tokens)
+
+# 导入大模型响应缓存
+from response_cache import response_cache, make_cache_key, prompt_version
+
+# 导入三字经/千字文预生成解读
+from classic_store import (classic_store, CLASSIC_SYSTEM_PROMPT, CLASSIC_USER_TEMPLATE,
+                           CLASSIC_MODEL, CLASSIC_GENERATION_PARAMS)
+
+# 导入按用户缓存的对话上下文
+from chat_context_cache import chat_context_cache
+
+# 导入对话上下文窗口
+from context_window import (build_context_window, count_tokens, get_context_budget, format_messages_for_summary,
+                            CHAT_CONTEXT_COMPACT_RATIO)
+
+# 导入工具路由
+from tool_router import tool_router
+
+# 导入可续传的流式生成任务
+from stream_jobs import stream_jobs, parse_last_event_id, StreamJobLimitError
+
+# 导入对话消息的延迟写入（WAL + 后台批量写入）
+from conversation_writer import SequenceGapError, conversation_writer, merge_pending
+
+# 导入多模型对比
+from model_compare import ModelFanOut, CHAT_COMPARE_MAX_MODELS
+
+# 导入长期对话记忆（跨对话检索历史片段）
+from conversation_memory import conversation_memory, format_memories
+
+# 导入对话分支（写时复制）
+from conversation_branches import (branch_ranges, create_branch, detach_branches, load_chain,
+                                   read_messages as read_branch_messages)
+
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
+# 同一请求内的数据库访问共享一个连接，请求结束时归还连接池
+init_db_scope(app)
+
 # 配置
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', secrets.token_hex(32))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
@@ -52,423 +96,10 @@ USER_SKILLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user
 # 确保用户skills目录存在
 os.makedirs(USER_SKILLS_DIR, exist_ok=True)
 
-# 数据库配置
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'port': int(os.getenv('DB_PORT', 3306)),
-    'user': os.getenv('DB_USER', 'root'),
-    'password': os.getenv('DB_PASSWORD', ''),
-    'database': os.getenv('DB_NAME', 'arc_logi_chat'),
-    'charset': os.getenv('DB_CHARSET', 'utf8mb4'),
-    'cursorclass': pymysql.cursors.DictCursor
-}
-
-@contextmanager
-def get_db_connection():
-    """获取数据库连接的上下文管理器"""
-    connection = pymysql.connect(**DB_CONFIG)
-    try:
-        yield connection
-    finally:
-        connection.close()
-
 def init_database():
-    """初始化数据库表"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cursor:
-            # 创建用户表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(50) NOT NULL UNIQUE,
-                    password VARCHAR(255) NOT NULL,
-                    email VARCHAR(100),
-                    theme VARCHAR(20) DEFAULT 'dark',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_email (email)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建对话表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    conversation_id VARCHAR(64) NOT NULL,
-                    username VARCHAR(50) NOT NULL,
-                    messages JSON,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_conversation_id (conversation_id),
-                    INDEX idx_username (username),
-                    UNIQUE KEY uk_user_conv (username, conversation_id)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # 创建用户技能状态表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_skills (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(50) NOT NULL,
-                    skill_name VARCHAR(100) NOT NULL,
-                    enabled TINYINT(1) DEFAULT 1,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY uk_user_skill (username, skill_name),
-                    INDEX idx_username (username)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建工作流表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workflows (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    description TEXT,
-                    username VARCHAR(50) NOT NULL,
-                    status ENUM('draft', 'active', 'paused', 'archived') DEFAULT 'draft',
-                    definition JSON,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_status (status),
-                    INDEX idx_created_at (created_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建工作流节点表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workflow_nodes (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    workflow_id INT NOT NULL,
-                    node_id VARCHAR(50) NOT NULL,
-                    node_type ENUM('start', 'end', 'llm', 'script', 'condition', 'input', 'output', 'delay', 'base64', 'json', 'sql', 'http') NOT NULL,
-                    name VARCHAR(100),
-                    config JSON,
-                    position_x INT DEFAULT 0,
-                    position_y INT DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_workflow_id (workflow_id),
-                    INDEX idx_node_type (node_type),
-                    UNIQUE KEY uk_workflow_node (workflow_id, node_id),
-                    FOREIGN KEY (workflow_id) REFERENCES workflows(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建工作流边表（节点连接关系）
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workflow_edges (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    workflow_id INT NOT NULL,
-                    source_node_id VARCHAR(50) NOT NULL,
-                    target_node_id VARCHAR(50) NOT NULL,
-                    `condition` TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_workflow_id (workflow_id),
-                    INDEX idx_source_target (source_node_id, target_node_id),
-                    FOREIGN KEY (workflow_id) REFERENCES workflows(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建工作流执行表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workflow_executions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    workflow_id INT NOT NULL,
-                    username VARCHAR(50) NOT NULL,
-                    execution_id VARCHAR(64) NOT NULL,
-                    status ENUM('pending', 'running', 'completed', 'failed', 'cancelled') DEFAULT 'pending',
-                    input_data JSON,
-                    output_data JSON,
-                    error_message TEXT,
-                    started_at DATETIME,
-                    completed_at DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_workflow_id (workflow_id),
-                    INDEX idx_username (username),
-                    INDEX idx_execution_id (execution_id),
-                    INDEX idx_status (status),
-                    INDEX idx_created_at (created_at),
-                    FOREIGN KEY (workflow_id) REFERENCES workflows(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建工作流节点执行表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workflow_node_executions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    execution_id INT NOT NULL,
-                    node_id VARCHAR(50) NOT NULL,
-                    node_type VARCHAR(50) NOT NULL,
-                    status ENUM('pending', 'running', 'completed', 'failed', 'skipped') DEFAULT 'pending',
-                    input_data JSON,
-                    output_data JSON,
-                    error_message TEXT,
-                    started_at DATETIME,
-                    completed_at DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_execution_id (execution_id),
-                    INDEX idx_node_id (node_id),
-                    INDEX idx_status (status),
-                    FOREIGN KEY (execution_id) REFERENCES workflow_executions(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # 创建定时任务表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS schedules (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    description TEXT,
-                    username VARCHAR(50) NOT NULL,
-                    cron VARCHAR(50) NOT NULL,
-                    preset VARCHAR(50),
-                    command TEXT NOT NULL,
-                    status ENUM('active', 'paused') DEFAULT 'active',
-                    last_run_at DATETIME,
-                    next_run_at DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_username_created (username, created_at),
-                    INDEX idx_status (status),
-                    INDEX idx_next_run_at (next_run_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # 创建定时任务执行表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS schedule_executions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    schedule_id INT NOT NULL,
-                    username VARCHAR(50) NOT NULL,
-                    execution_id VARCHAR(64) NOT NULL,
-                    status ENUM('pending', 'running', 'completed', 'failed') DEFAULT 'pending',
-                    output TEXT,
-                    error_message TEXT,
-                    started_at DATETIME,
-                    completed_at DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_schedule_id (schedule_id),
-                    INDEX idx_username (username),
-                    INDEX idx_status (status),
-                    INDEX idx_created_at (created_at),
-                    FOREIGN KEY (schedule_id) REFERENCES schedules(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # 创建异步任务表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS async_tasks (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(50) NOT NULL,
-                    task_name VARCHAR(100) NOT NULL,
-                    description TEXT,
-                    command TEXT NOT NULL,
-                    status ENUM('pending', 'scheduled', 'running', 'completed', 'failed', 'cancelled') DEFAULT 'pending',
-                    output TEXT,
-                    error_message TEXT,
-                    execution_id VARCHAR(64) NOT NULL,
-                    scheduled_at DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    started_at DATETIME,
-                    completed_at DATETIME,
-                    INDEX idx_username (username),
-                    INDEX idx_username_created (username, created_at),
-                    INDEX idx_status (status),
-                    INDEX idx_execution_id (execution_id),
-                    INDEX idx_created_at (created_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # 创建提示词表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS prompts (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    content TEXT NOT NULL,
-                    description TEXT,
-                    username VARCHAR(50) NOT NULL,
-                    tags VARCHAR(255),
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_name (name),
-                    INDEX idx_created_at (created_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建Agent表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS agents (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    description TEXT,
-                    system_prompt TEXT,
-                    prompt_id INT,
-                    model VARCHAR(50) DEFAULT 'gpt-4',
-                    temperature FLOAT DEFAULT 0.7,
-                    max_tokens INT DEFAULT 2000,
-                    username VARCHAR(50) NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_name (name),
-                    INDEX idx_prompt_id (prompt_id),
-                    INDEX idx_created_at (created_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建Agent技能关联表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS agent_skills (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    agent_id INT NOT NULL,
-                    skill_name VARCHAR(100) NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    UNIQUE KEY uk_agent_skill (agent_id, skill_name),
-                    INDEX idx_agent_id (agent_id),
-                    INDEX idx_skill_name (skill_name),
-                    FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建工作流搜索历史表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workflow_search_history (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(50) NOT NULL,
-                    search_keyword VARCHAR(200) NOT NULL,
-                    search_type VARCHAR(20) DEFAULT 'workflow',
-                    search_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_search_time (search_time),
-                    INDEX idx_keyword (search_keyword)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # 创建热门搜索表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS popular_searches (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    keyword VARCHAR(200) NOT NULL,
-                    search_type VARCHAR(20) DEFAULT 'workflow',
-                    search_count INT DEFAULT 1,
-                    last_searched_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE KEY uk_keyword_type (keyword, search_type),
-                    INDEX idx_search_count (search_count),
-                    INDEX idx_last_searched (last_searched_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-
-            # 为 workflows 表添加 username 索引（如果不存在）
-            try:
-                cursor.execute("""
-                    SHOW INDEX FROM workflows WHERE Key_name = 'idx_username'
-                """)
-                if not cursor.fetchone():
-                    cursor.execute("""
-                        ALTER TABLE workflows ADD INDEX idx_username (username)
-                    """)
-                    print("✅ 已添加 username 索引到 workflows 表")
-            except Exception as e:
-                print(f"添加 username 索引失败: {e}")
+    """初始化数据库表（执行尚未应用的迁移，已是最新版本时只做一次版本查询）"""
+    ensure_schema()
 
-            # 为 async_tasks 表添加 scheduled_at 列（如果不存在）
-            try:
-                cursor.execute("""
-                    SELECT COLUMN_NAME 
-                    FROM INFORMATION_SCHEMA.COLUMNS 
-                    WHERE TABLE_SCHEMA = DATABASE() 
-                    AND TABLE_NAME = 'async_tasks' 
-                    AND COLUMN_NAME = 'scheduled_at'
-                """)
-                if not cursor.fetchone():
-                    cursor.execute("""
-                        ALTER TABLE async_tasks 
-                        ADD COLUMN scheduled_at DATETIME NULL DEFAULT NULL
-                    """)
-                    print("✅ 已添加 scheduled_at 列到 async_tasks 表")
-            except Exception as e:
-                print(f"添加 scheduled_at 列失败: {e}")
-            
-            # 为 async_tasks 表添加 scheduled 状态到 status 枚举（如果不存在）
-            try:
-                cursor.execute("""
-                    SELECT COLUMN_TYPE 
-                    FROM INFORMATION_SCHEMA.COLUMNS 
-                    WHERE TABLE_SCHEMA = DATABASE() 
-                    AND TABLE_NAME = 'async_tasks' 
-                    AND COLUMN_NAME = 'status'
-                """)
-                row = cursor.fetchone()
-                if row and 'scheduled' not in row['COLUMN_TYPE']:
-                    cursor.execute("""
-                        ALTER TABLE async_tasks 
-                        MODIFY COLUMN status ENUM('pending', 'running', 'completed', 'failed', 'scheduled') DEFAULT 'pending'
-                    """)
-                    print("✅ 已添加 scheduled 状态到 async_tasks 表")
-            except Exception as e:
-                print(f"修改 status 枚举失败: {e}")
-            
-            # 创建知识库表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS knowledge_base (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    description TEXT,
-                    username VARCHAR(50) NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_username (username),
-                    INDEX idx_created_at (created_at)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建知识条目表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS knowledge_item (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    knowledge_base_id INT NOT NULL,
-                    title VARCHAR(200) NOT NULL,
-                    content TEXT NOT NULL,
-                    type ENUM('text', 'qa', 'concept', 'procedure') DEFAULT 'text',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    INDEX idx_knowledge_base_id (knowledge_base_id),
-                    INDEX idx_type (type),
-                    INDEX idx_created_at (created_at),
-                    FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_base(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # 创建知识关系表
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS knowledge_relation (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    knowledge_base_id INT NOT NULL,
-                    source_item_id INT DEFAULT NULL,
-                    target_item_id INT NOT NULL,
-                    relation_type ENUM('related', 'parent', 'child', 'similar', 'tag') DEFAULT 'related',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_knowledge_base_id (knowledge_base_id),
-                    INDEX idx_source_item_id (source_item_id),
-                    INDEX idx_target_item_id (target_item_id),
-                    FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_base(id) ON DELETE CASCADE,
-                    FOREIGN KEY (source_item_id) REFERENCES knowledge_item(id) ON DELETE CASCADE,
-                    FOREIGN KEY (target_item_id) REFERENCES knowledge_item(id) ON DELETE CASCADE
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            conn.commit()
-            print("✅ 数据库表初始化完成")
 
 # 初始化技能注册表
 skill_registry = register_all_skills()
@@ -609,6 +240,12 @@ def send_email():
         if not smtp_user or not smtp_password:
             return jsonify({'success': False, 'error': '邮件服务器未配置'})
         
+        import smtplib
+        from email import encoders
+        from email.mime.base import MIMEBase
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
         msg = MIMEMultipart()
         msg['From'] = smtp_from
         msg['To'] = to_email
@@ -816,6 +453,109 @@ def redirect_shorturl(code):
     except:
         return "短链接不存在", 404
 
+def content_cache_key(endpoint, model, system_prompt, user_template, args, params):
+    """内容生成结果的缓存键（流式和非流式共用）"""
+    return make_cache_key(endpoint, model, '\x1f'.join(args),
+                          prompt_version(system_prompt, user_template, params))
+
+def generate_cached_content(endpoint, system_prompt, user_template, *args, model="deepseek-chat",
+                            timeout=60.0, **params):
+    """调用大模型生成内容，结果按 (接口, 模型, 规范化输入, 提示词版本) 缓存
+
+    Args:
+        endpoint: 接口标识
+        system_prompt: 系统提示词
+        user_template: 用户消息模板，用 args 填充
+        args: 用户输入（规范化后作为缓存键的一部分）
+        timeout: 请求超时（秒）
+        params: 其余生成参数（temperature、max_tokens 等），计入提示词版本
+    """
+    key = content_cache_key(endpoint, model, system_prompt, user_template, args, params)
+
+    def compute():
+        response = chat_completion(
+            model=model,
+            base_url="https://api.deepseek.com",
+            api_key=OPENAI_API_KEY,
+            timeout=timeout,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_template.format(*args)}
+            ],
+            **params
+        )
+        return response.choices[0].message.content
+
+    return response_cache.get_or_compute(key, compute)
+
+def stream_requested():
+    """请求是否要求以 SSE 流式返回（?stream=1）"""
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def stream_content(endpoint, system_prompt, user_template, *args, model="deepseek-chat",
+                   timeout=60.0, cache=True, **params):
+    """以 SSE 流式返回大模型生成的内容，事件格式与 /api/chat 相同：
+    {"content": 增量文本}、{"done": true}、{"error": 错误信息}
+
+    Args:
+        endpoint: 接口标识
+        system_prompt: 系统提示词
+        user_template: 用户消息模板，用 args 填充
+        args: 用户输入
+        timeout: 请求超时（秒）
+        cache: 是否与 generate_cached_content 共用响应缓存（命中时一次性输出缓存内容）
+        params: 其余生成参数（temperature、max_tokens 等）
+    """
+    key = content_cache_key(endpoint, model, system_prompt, user_template, args, params) if cache else None
+
+    def generate():
+        try:
+            cached = response_cache.get(key) if key else None
+            if cached is not None:
+                yield f"data: {json.dumps({'content': cached})}\n\n"
+                yield f"data: {json.dumps({'done': True})}\n\n"
+                return
+
+            stream = stream_chat_completion(
+                model=model,
+                base_url="https://api.deepseek.com",
+                api_key=OPENAI_API_KEY,
+                timeout=timeout,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_template.format(*args)}
+                ],
+                **params
+            )
+            parts = []
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        parts.append(content)
+                        yield f"data: {json.dumps({'content': content})}\n\n"
+            finally:
+                # 客户端断开时生成器被关闭，及时释放上游连接和并发名额
+                stream.close()
+
+            if key and parts:
+                response_cache.set(key, ''.join(parts))
+            yield f"data: {json.dumps({'done': True})}\n\n"
+
+        except Exception as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 LINUX_COMMAND_PROMPT = """你是一个Linux命令专家，擅长介绍各种Linux命令的用法、选项和示例。
 
 用户会输入一个Linux命令名称或相关关键词，你需要提供该命令的详细信息，包括：
@@ -839,25 +579,17 @@ def linux_query():
     if not command:
         return jsonify({'success': False, 'error': '请输入命令名称'})
     
-    try:
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
-            base_url="https://api.deepseek.com",
-            timeout=60.0,
-            max_retries=2
+    if stream_requested():
+        return stream_content(
+            'linux_query', LINUX_COMMAND_PROMPT, "请介绍 Linux 命令「{}」的用法", command,
+            timeout=60.0, temperature=0.7, max_tokens=2000
         )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": LINUX_COMMAND_PROMPT},
-                {"role": "user", "content": f"请介绍 Linux 命令「{command}」的用法"}
-            ],
-            temperature=0.7,
-            max_tokens=2000
+    
+    try:
+        result = generate_cached_content(
+            'linux_query', LINUX_COMMAND_PROMPT, "请介绍 Linux 命令「{}」的用法", command,
+            timeout=60.0, temperature=0.7, max_tokens=2000
         )
-        
-        result = response.choices[0].message.content
         return jsonify({'success': True, 'content': result})
     
     except Exception as e:
@@ -895,25 +627,17 @@ def git_query():
     if not command:
         return jsonify({'success': False, 'error': '请输入命令名称'})
     
-    try:
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
-            base_url="https://api.deepseek.com",
-            timeout=60.0,
-            max_retries=2
+    if stream_requested():
+        return stream_content(
+            'git_query', GIT_COMMAND_PROMPT, "请介绍 Git 命令「{}」的用法", command,
+            timeout=60.0, temperature=0.7, max_tokens=2000
         )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": GIT_COMMAND_PROMPT},
-                {"role": "user", "content": f"请介绍 Git 命令「{command}」的用法"}
-            ],
-            temperature=0.7,
-            max_tokens=2000
+    
+    try:
+        result = generate_cached_content(
+            'git_query', GIT_COMMAND_PROMPT, "请介绍 Git 命令「{}」的用法", command,
+            timeout=60.0, temperature=0.7, max_tokens=2000
         )
-        
-        result = response.choices[0].message.content
         return jsonify({'success': True, 'content': result})
     
     except Exception as e:
@@ -1169,6 +893,8 @@ def image_convert():
         return jsonify({'success': False, 'error': '不支持的图片格式'})
     
     try:
+        from PIL import Image
+
         image = Image.open(file)
         if image.mode == 'RGBA' and target_format in ['JPEG', 'JPG']:
             background = Image.new('RGB', image.size, (255, 255, 255))
@@ -1205,6 +931,8 @@ def image_to_pdf():
         return jsonify({'success': False, 'error': '不支持的图片格式'})
     
     try:
+        from PIL import Image
+
         image = Image.open(file)
         if image.mode == 'RGBA':
             background = Image.new('RGB', image.size, (255, 255, 255))
@@ -1358,12 +1086,12 @@ def voice_recognize():
     if not allowed_audio_file(file.filename):
         return jsonify({'success': False, 'error': '不支持的音频格式'})
     
+    import openai
+
     try:
         if not OPENAI_API_KEY:
             return jsonify({'success': False, 'error': '未配置 OpenAI API Key'})
         
-        client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
-        
         temp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp')
         os.makedirs(temp_dir, exist_ok=True)
         
@@ -1373,12 +1101,19 @@ def voice_recognize():
         input_path = os.path.join(temp_dir, input_filename)
         file.save(input_path)
         
+        # 读入内存，网关重试时可以重新发送
         with open(input_path, 'rb') as audio_file:
-            transcript = client.audio.transcriptions.create(
+            audio_bytes = audio_file.read()
+        transcript = llm_call(
+            "whisper-1",
+            lambda client: client.audio.transcriptions.create(
                 model="whisper-1",
-                file=audio_file,
+                file=(input_filename, audio_bytes),
                 language="zh"
-            )
+            ),
+            base_url=OPENAI_BASE_URL,
+            api_key=OPENAI_API_KEY
+        )
         
         os.remove(input_path)
         
@@ -1441,25 +1176,17 @@ def recipe_generate():
     if not dish_name:
         return jsonify({'success': False, 'error': '请输入菜名'})
     
-    try:
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
-            base_url="https://api.deepseek.com",
-            timeout=120.0,
-            max_retries=2
+    if stream_requested():
+        return stream_content(
+            'recipe_generate', RECIPE_SYSTEM_PROMPT, "请生成菜名「{}」的详细制作步骤，以表格形式呈现", dish_name,
+            timeout=120.0, temperature=0.7, max_tokens=2000
         )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": RECIPE_SYSTEM_PROMPT},
-                {"role": "user", "content": f"请生成菜名「{dish_name}」的详细制作步骤，以表格形式呈现"}
-            ],
-            temperature=0.7,
-            max_tokens=2000
+    
+    try:
+        result = generate_cached_content(
+            'recipe_generate', RECIPE_SYSTEM_PROMPT, "请生成菜名「{}」的详细制作步骤，以表格形式呈现", dish_name,
+            timeout=120.0, temperature=0.7, max_tokens=2000
         )
-        
-        result = response.choices[0].message.content
         return jsonify({'success': True, 'content': result})
     
     except Exception as e:
@@ -1481,16 +1208,18 @@ def weibo_generate():
     if not keyword:
         return jsonify({'success': False, 'error': '请输入关键词或主题'})
     
+    if stream_requested():
+        return stream_content(
+            'weibo_generate', MICRO_HEADLINE_SYSTEM_PROMPT, "请为以下主题生成微头条文案：{}", keyword,
+            cache=False, timeout=60.0, temperature=0.8, max_tokens=1000
+        )
+    
     try:
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
+        response = chat_completion(
+            model="deepseek-chat",
             base_url="https://api.deepseek.com",
+            api_key=OPENAI_API_KEY,
             timeout=60.0,
-            max_retries=2
-        )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
             messages=[
                 {"role": "system", "content": MICRO_HEADLINE_SYSTEM_PROMPT},
                 {"role": "user", "content": f"请为以下主题生成微头条文案：{keyword}"}
@@ -1555,16 +1284,18 @@ def wechat_generate():
     if not trends:
         return jsonify({'success': False, 'error': '请输入热门趋势'})
     
+    if stream_requested():
+        return stream_content(
+            'wechat_generate', WECHAT_SYSTEM_PROMPT, "请为以下领域和趋势生成微信公众号文章：\n\n细分领域：{}\n热门趋势：{}",
+            niche, trends, cache=False, timeout=180.0, temperature=0.8, max_tokens=4000
+        )
+    
     try:
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
+        response = chat_completion(
+            model="deepseek-chat",
             base_url="https://api.deepseek.com",
+            api_key=OPENAI_API_KEY,
             timeout=180.0,
-            max_retries=2
-        )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
             messages=[
                 {"role": "system", "content": WECHAT_SYSTEM_PROMPT},
                 {"role": "user", "content": f"请为以下领域和趋势生成微信公众号文章：\n\n细分领域：{niche}\n热门趋势：{trends}"}
@@ -1622,16 +1353,18 @@ def naming_generate():
     if birth_time:
         user_content += f"，出生时辰：{birth_time}"
     
+    if stream_requested():
+        return stream_content(
+            'naming_generate', NAMING_SYSTEM_PROMPT, "{}", user_content,
+            cache=False, timeout=120.0, temperature=0.8, max_tokens=2000
+        )
+    
     try:
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
+        response = chat_completion(
+            model="deepseek-chat",
             base_url="https://api.deepseek.com",
+            api_key=OPENAI_API_KEY,
             timeout=120.0,
-            max_retries=2
-        )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
             messages=[
                 {"role": "system", "content": NAMING_SYSTEM_PROMPT},
                 {"role": "user", "content": user_content}
@@ -1711,10 +1444,6 @@ def http_request_proxy():
     except requests.exceptions.RequestException as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-CLASSIC_SYSTEM_PROMPT = """你是一个中国传统文化专家，擅长解读经典古籍。你的任务是用通俗易懂的语言解读三字经、千字文等传统启蒙经典，帮助用户理解其含义、教育思想和历史价值。
-
-输出格式请使用Markdown，方便前端渲染显示。"""
-
 @app.route('/sanzijing')
 def sanzijing_tool():
     """三字经页面"""
@@ -1738,26 +1467,17 @@ def classic_analyze():
     
     classic_name = '三字经' if classic == 'sanzijing' else '千字文'
     
+    # 优先使用离线预生成的解读（见 classic_store.py），没有再实时生成
+    result = classic_store.get(classic_name, user_content)
+    if result is not None:
+        return jsonify({'success': True, 'content': result, 'source': 'store'})
+
     try:
-        client = openai.OpenAI(
-            api_key=OPENAI_API_KEY,
-            base_url="https://api.deepseek.com",
-            timeout=120.0,
-            max_retries=2
+        result = generate_cached_content(
+            'classic_analyze', CLASSIC_SYSTEM_PROMPT, CLASSIC_USER_TEMPLATE, classic_name, user_content,
+            model=CLASSIC_MODEL, timeout=120.0, **CLASSIC_GENERATION_PARAMS
         )
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": CLASSIC_SYSTEM_PROMPT},
-                {"role": "user", "content": f"关于{classic_name}：{user_content}"}
-            ],
-            temperature=0.7,
-            max_tokens=2000
-        )
-        
-        result = response.choices[0].message.content
-        return jsonify({'success': True, 'content': result})
+        return jsonify({'success': True, 'content': result, 'source': 'live'})
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -2129,6 +1849,8 @@ def update_user_profile():
                 """, profile_data)
                 conn.commit()
         
+        chat_context_cache.invalidate(username)
+        
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -2166,6 +1888,8 @@ def update_user_preferences():
                 """, pref_data)
                 conn.commit()
         
+        chat_context_cache.invalidate(username)
+        
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -2297,12 +2021,11 @@ def delete_preset_group(group_id):
         
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute("SELECT id FROM preset_groups WHERE id = %s AND username = %s", (group_id, username))
-                if not cursor.fetchone():
+                cursor.execute("DELETE FROM preset_groups WHERE id = %s AND username = %s", (group_id, username))
+                if cursor.rowcount == 0:
                     return jsonify({'error': '分组不存在'}), 404
                 
                 cursor.execute("DELETE FROM preset_items WHERE group_id = %s", (group_id,))
-                cursor.execute("DELETE FROM preset_groups WHERE id = %s", (group_id,))
                 conn.commit()
         
         return jsonify({'success': True})
@@ -2398,15 +2121,14 @@ def delete_preset_item(item_id):
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute("""
-                    SELECT pi.id FROM preset_items pi
+                    DELETE pi FROM preset_items pi
                     JOIN preset_groups pg ON pi.group_id = pg.id
                     WHERE pi.id = %s AND pi.username = %s
                 """, (item_id, username))
-                if not cursor.fetchone():
-                    return jsonify({'error': '预设项不存在'}), 404
-                
-                cursor.execute("DELETE FROM preset_items WHERE id = %s", (item_id,))
                 conn.commit()
+                
+                if cursor.rowcount == 0:
+                    return jsonify({'error': '预设项不存在'}), 404
         
         return jsonify({'success': True})
     except Exception as e:
@@ -2723,35 +2445,354 @@ def get_theme_vars_json():
         'css_vars': THEME_CSS_VARS.get(theme, THEME_CSS_VARS['dark'])
     })
 
-def get_user_conversations(username):
-    """获取用户的所有对话ID列表"""
+def read_conversation_messages(conversation_id, username):
+    """读取数据库中对话的全部消息，对话不存在或不属于该用户时返回 None
+
+    归属校验与读取合并为一次查询：先走 uk_user_conv 定位对话头，再按 seq 取消息。
+    分支对话再沿父对话链物化继承的消息。
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT DISTINCT conversation_id FROM conversations WHERE username = %s", (username,))
-            results = cursor.fetchall()
-            return [row['conversation_id'] for row in results]
+            cursor.execute(
+                "SELECT c.parent_conversation_id, c.fork_seq, cm.message FROM conversations c "
+                "LEFT JOIN conversation_messages cm "
+                "ON cm.username = c.username AND cm.conversation_id = c.conversation_id "
+                "WHERE c.username = %s AND c.conversation_id = %s ORDER BY cm.seq",
+                (username, conversation_id)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                return None
+            if rows[0]['parent_conversation_id'] and rows[0]['fork_seq']:
+                return read_branch_messages(cursor, username, load_chain(cursor, username, conversation_id))
+    return [json.loads(row['message']) for row in rows if row['message']]
+
+def get_owned_conversation(conversation_id, username):
+    """读取属于该用户的对话消息，对话不存在或不属于该用户时返回 None
+
+    尚未写入数据库的消息（包括其他工作进程的）补在最后（读己之写）。
+    """
+    pending = conversation_writer.pending(conversation_id, username)
+    stored = read_conversation_messages(conversation_id, username)
+    if stored is None and not pending:
+        return None
+    return merge_pending(stored or [], pending)
 
 def get_conversation_from_db(conversation_id, username):
-    """从数据库获取对话"""
+    """从数据库获取对话（按 seq 顺序读取逐条存储的消息，尚未写入的消息补在最后，包括其他工作进程的）"""
+    pending = conversation_writer.pending(conversation_id, username)
+    return merge_pending(read_conversation_messages(conversation_id, username) or [], pending)
+
+def create_conversation_branch(parent_id, username, fork_seq, conversation_id):
+    """从 parent_id 的前 fork_seq 条消息分出新对话 conversation_id
+
+    Returns:
+        None 表示成功，否则为 (错误信息, HTTP 状态码)
+    """
+    # 分支从数据库继承消息：父对话还有未写入的消息（本进程或其他工作进程）时先等它们写入
+    if not conversation_writer.wait_flushed(parent_id, username):
+        print(f"⚠️  对话 {parent_id} 还有消息未写入数据库，分支可能缺少最新的消息")
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT messages FROM conversations WHERE conversation_id = %s AND username = %s", 
-                          (conversation_id, username))
-            result = cursor.fetchone()
-            if result and result['messages']:
-                return json.loads(result['messages'])
-            return []
+            error = create_branch(cursor, username, parent_id, fork_seq, conversation_id)
+            if error:
+                conn.rollback()
+                return error
+        conn.commit()
+    print(f"[Chat] 对话 {conversation_id} 从 {parent_id} 的第 {fork_seq} 条消息处分支")
+    return None
+
+def get_conversation_history_ranges(conversation_id, username):
+    """对话历史由哪些对话的哪些 seq 区间组成：[(对话, 起始 seq, 结束 seq)]
+
+    分支沿父对话链继承消息，继承的轮次在长期记忆中记在父对话名下。对话还不存在时只有它自己。
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            chain = load_chain(cursor, username, conversation_id)
+    return branch_ranges(chain) or [(conversation_id, 0, None)]
 
-def save_conversation_to_db(conversation_id, username, messages):
-    """保存对话到数据库"""
+def get_conversation_context_summary(conversation_id, username):
+    """获取对话的滚动摘要：(摘要, 摘要覆盖到的消息条数)"""
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(
-                "INSERT INTO conversations (conversation_id, username, messages) VALUES (%s, %s, %s) "
-                "ON DUPLICATE KEY UPDATE messages = %s, updated_at = CURRENT_TIMESTAMP",
-                (conversation_id, username, json.dumps(messages, ensure_ascii=False), json.dumps(messages, ensure_ascii=False))
+                "SELECT summary, summary_upto FROM conversations WHERE username = %s AND conversation_id = %s",
+                (username, conversation_id)
             )
+            row = cursor.fetchone()
+    if not row or not row['summary']:
+        return None, 0
+    return row['summary'], row['summary_upto']
+
+CONVERSATION_SUMMARY_PROMPT = """你负责压缩一段较早的对话，供后续对话作为背景参考。
+请把【已有摘要】与【新增对话】合并成一份新的摘要，要求：
+1. 保留用户的目标、偏好、已确认的事实、结论以及未完成的事项
+2. 去掉寒暄和重复内容，不要编造对话中没有的信息
+3. 使用中文，条理清晰，不超过 400 字
+只输出摘要正文。"""
+
+def update_conversation_context_summary(conversation_id, username, model, previous_summary,
+                                        summary_upto, dropped_messages):
+    """把被挤出上下文窗口的消息并入对话摘要（在后台线程中执行）"""
+    try:
+        response = chat_completion(
+            model=model,
+            messages=[
+                {'role': 'system', 'content': CONVERSATION_SUMMARY_PROMPT},
+                {'role': 'user', 'content': f"【已有摘要】\n{previous_summary or '无'}\n\n"
+                                            f"【新增对话】\n{format_messages_for_summary(dropped_messages)}"}
+            ],
+            temperature=0.3,
+            max_tokens=800
+        )
+        summary = (response.choices[0].message.content or '').strip()
+        if not summary:
+            return
+
+        new_upto = summary_upto + len(dropped_messages)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                # 只前进不后退：并发的两轮请求以覆盖范围更大的摘要为准
+                cursor.execute(
+                    "UPDATE conversations SET summary = %s, summary_upto = %s, updated_at = updated_at "
+                    "WHERE username = %s AND conversation_id = %s AND summary_upto < %s",
+                    (summary, new_upto, username, conversation_id, new_upto)
+                )
             conn.commit()
+        print(f"[Chat] 对话 {conversation_id} 摘要已更新，覆盖前 {new_upto} 条消息")
+    except Exception as e:
+        print(f"⚠️  更新对话摘要失败: {e}")
+
+def _conversation_summary(messages):
+    """从新消息中提取列表摘要：(标题, 预览)"""
+    first_user = next((m for m in messages if m.get('role') == 'user'), None)
+    last_visible = next((m for m in reversed(messages)
+                         if m.get('role') in ('user', 'assistant') and m.get('content')), None)
+    title = first_user['content'][:50] if first_user else None
+    preview = last_visible['content'][:100] if last_visible else None
+    return title, preview
+
+def _stored_prefix(cursor, conversation_id, username, messages, base_seq, next_seq):
+    """messages 从 base_seq 开始编号时，开头有多少条已经在数据库里
+
+    数据库中 base_seq 之后的消息与 messages 开头一致时（重放已写入的条目）跳过这部分；
+    内容不同说明这些 seq 已被其他请求占用，返回 0，messages 整体追加到末尾。
+    """
+    overlap = min(next_seq - base_seq, len(messages))
+    if overlap <= 0:
+        return 0
+    cursor.execute(
+        "SELECT message FROM conversation_messages "
+        "WHERE username = %s AND conversation_id = %s AND seq >= %s AND seq < %s ORDER BY seq",
+        (username, conversation_id, base_seq, base_seq + overlap)
+    )
+    stored = [json.loads(row['message']) for row in cursor.fetchall()]
+    if stored == [json.loads(json.dumps(msg, ensure_ascii=False)) for msg in messages[:overlap]]:
+        return overlap
+    print(f"⚠️  对话 {conversation_id} 从第 {base_seq} 条起已被其他请求写入，本轮消息追加到第 {next_seq} 条之后")
+    return 0
+
+def save_conversation_to_db(conversation_id, username, messages, stored_count=None, base_seq=None):
+    """保存对话到数据库（只追加新消息，并维护对话列表摘要列）
+
+    Args:
+        messages: 对话消息列表
+        stored_count: messages 中前多少条已经在数据库里；为 None 时视 messages 为完整历史，
+            以数据库中已有的条数为准
+        base_seq: messages[0] 的 seq；指定时跳过数据库中已有且内容相同的部分（重放 WAL 时保证不重复写入），
+            数据库的消息条数不足 base_seq 时抛出 SequenceGapError
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            # 写对话头，同时锁住该行，保证并发追加时 seq 不冲突
+            cursor.execute(
+                "INSERT INTO conversations (conversation_id, username) VALUES (%s, %s) "
+                "ON DUPLICATE KEY UPDATE updated_at = CURRENT_TIMESTAMP",
+                (conversation_id, username)
+            )
+            cursor.execute(
+                "SELECT message_count FROM conversations WHERE username = %s AND conversation_id = %s FOR UPDATE",
+                (username, conversation_id)
+            )
+            next_seq = cursor.fetchone()['message_count']
+            if base_seq is not None:
+                if next_seq < base_seq:
+                    # 之前的消息还没有写入（可能还在其他进程的延迟写入队列中），由调用方稍后重试
+                    conn.rollback()
+                    raise SequenceGapError(next_seq, base_seq)
+                stored_count = _stored_prefix(cursor, conversation_id, username, messages, base_seq, next_seq)
+            elif stored_count is None:
+                stored_count = next_seq
+
+            new_messages = messages[stored_count:]
+            if new_messages:
+                cursor.executemany(
+                    "INSERT INTO conversation_messages (conversation_id, username, seq, role, message) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    [(conversation_id, username, next_seq + i, msg.get('role', ''),
+                      json.dumps(msg, ensure_ascii=False))
+                     for i, msg in enumerate(new_messages)]
+                )
+                title, preview = _conversation_summary(new_messages)
+                cursor.execute(
+                    "UPDATE conversations SET message_count = %s, title = COALESCE(title, %s), "
+                    "preview = COALESCE(%s, preview), last_message_at = CURRENT_TIMESTAMP "
+                    "WHERE username = %s AND conversation_id = %s",
+                    (next_seq + len(new_messages), title, preview, username, conversation_id)
+                )
+            conn.commit()
+
+# 延迟写入的条目由后台线程按对话合并后调用这里按 base_seq 写入数据库（追加到末尾时 base_seq 为 None）
+conversation_writer.configure(
+    lambda conversation_id, username, messages, base_seq: save_conversation_to_db(
+        conversation_id, username, messages, stored_count=0 if base_seq is None else None, base_seq=base_seq
+    )
+)
+
+def load_agent_chat_context(agent_id, username):
+    """解析 Agent 对应的模型和系统提示词（Agent 不存在时返回 None）"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT a.model, a.system_prompt, a.prompt_id, p.content AS prompt_content "
+                "FROM agents a LEFT JOIN prompts p ON p.id = a.prompt_id AND p.username = a.username "
+                "WHERE a.id = %s AND a.username = %s",
+                (agent_id, username)
+            )
+            agent = cursor.fetchone()
+    if not agent:
+        return None
+    
+    print(f'[Chat] agent.system_prompt长度={len(agent.get("system_prompt") or "")}, prompt_id={agent.get("prompt_id")}')
+    system_prompt = None
+    if agent.get('system_prompt'):
+        system_prompt = agent['system_prompt']
+        print(f'[Chat] 使用agent.system_prompt')
+    elif agent.get('prompt_content'):
+        system_prompt = agent['prompt_content']
+        print(f'[Chat] 通过prompt_id={agent.get("prompt_id")}获取提示词')
+    return {'model': agent.get('model'), 'system_prompt': system_prompt}
+
+# 工具路由参考的最近历史消息条数
+RECENT_ROUTING_MESSAGES = 6
+
+def get_chat_tools_for_user(username):
+    """生成用户启用技能的 tools 数组（OpenAI Function Calling 格式）"""
+    tools = []
+    # 按名称排序：工具定义属于提示词前缀的一部分，顺序不随技能目录的遍历顺序变化
+    for skill_name in sorted(get_enabled_skills_for_user(username)):
+        skill = skill_registry.get_skill(skill_name)
+        if skill:
+            tools.append({
+                "type": "function",
+                "function": skill.to_function_definition()
+            })
+    return tools
+
+def chat_stream_response(job, last_event_id=0, reused=False):
+    """以 SSE 返回流式任务的事件（每个事件带 id，断线后可用 Last-Event-ID 续传）
+
+    不使用 stream_with_context：请求上下文随视图返回而结束，数据库连接随即归还连接池，
+    任务本身在后台线程中运行，客户端断开只结束读取。
+    reused 为 True 表示接上了对话中已在运行的任务，本次请求的消息没有发送。
+    """
+    headers = {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        'X-Chat-Job-Id': job.id
+    }
+    if reused:
+        headers['X-Chat-Job-Reused'] = '1'
+    return Response(
+        stream_jobs.sse(job, last_event_id),
+        mimetype='text/event-stream',
+        headers=headers
+    )
+
+def parse_compare_models(value):
+    """校验对比模式的模型列表：(去重后的模型列表, 错误信息)"""
+    if not isinstance(value, list) or not all(isinstance(model, str) and model for model in value):
+        return None, 'models 必须是模型名称列表'
+    models = list(dict.fromkeys(value))
+    if not models:
+        return None, 'models 不能为空'
+    if len(models) > CHAT_COMPARE_MAX_MODELS:
+        return None, f'一次最多对比 {CHAT_COMPARE_MAX_MODELS} 个模型'
+    known = {item['id'] for item in AVAILABLE_MODELS}
+    unknown = [model for model in models if model not in known]
+    if unknown:
+        return None, f'不支持的模型: {", ".join(unknown)}'
+    return models, None
+
+def generate_compare_response(conversation_id, username, models, messages, context_count, stored_count,
+                              context_summary, summary_upto, memories):
+    """对比模式：同一份上下文并发发给多个模型，文本事件带 model 字段
+
+    不发送 tools：技能可能有副作用（发邮件、写 Redis 等），不能让每个模型各执行一遍。
+    按请求顺序第一个成功的模型的回答作为本轮回复保存，全部模型的回答和耗时记在 compare 字段中。
+    """
+    turn_seq = len(messages) - context_count - 1
+    
+    # 取各模型预算中最小的一个，所有模型看到完全相同的上下文
+    window = build_context_window(
+        system_messages=messages[:context_count],
+        history=messages[context_count:-1],
+        current=messages[-1],
+        budget=min(get_context_budget(model) for model in models),
+        summary=context_summary,
+        summary_upto=summary_upto,
+        compact_ratio=CHAT_CONTEXT_COMPACT_RATIO,
+        recall=format_memories(memories)
+    )
+    context_stats = window.stats
+    context_stats['models'] = models
+    context_stats['memories'] = len(memories)
+    yield {'context': context_stats}
+    
+    fan_out = ModelFanOut(models, lambda model: StreamedCompletion(stream_chat_completion(
+        model=model,
+        messages=window.messages,
+        stream_options={'include_usage': True},
+        temperature=0.7,
+        max_tokens=2000
+    )))
+    yield from fan_out
+    yield {'compare': {
+        'models': [fan_out.summary(result) for result in fan_out.results],
+        'wall_ms': fan_out.wall_ms,
+        'sequential_ms': fan_out.sequential_ms
+    }}
+    
+    answered = [result for result in fan_out.results if result['content'] and not result['error']]
+    if not answered:
+        raise RuntimeError('所有模型都没有返回回答: ' + '; '.join(
+            f"{result['model']}: {result['error'] or '空回复'}" for result in fan_out.results))
+    primary = answered[0]
+    
+    conversation_writer.append(conversation_id, username, stored_count, messages[context_count + stored_count:] + [{
+        'role': 'assistant',
+        'content': primary['content'],
+        'model': primary['model'],
+        'compare': [{key: result[key] for key in ('model', 'content', 'ttft_ms', 'latency_ms', 'error')}
+                    for result in fan_out.results],
+        'timestamp': datetime.now().isoformat()
+    }])
+    threading.Thread(
+        target=conversation_memory.add_turn,
+        args=(username, conversation_id, turn_seq, messages[-1]['content'], primary['content']),
+        daemon=True
+    ).start()
+    
+    if window.needs_summary_update(summary_upto):
+        threading.Thread(
+            target=update_conversation_context_summary,
+            args=(conversation_id, username, primary['model'], context_summary, summary_upto,
+                  messages[context_count + summary_upto:context_count + window.cut]),
+            daemon=True
+        ).start()
+    
+    yield {'done': True}
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
@@ -2766,254 +2807,281 @@ def chat():
         model = data.get('model', 'deepseek-chat')
         agent_id = data.get('agent_id')
         system_prompt = data.get('system_prompt', '')
+        regenerate = bool(data.get('regenerate'))
         username = session['username']
         
-        if not message:
+        if not message and not regenerate:
             return jsonify({'error': '消息不能为空'}), 400
         
+        # 对比模式：models 为模型列表时同时请求多个模型（忽略 model 和 Agent 的模型）
+        compare_models = None
+        if data.get('models') is not None:
+            compare_models, error = parse_compare_models(data['models'])
+            if error:
+                return jsonify({'error': error}), 400
+            if len(compare_models) == 1:
+                model, compare_models = compare_models[0], None
+        
+        # 对话已有回答在生成（如客户端断线后重发）：接上正在运行的任务，不再叠加一次生成
+        running_job = stream_jobs.running(username, conversation_id)
+        if running_job is not None:
+            print(f"[Chat] 对话 {conversation_id} 已有任务 {running_job.id} 在运行，接上该任务")
+            return chat_stream_response(running_job, reused=True)
+        stream_jobs.check_limits(username)
+        
+        # 分支：conversation_id 作为新对话，继承 fork_from 对话的前 fork_seq 条消息（编辑之前的消息、重新生成回答）
+        if data.get('fork_from'):
+            fork_seq = data.get('fork_seq')
+            if not isinstance(fork_seq, int) or isinstance(fork_seq, bool) or fork_seq < 0:
+                return jsonify({'error': 'fork_seq 必须是非负整数'}), 400
+            error = create_conversation_branch(data['fork_from'], username, fork_seq, conversation_id)
+            if error:
+                return jsonify({'error': error[0]}), error[1]
+        
         # 如果有agent_id，获取Agent信息
         print(f'[Chat] agent_id={agent_id}, 前端system_prompt长度={len(system_prompt)}')
         if agent_id:
-            with get_db_connection() as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute(
-                        "SELECT * FROM agents WHERE id = %s AND username = %s",
-                        (agent_id, username)
-                    )
-                    agent = cursor.fetchone()
-                    if agent:
-                        model = agent.get('model', model)
-                        print(f'[Chat] agent.system_prompt长度={len(agent.get("system_prompt", ""))}, prompt_id={agent.get("prompt_id")}')
-                        if agent.get('system_prompt'):
-                            system_prompt = agent['system_prompt']
-                            print(f'[Chat] 使用agent.system_prompt')
-                        elif agent.get('prompt_id'):
-                            cursor.execute(
-                                "SELECT content FROM prompts WHERE id = %s AND username = %s",
-                                (agent['prompt_id'], username)
-                            )
-                            prompt = cursor.fetchone()
-                            if prompt:
-                                system_prompt = prompt['content']
-                                print(f'[Chat] 通过prompt_id={agent.get("prompt_id")}获取提示词')
+            agent_context = chat_context_cache.get_or_load(
+                username, f'agent:{agent_id}', lambda: load_agent_chat_context(agent_id, username)
+            )
+            if agent_context:
+                if not data.get('models'):
+                    model = agent_context['model'] or model
+                if agent_context['system_prompt']:
+                    system_prompt = agent_context['system_prompt']
         
         # 获取对话历史
-        messages = get_conversation_from_db(conversation_id, username)
+        stored_messages = get_conversation_from_db(conversation_id, username)
+        stored_count = len(stored_messages)
+        context_summary, summary_upto = get_conversation_context_summary(conversation_id, username)
+        
+        # 重新生成：回答对话中最后一条用户消息，不再追加新的用户消息
+        if regenerate:
+            if not stored_messages or stored_messages[-1].get('role') != 'user':
+                return jsonify({'error': '对话的最后一条不是用户消息，无法重新生成'}), 400
+            message = stored_messages[-1]['content']
+        
+        # 从用户的其他对话中召回与本轮消息相关的片段；分支继承自父对话链的轮次已在历史中，不召回
+        memories = []
+        if conversation_memory.enabled:
+            memories = conversation_memory.search(
+                username, message, exclude_ranges=get_conversation_history_ranges(conversation_id, username)
+            )
         
         # 获取用户信息并注入到context中
-        user_info = get_user_info_for_context(username)
-        if user_info:
-            messages.insert(0, {
-                'role': 'system',
-                'content': user_info,
-                'timestamp': datetime.now().isoformat()
-            })
+        user_info = chat_context_cache.get_or_load(
+            username, 'user_info', lambda: get_user_info_for_context(username)
+        )
+        
+        # 按固定顺序组装：系统/Agent 提示词、用户信息、（摘要）、历史、本轮消息。
+        # 前面的部分在多轮之间逐字节不变，支持前缀缓存的提供方（如 DeepSeek）可以直接复用
+        context_messages = [{'role': 'system', 'content': content} for content in (system_prompt, user_info) if content]
+        messages = context_messages + stored_messages
         
-        # 如果有system_prompt，添加到消息开头
-        if system_prompt:
-            messages.insert(0, {
-                'role': 'system',
-                'content': system_prompt,
+        # 注入的上下文只用于本轮请求，不写回对话历史
+        context_count = len(context_messages)
+        
+        # 添加用户消息
+        if not regenerate:
+            messages.append({
+                'role': 'user',
+                'content': message,
                 'timestamp': datetime.now().isoformat()
             })
         
-        # 添加用户消息
-        messages.append({
-            'role': 'user',
-            'content': message,
-            'timestamp': datetime.now().isoformat()
-        })
+        # 本轮用户消息的 seq（长期记忆按它去重）
+        turn_seq = len(messages) - context_count - 1
+        
+        if compare_models:
+            job = stream_jobs.start(username, lambda: generate_compare_response(
+                conversation_id, username, compare_models, messages, context_count, stored_count,
+                context_summary, summary_upto, memories
+            ), conversation_id=conversation_id)
+            return chat_stream_response(job)
         
-        # 调用 AI API (流式)
+        # 调用 AI API (流式)：作为后台任务运行，与 HTTP 连接解耦，断线后可用 Last-Event-ID 续传
         def generate():
-            try:
-                # 根据模型选择 API 地址
-                if model.startswith('deepseek'):
-                    base_url = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com/v1')
-                else:
-                    base_url = OPENAI_BASE_URL
-                
-                # 创建 OpenAI 客户端
-                client = openai.OpenAI(
-                    api_key=OPENAI_API_KEY,
-                    base_url=base_url,
-                    timeout=60.0,
-                    max_retries=2
-                )
-                
-                # 准备消息格式
-                api_messages = [
-                    {'role': msg['role'], 'content': msg['content']}
-                    for msg in messages
-                    if msg['role'] in ['system', 'user', 'assistant']
-                ]
-                
-                # 获取用户启用的技能函数定义
-                enabled_skills = get_enabled_skills_for_user(username)
-                tools = []
-                for skill_name in enabled_skills:
-                    skill = skill_registry.get_skill(skill_name)
-                    if skill:
-                        tools.append({
-                            "type": "function",
-                            "function": skill.to_function_definition()
-                        })
-                
-                # 第一次 API 调用（可能触发 function calling）
-                response = client.chat.completions.create(
+            # 按模型的 token 预算组装上下文，放不下的早期对话由摘要代替
+            window = build_context_window(
+                system_messages=messages[:context_count],
+                history=messages[context_count:-1],
+                current=messages[-1],
+                budget=get_context_budget(model),
+                summary=context_summary,
+                summary_upto=summary_upto,
+                compact_ratio=CHAT_CONTEXT_COMPACT_RATIO,
+                recall=format_memories(memories)
+            )
+            api_messages = window.messages
+            context_stats = window.stats
+            context_stats['memories'] = len(memories)
+            print(f"[Chat] 上下文 {context_stats['used_tokens']}/{context_stats['budget']} tokens，"
+                  f"完整历史 {context_stats['full_tokens']} tokens，节省 {context_stats['saved_tokens']} tokens，"
+                  f"省略 {context_stats['dropped_messages']} 条历史消息，使用摘要: {context_stats['summary_used']}，"
+                  f"召回 {len(memories)} 个历史片段")
+            
+            # 获取用户启用的技能函数定义，只发送与本轮消息相关的部分；
+            # 同一对话的技能集合只增不减、顺序不变，tools 不变时整段历史都能命中提示词缓存
+            all_tools = chat_context_cache.get_or_load(
+                username, 'tools', lambda: get_chat_tools_for_user(username)
+            )
+            history = messages[context_count:-1]
+            tools = tool_router.select(
+                skill_registry, all_tools, message,
+                recent_messages=[m['content'] for m in history[-RECENT_ROUTING_MESSAGES:]
+                                 if m.get('role') == 'user' and m.get('content')],
+                recent_tools=[tc['function']['name'] for m in history[-RECENT_ROUTING_MESSAGES:]
+                              for tc in (m.get('tool_calls') or [])],
+                conversation=(username, conversation_id)
+            )
+            context_stats['tools'] = len(tools)
+            context_stats['tools_total'] = len(all_tools)
+            context_stats['tool_tokens_saved'] = (
+                count_tokens(json.dumps(all_tools, ensure_ascii=False))
+                - count_tokens(json.dumps(tools, ensure_ascii=False))
+            )
+            print(f"[Chat] 发送 {len(tools)}/{len(all_tools)} 个技能定义: "
+                  f"{[t['function']['name'] for t in tools]}，节省 {context_stats['tool_tokens_saved']} tokens")
+            yield {'context': context_stats}
+            
+            # 工具调用循环：每一轮都是流式请求，文本内容边生成边转发，
+            # tool_calls 的增量片段拼接完整后再执行技能，没有 tool_calls 的一轮即为最终回复
+            full_response = ''
+            usage = {'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0, 'rounds': 0}
+            while True:
+                completion = StreamedCompletion(stream_chat_completion(
                     model=model,
                     messages=api_messages,
                     tools=tools if tools else None,
                     tool_choice="auto" if tools else None,
+                    stream_options={'include_usage': True},
                     temperature=0.7,
                     max_tokens=2000
-                )
+                ))
                 
-                # 检查是否需要调用函数
-                response_message = response.choices[0].message
-                tool_calls = response_message.tool_calls
-                full_response = ''
-                
-                # 如果有中间 content，先发送给前端
-                if response_message.content:
-                    yield f"data: {json.dumps({'content': response_message.content})}\n\n"
-                    full_response += response_message.content
-                
-                if tool_calls:
-                    # 保存带 tool_calls 的助手消息到数据库
-                    messages.append({
-                        'role': 'assistant',
-                        'content': full_response,
-                        'tool_calls': [{
-                            'id': tc.id,
-                            'function': {
-                                'name': tc.function.name,
-                                'arguments': tc.function.arguments
-                            }
-                        } for tc in (tool_calls if isinstance(tool_calls, list) else [tool_calls])]
-                    })
-                    
-                    # AI 决定调用技能
-                    api_messages.append(response_message)
-                    
-                    # 循环处理多轮 tool_calls
-                    needs_stream = False
-                    while tool_calls:
-                        # 执行所有被调用的技能
-                        for tool_call in tool_calls:
-                            function_name = tool_call.function.name
-                            function_args = json.loads(tool_call.function.arguments)
-                            function_args['_username'] = username
-                            
-                            # 发送思考过程：正在调用函数
-                            yield f"data: {json.dumps({'thinking': {'type': 'calling_function', 'function': function_name, 'args': function_args}})}\n\n"
-                            
-                            # 执行技能
-                            result = skill_registry.execute_skill(function_name, **function_args)
-                            
-                            # 发送思考过程：函数执行结果
-                            yield f"data: {json.dumps({'thinking': {'type': 'function_result', 'function': function_name, 'result': result}})}\n\n"
-                            
-                            # 将技能执行结果添加到消息中
-                            tool_result_msg = {
-                                "role": "tool",
-                                "tool_call_id": tool_call.id,
-                                "name": function_name,
-                                "content": json.dumps(result, ensure_ascii=False)
-                            }
-                            api_messages.append(tool_result_msg)
-                            messages.append(tool_result_msg)
-                        
-                        # 再次调用 API 获取回复（可能还有更多 tool_calls）
-                        response = client.chat.completions.create(
-                            model=model,
-                            messages=api_messages,
-                            tools=tools if tools else None,
-                            tool_choice="auto" if tools else None,
-                            temperature=0.7,
-                            max_tokens=2000
-                        )
-                        
-                        response_message = response.choices[0].message
-                        tool_calls = response_message.tool_calls
-                        
-                        # 如果没有更多 tool_calls 了，准备使用流式获取最终回复
-                        if not tool_calls:
-                            needs_stream = True
-                            break
-                        
-                        # 还有更多 tool_calls
-                        api_messages.append(response_message)
-                        messages.append({
-                            'role': 'assistant',
-                            'content': response_message.content or '',
-                            'tool_calls': [{
-                                'id': tc.id,
-                                'function': {
-                                    'name': tc.function.name,
-                                    'arguments': tc.function.arguments
-                                }
-                            } for tc in (tool_calls if isinstance(tool_calls, list) else [tool_calls])]
-                        })
-                    
-                    # 使用流式 API 获取最终回复
-                    if needs_stream:
-                        stream = client.chat.completions.create(
-                            model=model,
-                            messages=api_messages,
-                            stream=True,
-                            temperature=0.7,
-                            max_tokens=2000
-                        )
-                        
-                        for chunk in stream:
-                            if chunk.choices[0].delta.content:
-                                content = chunk.choices[0].delta.content
-                                full_response += content
-                                yield f"data: {json.dumps({'content': content})}\n\n"
-                else:
-                    # 没有调用技能，直接流式返回
-                    stream = client.chat.completions.create(
-                        model=model,
-                        messages=api_messages,
-                        stream=True,
-                        temperature=0.7,
-                        max_tokens=2000
-                    )
-                    
-                    for chunk in stream:
-                        if chunk.choices[0].delta.content:
-                            content = chunk.choices[0].delta.content
-                            full_response += content
-                            yield f"data: {json.dumps({'content': content})}\n\n"
+                for content in completion:
+                    full_response += content
+                    yield {'content': content}
+                
+                usage['rounds'] += 1
+                if completion.usage is not None:
+                    usage['prompt_tokens'] += getattr(completion.usage, 'prompt_tokens', 0) or 0
+                    usage['cached_tokens'] += cached_prompt_tokens(completion.usage)
+                    usage['completion_tokens'] += getattr(completion.usage, 'completion_tokens', 0) or 0
+                
+                tool_calls = completion.tool_calls
+                if not tool_calls:
+                    break
                 
-                # 保存完整的助手回复
+                # AI 决定调用技能，保存带 tool_calls 的助手消息
+                api_messages.append({
+                    'role': 'assistant',
+                    'content': completion.content or None,
+                    'tool_calls': tool_calls
+                })
                 messages.append({
                     'role': 'assistant',
-                    'content': full_response,
-                    'timestamp': datetime.now().isoformat()
+                    'content': completion.content,
+                    'tool_calls': tool_calls
                 })
                 
-                # 持久化到数据库
-                save_conversation_to_db(conversation_id, username, messages)
-                
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                # 执行所有被调用的技能：同一轮的多个调用并发执行
+                calls = []
+                for tool_call in tool_calls:
+                    function_name = tool_call['function']['name']
+                    function_args = json.loads(tool_call['function']['arguments'] or '{}')
+                    function_args['_username'] = username
+                    calls.append((function_name, function_args))
+                    
+                    # 发送思考过程：正在调用函数
+                    yield {'thinking': {'type': 'calling_function', 'function': function_name, 'args': function_args, 'tool_call_id': tool_call['id']}}
                 
-            except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-        
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
-            }
-        )
+                results = [None] * len(calls)
+                for index, result in skill_registry.execute_skills(calls):
+                    results[index] = result
+                    
+                    # 发送思考过程：函数执行结果（按完成先后）
+                    yield {'thinking': {'type': 'function_result', 'function': calls[index][0], 'result': result, 'tool_call_id': tool_calls[index]['id']}}
+                
+                # 将技能执行结果按 tool_call 原顺序添加到消息中
+                for tool_call, (function_name, _), result in zip(tool_calls, calls, results):
+                    tool_result_msg = {
+                        "role": "tool",
+                        "tool_call_id": tool_call['id'],
+                        "name": function_name,
+                        "content": json.dumps(result, ensure_ascii=False)
+                    }
+                    api_messages.append(tool_result_msg)
+                    messages.append(tool_result_msg)
+            
+            # 本次请求的 token 用量，cached_tokens 为命中提供方前缀缓存的输入 token
+            print(f"[Chat] 输入 {usage['prompt_tokens']} tokens（缓存命中 {usage['cached_tokens']}），"
+                  f"输出 {usage['completion_tokens']} tokens，共 {usage['rounds']} 轮调用")
+            yield {'usage': usage}
+            
+            # 保存完整的助手回复
+            messages.append({
+                'role': 'assistant',
+                'content': full_response,
+                'timestamp': datetime.now().isoformat()
+            })
+            
+            # 本轮新增的消息写入 WAL 后由后台线程批量写入数据库，done 事件不再等待数据库
+            conversation_writer.append(conversation_id, username, stored_count,
+                                       messages[context_count + stored_count:])
+            
+            # 本轮问答写入长期记忆索引，供以后的其他对话召回
+            threading.Thread(
+                target=conversation_memory.add_turn,
+                args=(username, conversation_id, turn_seq, message, full_response),
+                daemon=True
+            ).start()
+            
+            # 有消息被挤出窗口且尚未并入摘要时，后台更新摘要供下一轮使用
+            if window.needs_summary_update(summary_upto):
+                threading.Thread(
+                    target=update_conversation_context_summary,
+                    args=(conversation_id, username, model, context_summary, summary_upto,
+                          messages[context_count + summary_upto:context_count + window.cut]),
+                    daemon=True
+                ).start()
+            
+            yield {'done': True}
+        
+        job = stream_jobs.start(username, generate, conversation_id=conversation_id)
+        return chat_stream_response(job)
         
+    except StreamJobLimitError as e:
+        return jsonify({'error': str(e)}), 429
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/stream/<job_id>', methods=['GET'])
+def resume_chat_stream(job_id):
+    """断线续传：从 Last-Event-ID 之后继续读取流式任务的事件"""
+    if 'username' not in session:
+        return jsonify({'error': '未登录'}), 401
+    
+    job = stream_jobs.get(job_id, session['username'])
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    
+    last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    )
+    return chat_stream_response(job, last_event_id)
+
+@app.route('/api/chat/active/<conversation_id>', methods=['GET'])
+def get_active_chat_stream(conversation_id):
+    """查询对话最近一次仍可读取的流式任务（页面刷新后续传用）"""
+    if 'username' not in session:
+        return jsonify({'error': '未登录'}), 401
+    
+    job = stream_jobs.find_active(session['username'], conversation_id)
+    if job is None:
+        return jsonify({'job_id': None})
+    return jsonify({'job_id': job.id, 'finished': job.finished, 'last_event_id': job.last_event_id})
+
 @app.route('/api/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
     """获取对话历史"""
@@ -3021,12 +3089,10 @@ def get_conversation(conversation_id):
         return jsonify({'error': '未登录'}), 401
     
     username = session['username']
-    # 验证对话所有权
-    user_conv_ids = get_user_conversations(username)
-    if conversation_id not in user_conv_ids:
-        return jsonify({'error': '无权访问'}), 403
+    messages = get_owned_conversation(conversation_id, username)
+    if messages is None:
+        return jsonify({'error': '对话不存在或无权访问'}), 404
     
-    messages = get_conversation_from_db(conversation_id, username)
     return jsonify({
         'conversation_id': conversation_id,
         'messages': messages
@@ -3039,77 +3105,117 @@ def delete_conversation(conversation_id):
         return jsonify({'error': '未登录'}), 401
     
     username = session['username']
-    # 验证对话所有权
-    user_conv_ids = get_user_conversations(username)
-    if conversation_id not in user_conv_ids:
-        return jsonify({'error': '无权访问'}), 403
     
-    # 从数据库删除
+    # 本进程尚未写入的消息直接丢弃，避免删除后又被后台写入重新建出对话；
+    # 其他工作进程的无法丢弃，等它们写入后再删除
+    conversation_writer.discard(conversation_id, username)
+    conversation_writer.wait_flushed(conversation_id, username)
+    
+    # 锁住对话头的同时完成归属校验
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM conversations WHERE conversation_id = %s AND username = %s", 
-                          (conversation_id, username))
+            cursor.execute(
+                "SELECT conversation_id, parent_conversation_id, fork_seq FROM conversations "
+                "WHERE username = %s AND conversation_id = %s FOR UPDATE",
+                (username, conversation_id)
+            )
+            conversation = cursor.fetchone()
+            if not conversation:
+                return jsonify({'error': '对话不存在或无权访问'}), 404
+            
+            # 子分支先复制它们从本对话继承的那一段消息，改挂到上一级对话
+            copied = detach_branches(cursor, username, conversation)
+            cursor.execute("DELETE FROM conversations WHERE username = %s AND conversation_id = %s",
+                          (username, conversation_id))
+            cursor.execute("DELETE FROM conversation_messages WHERE username = %s AND conversation_id = %s",
+                          (username, conversation_id))
             conn.commit()
     
+    # 已删除对话的片段不再被召回；子分支复制过去的那段消息，片段改记到子分支名下
+    conversation_memory.forget_conversation(username, conversation_id, handover=copied)
+    
     return jsonify({'success': True})
 
+def _encode_conversation_cursor(updated_at, row_id):
+    raw = f"{updated_at.isoformat() if updated_at else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_conversation_cursor(token):
+    padded = token + '=' * (-len(token) % 4)
+    updated_at, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.fromisoformat(updated_at), int(row_id)
+
 @app.route('/api/conversations', methods=['GET'])
 def list_conversations():
-    """列出对话，支持分页"""
+    """列出对话，按 (updated_at, id) 做 keyset 分页
+
+    Query:
+        limit: 每页条数
+        cursor: 上一页返回的 next_cursor，不传则从最新的对话开始
+    """
     if 'username' not in session:
         return jsonify({'error': '未登录'}), 401
     
     username = session['username']
-    page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 10, type=int)
-    offset = (page - 1) * limit
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    cursor_token = request.args.get('cursor')
+    
+    sql = (
+        "SELECT id, conversation_id, title, preview, message_count, updated_at, last_message_at, "
+        "parent_conversation_id, fork_seq FROM conversations WHERE username = %s AND message_count > 0"
+    )
+    params = [username]
+    if cursor_token:
+        try:
+            cursor_updated_at, cursor_id = _decode_conversation_cursor(cursor_token)
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'error': '无效的分页游标'}), 400
+        sql += " AND (updated_at < %s OR (updated_at = %s AND id < %s))"
+        params += [cursor_updated_at, cursor_updated_at, cursor_id]
+    sql += " ORDER BY updated_at DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
     
     with get_db_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT COUNT(*) as total FROM conversations WHERE username = %s",
-                (username,)
-            )
-            total = cursor.fetchone()['total']
-            
-            cursor.execute(
-                "SELECT conversation_id, messages, updated_at FROM conversations WHERE username = %s ORDER BY updated_at DESC LIMIT %s OFFSET %s",
-                (username, limit, offset)
-            )
+            cursor.execute(sql, params)
             results = cursor.fetchall()
     
-    conversation_list = []
-    for row in results:
-        messages = json.loads(row['messages']) if row['messages'] else []
-        if messages:
-            first_message = next((m for m in messages if m['role'] == 'user'), None)
-            conversation_list.append({
-                'id': row['conversation_id'],
-                'title': first_message['content'][:50] if first_message else '新对话',
-                'updated_at': row['updated_at'].isoformat() if row['updated_at'] else '',
-                'message_count': len(messages)
-            })
+    has_more = len(results) > limit
+    results = results[:limit]
     
-    has_more = (offset + len(results)) < total
+    conversation_list = [{
+        'id': row['conversation_id'],
+        'title': row['title'] or '新对话',
+        'preview': row['preview'] or '',
+        'updated_at': row['updated_at'].isoformat() if row['updated_at'] else '',
+        'last_message_at': row['last_message_at'].isoformat() if row['last_message_at'] else '',
+        'message_count': row['message_count'],
+        'parent_id': row['parent_conversation_id'],
+        'fork_seq': row['fork_seq']
+    } for row in results]
+    
+    next_cursor = None
+    if has_more and results:
+        next_cursor = _encode_conversation_cursor(results[-1]['updated_at'], results[-1]['id'])
     
     return jsonify({
         'conversations': conversation_list,
-        'total': total,
-        'page': page,
         'limit': limit,
-        'has_more': has_more
+        'has_more': has_more,
+        'next_cursor': next_cursor
     })
 
+AVAILABLE_MODELS = [
+    {'id': 'deepseek-chat', 'name': 'DeepSeek Chat', 'description': '强大的对话模型'},
+    {'id': 'deepseek-coder', 'name': 'DeepSeek Coder', 'description': '专业的编程模型'},
+    {'id': 'gpt-3.5-turbo', 'name': 'GPT-3.5 Turbo', 'description': '需要 OpenAI API'},
+    {'id': 'gpt-4', 'name': 'GPT-4', 'description': '需要 OpenAI API'},
+]
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
     """获取可用模型列表"""
-    models = [
-        {'id': 'deepseek-chat', 'name': 'DeepSeek Chat', 'description': '强大的对话模型'},
-        {'id': 'deepseek-coder', 'name': 'DeepSeek Coder', 'description': '专业的编程模型'},
-        {'id': 'gpt-3.5-turbo', 'name': 'GPT-3.5 Turbo', 'description': '需要 OpenAI API'},
-        {'id': 'gpt-4', 'name': 'GPT-4', 'description': '需要 OpenAI API'},
-    ]
-    return jsonify({'models': models})
+    return jsonify({'models': AVAILABLE_MODELS, 'compare_max_models': CHAT_COMPARE_MAX_MODELS})
 
 @app.route('/api/skills', methods=['GET'])
 def get_skills():
@@ -3135,6 +3241,8 @@ def scan_skills():
     
     try:
         skill_registry = register_all_skills()
+        chat_context_cache.clear()
+        tool_router.rebuild(skill_registry)
         
         user_settings = {}
         username = session.get('username')
@@ -3245,6 +3353,8 @@ def update_user_skill(skill_name):
                 )
                 conn.commit()
 
+        chat_context_cache.invalidate(username)
+
         return jsonify({
             'success': True,
             'skill_name': skill_name,
@@ -3704,18 +3814,16 @@ def delete_workflow(workflow_id):
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                # 检查工作流是否存在且用户有权访问
+                # 删除工作流（级联删除相关节点和边），同时完成归属校验
                 cursor.execute(
-                    "SELECT id FROM workflows WHERE id = %s AND username = %s",
+                    "DELETE FROM workflows WHERE id = %s AND username = %s",
                     (workflow_id, username)
                 )
-                if not cursor.fetchone():
-                    return jsonify({'error': '工作流不存在或无权访问'}), 404
-                
-                # 删除工作流（级联删除相关节点和边）
-                cursor.execute("DELETE FROM workflows WHERE id = %s", (workflow_id,))
                 conn.commit()
                 
+                if cursor.rowcount == 0:
+                    return jsonify({'error': '工作流不存在或无权访问'}), 404
+                
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -4419,20 +4527,15 @@ def delete_schedule(schedule_id):
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                # 检查定时任务是否存在且用户有权访问
-                cursor.execute(
-                    "SELECT id FROM schedules WHERE id = %s AND username = %s",
-                    (schedule_id, username)
-                )
-                if not cursor.fetchone():
-                    return jsonify({'error': '定时任务不存在或无权访问'}), 404
-                
                 cursor.execute(
                     "DELETE FROM schedules WHERE id = %s AND username = %s",
                     (schedule_id, username)
                 )
                 conn.commit()
                 
+                if cursor.rowcount == 0:
+                    return jsonify({'error': '定时任务不存在或无权访问'}), 404
+                
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -4905,21 +5008,16 @@ def delete_async_task(task_id):
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
-                # 检查任务是否存在且属于用户
+                # 删除任务，同时完成归属校验
                 cursor.execute(
-                    "SELECT id FROM async_tasks WHERE id = %s AND username = %s",
+                    "DELETE FROM async_tasks WHERE id = %s AND username = %s",
                     (task_id, username)
                 )
-                if not cursor.fetchone():
-                    return jsonify({'error': '任务不存在或无权访问'}), 404
-                
-                # 删除任务
-                cursor.execute(
-                    "DELETE FROM async_tasks WHERE id = %s",
-                    (task_id,)
-                )
                 conn.commit()
                 
+                if cursor.rowcount == 0:
+                    return jsonify({'error': '任务不存在或无权访问'}), 404
+                
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -5111,6 +5209,7 @@ def update_prompt(prompt_id):
                 if cursor.rowcount == 0:
                     return jsonify({'error': '提示词不存在'}), 404
                 
+                chat_context_cache.invalidate(username)
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -5135,6 +5234,7 @@ def delete_prompt(prompt_id):
                 if cursor.rowcount == 0:
                     return jsonify({'error': '提示词不存在'}), 404
                 
+                chat_context_cache.invalidate(username)
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -5316,6 +5416,7 @@ def update_agent(agent_id):
                         )
                     conn.commit()
                 
+                chat_context_cache.invalidate(username)
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -5340,6 +5441,7 @@ def delete_agent(agent_id):
                 if cursor.rowcount == 0:
                     return jsonify({'error': 'Agent不存在'}), 404
                 
+                chat_context_cache.invalidate(username)
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -5648,17 +5750,16 @@ def delete_knowledge_item(item_id):
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(
-                    """SELECT ki.id FROM knowledge_item ki
+                    """DELETE ki FROM knowledge_item ki
                        JOIN knowledge_base kb ON ki.knowledge_base_id = kb.id
                        WHERE ki.id = %s AND kb.username = %s""",
                     (item_id, username)
                 )
-                if not cursor.fetchone():
-                    return jsonify({'error': '知识条目不存在'}), 404
-                
-                cursor.execute("DELETE FROM knowledge_item WHERE id = %s", (item_id,))
                 conn.commit()
                 
+                if cursor.rowcount == 0:
+                    return jsonify({'error': '知识条目不存在'}), 404
+                
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -5789,17 +5890,16 @@ def delete_knowledge_relation(relation_id):
         with get_db_connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(
-                    """SELECT kr.id FROM knowledge_relation kr
+                    """DELETE kr FROM knowledge_relation kr
                        JOIN knowledge_base kb ON kr.knowledge_base_id = kb.id
                        WHERE kr.id = %s AND kb.username = %s""",
                     (relation_id, username)
                 )
-                if not cursor.fetchone():
-                    return jsonify({'error': '关系不存在'}), 404
-                
-                cursor.execute("DELETE FROM knowledge_relation WHERE id = %s", (relation_id,))
                 conn.commit()
                 
+                if cursor.rowcount == 0:
+                    return jsonify({'error': '关系不存在'}), 404
+                
                 return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -6018,6 +6118,8 @@ def redis_tool():
 
 def get_redis_client(host, port, password, db):
     """创建 Redis 客户端连接"""
+    import redis
+
     if password:
         return redis.Redis(host=host, port=int(port), password=password, db=int(db), decode_responses=True)
     else:
@@ -6026,6 +6128,8 @@ def get_redis_client(host, port, password, db):
 @app.route('/api/redis/connect', methods=['POST'])
 def redis_connect():
     """测试 Redis 连接"""
+    import redis
+
     if 'username' not in session:
         return jsonify({'success': False, 'error': '请先登录'}), 401
     
@@ -6439,6 +6543,8 @@ def redis_info():
 @app.route('/api/redis/execute', methods=['POST'])
 def redis_execute():
     """执行 Redis 命令"""
+    import redis
+
     if 'username' not in session:
         return jsonify({'success': False, 'error': '请先登录'}), 401
     
@@ -6656,7 +6762,48 @@ def mysql_execute():
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查"""
-    return jsonify({'status': 'ok', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'ok',
+        'timestamp': datetime.now().isoformat(),
+        'db_pool': get_pool_stats(),
+        'llm_clients': get_llm_client_stats(),
+        'llm_gateway': get_gateway_stats(),
+        'response_cache': response_cache.stats(),
+        'classic_store': classic_store.stats(),
+        'chat_context_cache': chat_context_cache.stats(),
+        'stream_jobs': stream_jobs.stats(),
+        'scheduler': scheduler.stats(),
+        'conversation_writer': conversation_writer.stats(),
+        'memory': conversation_memory.stats(),
+        'tool_router': tool_router.stats(),
+        'skills': skill_registry.stats(),
+        'startup': startup_profile.stats()
+    })
+
+def init_database_safely():
+    """初始化数据库表，失败时只打印提示（服务仍然启动）"""
+    try:
+        init_database()
+    except Exception as e:
+        print(f"⚠️  数据库初始化失败: {e}")
+        print("   请确保 MySQL 已启动并配置正确的连接信息")
+
+def start_scheduler():
+    """启动定时任务调度器（多进程时只有选举出的主节点执行调度，当选后初始化下次执行时间）"""
+    try:
+        scheduler.start()
+    except Exception as e:
+        print(f"⚠️  定时任务调度器启动失败: {e}")
+
+def start_conversation_writer():
+    """启动对话延迟写入：重放上次异常退出遗留的 WAL（需在数据库初始化之后）"""
+    try:
+        conversation_writer.start()
+    except Exception as e:
+        print(f"⚠️  对话延迟写入启动失败: {e}")
+
+# 应用导入完成，打印启动耗时报告
+startup_profile.end()
 
 if __name__ == '__main__':
     # 确保模板目录存在
@@ -6665,11 +6812,7 @@ if __name__ == '__main__':
     os.makedirs('static/js', exist_ok=True)
     
     # 初始化数据库表
-    try:
-        init_database()
-    except Exception as e:
-        print(f"⚠️  数据库初始化失败: {e}")
-        print("   请确保 MySQL 已启动并配置正确的连接信息")
+    init_database_safely()
     
     print("\n" + "="*50)
     print("🚀 AI Chat Platform Starting...")
@@ -6689,11 +6832,10 @@ if __name__ == '__main__':
         print(f"   - {skill_name}: {skill.description[:50]}...")
     
     # 启动定时任务调度器
-    try:
-        scheduler.initialize_schedules()
-        scheduler.start()
-    except Exception as e:
-        print(f"⚠️  定时任务调度器启动失败: {e}")
+    start_scheduler()
+    # debug 模式下重载器的父进程不处理请求，只在实际服务的子进程中启动延迟写入（否则两个进程会互相视为多进程部署）
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_conversation_writer()
     
     print(f"📝 访问地址: http://localhost:8000")
     print("="*50 + "\n")
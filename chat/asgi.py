@@ -0,0 +1,248 @@
+"""
+ASGI 服务入口（异步流式模式）
+
+WSGI 模式下每个打开的 SSE 连接在整个回答期间独占一个工作线程，并发流的数量受线程数限制。
+ASGI 模式下：
+
+- /api/chat 和 /api/chat/stream/<job_id> 的鉴权、加载上下文、启动任务仍由原来的 Flask 视图完成
+  （在线程池中执行，耗时很短）；视图返回的流式任务（响应头 X-Chat-Job-Id）改由事件循环
+  异步读取，每个打开的连接只是一个协程，不再占用线程
+- 生成本身在 stream_jobs 的后台任务中运行，与连接无关。任务线程池大小为 CHAT_STREAM_MAX_JOBS，
+  超出时 /api/chat 返回 429，因此进程的线程数有上限：ASGI_WSGI_THREADS + CHAT_STREAM_MAX_JOBS，
+  不随打开的连接数增长
+- 其余接口原样交给 Flask 处理（在线程池中执行），行为与 WSGI 模式一致
+
+运行（uvicorn 已列在 requirements.txt 中）：
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+环境变量：
+    ASGI_WSGI_THREADS   执行 Flask 视图的线程数，默认 32
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app as flask_app, init_database_safely, start_scheduler, start_conversation_writer
+from conversation_writer import conversation_writer
+from stream_jobs import stream_jobs, parse_last_event_id
+
+
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '32'))
+
+# 请求体超过该大小时写入临时文件
+MAX_MEMORY_BODY = 1024 * 1024
+# 线程向事件循环传递响应体时的队列长度（背压）
+WSGI_QUEUE_SIZE = 16
+
+STREAM_JOB_HEADER = 'x-chat-job-id'
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+
+class _ClientGone(Exception):
+    """客户端已断开，停止迭代 WSGI 响应体"""
+
+
+def build_environ(scope, body):
+    """由 ASGI scope 构造 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    """读取完整请求体（较大时写入临时文件）"""
+    body = tempfile.SpooledTemporaryFile(max_size=MAX_MEMORY_BODY)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise _ClientGone()
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+def run_wsgi(environ, loop, queue, gone):
+    """在线程中调用 Flask 并迭代响应体，通过有界队列交给事件循环
+
+    整个响应体在同一个线程中迭代（stream_with_context 要求上下文在同一线程中进出）。
+    响应头带 X-Chat-Job-Id 时不迭代，只把任务编号交给事件循环异步读取。
+    """
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=1)
+            except FutureTimeoutError:
+                if gone.is_set():
+                    future.cancel()
+                    raise _ClientGone()
+
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = headers
+        return lambda data: put(('body', data))
+
+    body = None
+    try:
+        body = flask_app(environ, start_response)
+        headers = response['headers']
+        job_id = next((value for name, value in headers if name.lower() == STREAM_JOB_HEADER), None)
+        put(('start', response['status'], headers, job_id))
+        if job_id is not None:
+            return
+        for chunk in body:
+            if chunk:
+                put(('body', chunk))
+        put(('end',))
+    except _ClientGone:
+        pass
+    except Exception as e:
+        try:
+            put(('error', e))
+        except _ClientGone:
+            pass
+    finally:
+        if body is not None and hasattr(body, 'close'):
+            body.close()
+
+
+async def watch_disconnect(receive, gone):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            gone.set()
+            return
+
+
+async def send_start(send, status, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+
+
+async def stream_job(send, gone, job, last_event_id):
+    """异步发送流式任务的事件"""
+    async for chunk in stream_jobs.asse(job, last_event_id):
+        if gone.is_set():
+            return
+        await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def handle_http(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    try:
+        body = await read_body(receive)
+    except _ClientGone:
+        return
+
+    environ = build_environ(scope, body)
+    queue = asyncio.Queue(maxsize=WSGI_QUEUE_SIZE)
+    gone = threading.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, gone))
+    worker = loop.run_in_executor(_executor, run_wsgi, environ, loop, queue, gone)
+    try:
+        item = await queue.get()
+        if item[0] == 'error':
+            raise item[1]
+        _, status, headers, job_id = item
+        await send_start(send, status, headers)
+
+        if job_id is not None:
+            job = stream_jobs.lookup(job_id)
+            if job is None:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                return
+            query = parse_qs(environ['QUERY_STRING'])
+            last_event_id = parse_last_event_id(
+                environ.get('HTTP_LAST_EVENT_ID') or (query.get('last_event_id') or [None])[0]
+            )
+            await stream_job(send, gone, job, last_event_id)
+            return
+
+        while True:
+            item = await queue.get()
+            if item[0] == 'body':
+                await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+            elif item[0] == 'end':
+                break
+            else:
+                print(f"❌ [ASGI] 响应体输出失败: {item[1]}")
+                break
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        gone.set()
+        watcher.cancel()
+        await worker
+        body.close()
+
+
+async def handle_lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await loop.run_in_executor(None, init_database_safely)
+            await loop.run_in_executor(None, start_scheduler)
+            await loop.run_in_executor(None, start_conversation_writer)
+            print(f"🚀 ASGI 模式已启动，Flask 视图线程数 {ASGI_WSGI_THREADS}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _executor.shutdown(wait=False)
+            await loop.run_in_executor(None, conversation_writer.stop)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+    else:
+        raise NotImplementedError(f"不支持的连接类型: {scope['type']}")
+
+
+__all__ = ['application', 'build_environ']
@@ -0,0 +1,174 @@
+"""
+对话上下文缓存
+
+/api/chat 每次请求都要查询 agents、prompts、user_profile、user_preferences、user_skills
+并重新生成 tools 数组，而这些数据很少变化。这里按用户缓存解析后的结果：
+
+    agent:<id>   Agent 对应的模型和系统提示词
+    user_info    注入对话的用户信息块
+    tools        用户启用技能的函数定义数组
+
+默认使用进程内 LRU（按用户数量淘汰，条目带 TTL）；配置 CHAT_CONTEXT_CACHE_REDIS_URL 后
+改用 Redis 哈希存储，多进程共享并能互相看到失效。
+相关数据的更新接口调用 invalidate(username) 使该用户的全部缓存失效。
+
+环境变量：
+    CHAT_CONTEXT_CACHE_SIZE        进程内缓存的最大用户数，默认 1000
+    CHAT_CONTEXT_CACHE_TTL         条目有效期（秒），默认 300
+    CHAT_CONTEXT_CACHE_REDIS_URL   Redis 地址（可选），如 redis://localhost:6379/0
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+CHAT_CONTEXT_CACHE_SIZE = int(os.getenv('CHAT_CONTEXT_CACHE_SIZE', '1000'))
+CHAT_CONTEXT_CACHE_TTL = float(os.getenv('CHAT_CONTEXT_CACHE_TTL', '300'))
+CHAT_CONTEXT_CACHE_REDIS_URL = os.getenv('CHAT_CONTEXT_CACHE_REDIS_URL', '')
+
+REDIS_KEY_PREFIX = 'arc_logi_chat:ctx:'
+
+
+class ChatContextCache:
+    """按用户分组的上下文缓存"""
+
+    def __init__(self, max_users: int = CHAT_CONTEXT_CACHE_SIZE, ttl: float = CHAT_CONTEXT_CACHE_TTL,
+                 redis_client=None):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._redis = redis_client
+        self._lock = threading.Lock()
+        self._users: 'OrderedDict[str, Dict[str, tuple]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def _error(self, action: str, e: Exception):
+        print(f"⚠️  {action}: {e}")
+        with self._lock:
+            self.errors += 1
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, username: str, key: str):
+        """读取缓存，返回 (是否命中, 值)；值可以是 None"""
+        if self._redis is not None:
+            try:
+                raw = self._redis.hget(REDIS_KEY_PREFIX + username, key)
+            except Exception as e:
+                self._error("读取对话上下文缓存失败", e)
+                raw = None
+            hit = raw is not None
+            self._count(hit)
+            return hit, (json.loads(raw) if hit else None)
+
+        now = time.monotonic()
+        with self._lock:
+            entries = self._users.get(username)
+            entry = entries.get(key) if entries else None
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(username)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def set(self, username: str, key: str, value: Any):
+        if self._redis is not None:
+            try:
+                redis_key = REDIS_KEY_PREFIX + username
+                pipe = self._redis.pipeline()
+                pipe.hset(redis_key, key, json.dumps(value, ensure_ascii=False))
+                pipe.expire(redis_key, int(self.ttl))
+                pipe.execute()
+            except Exception as e:
+                self._error("写入对话上下文缓存失败", e)
+            return
+
+        with self._lock:
+            entries = self._users.get(username)
+            if entries is None:
+                entries = self._users[username] = {}
+            entries[key] = (time.monotonic() + self.ttl, value)
+            self._users.move_to_end(username)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def get_or_load(self, username: str, key: str, loader: Callable[[], Any]) -> Any:
+        """命中则返回缓存值，否则调用 loader() 加载并写入缓存"""
+        hit, value = self.get(username, key)
+        if hit:
+            return value
+        value = loader()
+        self.set(username, key, value)
+        return value
+
+    def invalidate(self, username: str):
+        """使某个用户的全部缓存失效"""
+        with self._lock:
+            self._users.pop(username, None)
+            self.invalidations += 1
+        if self._redis is not None:
+            try:
+                self._redis.delete(REDIS_KEY_PREFIX + username)
+            except Exception as e:
+                self._error("清除对话上下文缓存失败", e)
+
+    def clear(self):
+        """清空所有用户的缓存（技能重新加载后调用）"""
+        with self._lock:
+            self._users.clear()
+            self.invalidations += 1
+        if self._redis is not None:
+            try:
+                keys = list(self._redis.scan_iter(match=REDIS_KEY_PREFIX + '*'))
+                if keys:
+                    self._redis.delete(*keys)
+            except Exception as e:
+                self._error("清空对话上下文缓存失败", e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'backend': 'redis' if self._redis is not None else 'memory',
+                'users': len(self._users),
+                'max_users': self.max_users,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'invalidations': self.invalidations,
+                'errors': self.errors,
+            }
+
+
+def _create_cache() -> ChatContextCache:
+    redis_client = None
+    if CHAT_CONTEXT_CACHE_REDIS_URL:
+        try:
+            import redis
+            redis_client = redis.Redis.from_url(CHAT_CONTEXT_CACHE_REDIS_URL, decode_responses=True)
+        except Exception as e:
+            print(f"⚠️  对话上下文缓存无法使用 Redis，改用进程内缓存: {e}")
+    return ChatContextCache(redis_client=redis_client)
+
+
+chat_context_cache = _create_cache()
+
+
+__all__ = ['ChatContextCache', 'chat_context_cache']
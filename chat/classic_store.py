@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+三字经 / 千字文 预生成解读
+
+两部经典都是固定的短文本，页面上的"全文概要""分段详细"和逐句解读的提问是有限集合。
+离线批处理任务为每个提问预先生成解读，写入按提示词版本命名的存储文件：
+
+    <CLASSIC_STORE_DIR>/classic_<版本>.bin
+
+版本取 CLASSIC_SYSTEM_PROMPT、用户消息模板和生成参数的哈希（与 app.generate_cached_content
+的提示词版本一致），修改提示词后旧文件不再被读取，需要重新运行批处理任务。
+
+文件格式：4 字节魔数 + 4 字节索引长度 + JSON 索引 {key: [偏移, 长度]} + UTF-8 正文。
+接口进程用 mmap 打开文件，只解析索引，正文按需切片解码，多个工作进程共享同一份页缓存。
+存储中没有的提问仍然实时调用大模型。
+
+用法：
+    python classic_store.py                 # 生成缺失的条目（复用已有结果）
+    python classic_store.py --workers 8     # 指定并发数
+    python classic_store.py --force         # 全部重新生成
+
+环境变量：
+    CLASSIC_STORE_DIR       存储目录，默认 chat/data/classic_store
+    CLASSIC_STORE_WORKERS   批处理并发数，默认 4
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+from response_cache import make_cache_key, prompt_version
+
+load_dotenv()
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CLASSIC_STORE_DIR = os.getenv('CLASSIC_STORE_DIR', os.path.join(BASE_DIR, 'data', 'classic_store'))
+CLASSIC_STORE_WORKERS = int(os.getenv('CLASSIC_STORE_WORKERS', '4'))
+
+CLASSIC_SYSTEM_PROMPT = """你是一个中国传统文化专家，擅长解读经典古籍。你的任务是用通俗易懂的语言解读三字经、千字文等传统启蒙经典，帮助用户理解其含义、教育思想和历史价值。
+
+输出格式请使用Markdown，方便前端渲染显示。"""
+
+CLASSIC_USER_TEMPLATE = "关于{}：{}"
+CLASSIC_MODEL = "deepseek-chat"
+CLASSIC_GENERATION_PARAMS = {'temperature': 0.7, 'max_tokens': 2000}
+
+CLASSIC_NAMES = {
+    'sanzijing': '三字经',
+    'qianziwen': '千字文',
+}
+
+STORE_MAGIC = b'ACS1'
+_HEADER = struct.Struct('<4sI')
+_PASSAGE_RE = re.compile(r'<p>([^<]+)<')
+
+
+def classic_version() -> str:
+    """提示词版本（与 generate_cached_content 计算方式相同）"""
+    return prompt_version(CLASSIC_SYSTEM_PROMPT, CLASSIC_USER_TEMPLATE, CLASSIC_GENERATION_PARAMS)
+
+
+def store_path(version: Optional[str] = None, directory: Optional[str] = None) -> str:
+    return os.path.join(directory or CLASSIC_STORE_DIR, f"classic_{version or classic_version()}.bin")
+
+
+def entry_key(classic_name: str, user_content: str, version: Optional[str] = None) -> str:
+    return make_cache_key('classic_analyze', CLASSIC_MODEL, f"{classic_name}\x1f{user_content}",
+                          version or classic_version())
+
+
+def load_passages(classic: str) -> List[str]:
+    """从页面模板中读取原文（每个 <p> 一段），保证与页面展示的原文一致"""
+    path = os.path.join(BASE_DIR, 'templates', f'{classic}.html')
+    with open(path, 'r', encoding='utf-8') as f:
+        html = f.read()
+    start = html.find('id="originalText"')
+    if start < 0:
+        return []
+    end = html.find('</div>', start)
+    passages = (p.strip() for p in _PASSAGE_RE.findall(html[start:end]))
+    return [p for p in passages if p]
+
+
+def summary_question(classic_name: str) -> str:
+    return f'请对{classic_name}进行全文概要解读，包括其教育意义、历史价值等内容。'
+
+
+def section_question(classic_name: str) -> str:
+    return f'请选择{classic_name}中的重点章节进行详细解读，每段解释其含义和教育思想。'
+
+
+def passage_question(passage: str) -> str:
+    return f'请解读「{passage}」的含义和教育思想。'
+
+
+def corpus_questions() -> List[Tuple[str, str]]:
+    """需要预生成的全部 (经典名称, 提问)"""
+    questions = []
+    for classic, classic_name in CLASSIC_NAMES.items():
+        questions.append((classic_name, summary_question(classic_name)))
+        questions.append((classic_name, section_question(classic_name)))
+        for passage in load_passages(classic):
+            questions.append((classic_name, passage_question(passage)))
+    return questions
+
+
+def write_store(path: str, entries: Dict[str, str]):
+    """写入存储文件（先写临时文件再替换，读取方不会看到半个文件）"""
+    index = {}
+    payload = bytearray()
+    for key, content in entries.items():
+        data = content.encode('utf-8')
+        index[key] = [len(payload), len(data)]
+        payload += data
+    index_bytes = json.dumps(index, separators=(',', ':')).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(STORE_MAGIC, len(index_bytes)))
+        f.write(index_bytes)
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class ClassicStore:
+    """只读的预生成解读存储（mmap）"""
+
+    def __init__(self, directory: str = CLASSIC_STORE_DIR, version: Optional[str] = None):
+        self.directory = directory
+        self.version = version or classic_version()
+        self.path = store_path(self.version, directory)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._mmap = None
+        self._index: Dict[str, List[int]] = {}
+        self._data_offset = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.exists(self.path):
+                print(f"ℹ️  未找到经典解读预生成文件 {self.path}，全部实时生成")
+                return
+            try:
+                with open(self.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, index_length = _HEADER.unpack_from(mm, 0)
+                if magic != STORE_MAGIC:
+                    raise ValueError('文件格式不正确')
+                self._index = json.loads(mm[_HEADER.size:_HEADER.size + index_length])
+                self._data_offset = _HEADER.size + index_length
+                self._mmap = mm
+                print(f"✅ 已加载经典解读预生成文件: {len(self._index)} 条 (版本 {self.version})")
+            except Exception as e:
+                print(f"⚠️  加载经典解读预生成文件失败: {e}")
+                self._index = {}
+
+    def get(self, classic_name: str, user_content: str) -> Optional[str]:
+        """查找预生成的解读，没有则返回 None"""
+        if not self._loaded:
+            self._load()
+        location = self._index.get(entry_key(classic_name, user_content, self.version))
+        if location is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        start = self._data_offset + location[0]
+        content = self._mmap[start:start + location[1]].decode('utf-8')
+        with self._lock:
+            self.hits += 1
+        return content
+
+    def entries(self) -> Dict[str, str]:
+        """读出全部条目（批处理任务增量生成时使用）"""
+        if not self._loaded:
+            self._load()
+        return {
+            key: self._mmap[self._data_offset + offset:self._data_offset + offset + length].decode('utf-8')
+            for key, (offset, length) in self._index.items()
+        }
+
+    def reload(self):
+        """重新打开存储文件（批处理任务完成后调用）"""
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = None
+            self._index = {}
+            self._loaded = False
+
+    def stats(self) -> Dict[str, object]:
+        if not self._loaded:
+            self._load()
+        with self._lock:
+            return {
+                'version': self.version,
+                'loaded': self._mmap is not None,
+                'entries': len(self._index),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def generate_analysis(classic_name: str, user_content: str) -> str:
+    """实时调用大模型生成一条解读"""
+    from llm_gateway import chat_completion
+
+    response = chat_completion(
+        model=CLASSIC_MODEL,
+        base_url="https://api.deepseek.com",
+        api_key=os.getenv('OPENAI_API_KEY', ''),
+        timeout=120.0,
+        messages=[
+            {"role": "system", "content": CLASSIC_SYSTEM_PROMPT},
+            {"role": "user", "content": CLASSIC_USER_TEMPLATE.format(classic_name, user_content)}
+        ],
+        **CLASSIC_GENERATION_PARAMS
+    )
+    return response.choices[0].message.content
+
+
+def build_store(workers: int = CLASSIC_STORE_WORKERS, force: bool = False,
+                directory: str = CLASSIC_STORE_DIR,
+                generate: Callable[[str, str], str] = generate_analysis) -> Dict[str, int]:
+    """为全部提问生成解读并写入当前版本的存储文件
+
+    Args:
+        workers: 最大并发数（大模型接口有限流，不宜过大）
+        force: 为 True 时忽略已有结果全部重新生成
+        directory: 存储目录
+        generate: 生成函数 (经典名称, 提问) -> 解读
+
+    Returns:
+        统计信息：total / reused / generated / failed
+    """
+    version = classic_version()
+    path = store_path(version, directory)
+    entries = {} if force else ClassicStore(directory, version).entries()
+
+    questions = corpus_questions()
+    pending = [(name, content) for name, content in questions
+               if entry_key(name, content, version) not in entries]
+    result = {'total': len(questions), 'reused': len(questions) - len(pending), 'generated': 0, 'failed': 0}
+    print(f"📚 经典解读预生成: 共 {len(questions)} 条，待生成 {len(pending)} 条，并发 {workers} (版本 {version})")
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(generate, name, content): (name, content) for name, content in pending}
+        for future in as_completed(futures):
+            name, content = futures[future]
+            try:
+                analysis = future.result()
+            except Exception as e:
+                result['failed'] += 1
+                print(f"❌ {name} {content[:30]}: {e}")
+                continue
+            if not analysis:
+                result['failed'] += 1
+                continue
+            entries[entry_key(name, content, version)] = analysis
+            result['generated'] += 1
+            done = result['generated'] + result['failed']
+            if done % 10 == 0:
+                print(f"   已完成 {done}/{len(pending)}")
+
+    write_store(path, entries)
+    print(f"✅ 已写入 {path}: {len(entries)} 条，用时 {time.time() - started:.1f}s，失败 {result['failed']} 条")
+    return result
+
+
+classic_store = ClassicStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='预生成三字经 / 千字文解读')
+    parser.add_argument('--workers', type=int, default=CLASSIC_STORE_WORKERS, help='并发数')
+    parser.add_argument('--force', action='store_true', help='忽略已有结果全部重新生成')
+    args = parser.parse_args()
+    result = build_store(workers=args.workers, force=args.force)
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
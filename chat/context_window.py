@@ -0,0 +1,212 @@
+"""
+对话上下文窗口
+
+/api/chat 不再把完整历史原样发给模型，而是按模型的 token 预算组装上下文：
+
+- 始终保留系统提示词、用户信息和本轮用户消息
+- 从最新的一轮对话往前，按整轮（用户消息及其后的助手/工具消息）放入预算
+- 放不下的早期对话用保存在对话头上的滚动摘要代替，摘要在回复结束后增量更新
+- 从其他对话召回的相关片段（见 conversation_memory.py）每轮都不同，放在本轮消息之前，
+  不影响前面的部分
+- 消息顺序固定（系统提示词、用户信息、摘要、历史、召回片段、本轮消息），并尽量保持前缀不变：
+  摘要之后的历史还放得下时不再移动截断位置；需要截断时一次腾出 1 - compact_ratio 的余量，
+  之后几轮只在末尾追加，提供方的前缀缓存（如 DeepSeek）可以持续命中
+
+token 数优先用 tiktoken 计算（如已安装），否则按字符估算：中日韩字符约 1 token/字，
+其余约 4 字符/token。
+"""
+
+import json
+import os
+import re
+from typing import Dict, Any, List, Optional
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:
+    _encoding = None
+
+
+# 每个模型发送给 API 的消息 token 预算（不含工具定义和输出）
+DEFAULT_CONTEXT_BUDGET = 8000
+CONTEXT_TOKEN_BUDGETS = {
+    'deepseek-chat': 16000,
+    'deepseek-coder': 16000,
+    'gpt-3.5-turbo': 8000,
+    'gpt-4': 4000,
+}
+
+# 可通过环境变量覆盖，例如 CHAT_CONTEXT_BUDGETS='{"gpt-4": 6000}'
+try:
+    CONTEXT_TOKEN_BUDGETS.update(json.loads(os.getenv('CHAT_CONTEXT_BUDGETS', '{}')))
+except ValueError:
+    print("⚠️  CHAT_CONTEXT_BUDGETS 不是合法的 JSON，已忽略")
+
+# 需要截断历史时，只填满预算的这一比例，给之后几轮留出追加的余量（截断位置不必每轮移动）
+CHAT_CONTEXT_COMPACT_RATIO = float(os.getenv('CHAT_CONTEXT_COMPACT_RATIO', '0.7'))
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "【早先对话摘要】"
+
+_CJK_RE = re.compile(r'[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """计算（或估算）文本的 token 数"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_message_tokens(message: Dict[str, Any]) -> int:
+    """单条消息的 token 数"""
+    content = message.get('content') or ''
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(content)
+
+
+def get_context_budget(model: str) -> int:
+    """获取模型的上下文 token 预算"""
+    return int(CONTEXT_TOKEN_BUDGETS.get(model, DEFAULT_CONTEXT_BUDGET))
+
+
+def to_api_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    """转换为发送给 API 的消息格式（去掉时间戳等内部字段）"""
+    return {'role': message['role'], 'content': message.get('content') or ''}
+
+
+def _is_sendable(message: Dict[str, Any]) -> bool:
+    # 工具调用的中间消息（tool 结果、只有 tool_calls 的空助手消息）不回放给模型
+    return message.get('role') in ('system', 'user', 'assistant') and bool(message.get('content'))
+
+
+def _turn_starts(history: List[Dict[str, Any]], floor: int) -> List[int]:
+    """history[floor:] 中每一轮对话（以用户消息开头）的起始下标"""
+    starts = [i for i in range(floor, len(history)) if history[i].get('role') == 'user']
+    if not starts or starts[0] != floor:
+        starts.insert(0, floor)
+    return starts
+
+
+class ContextWindow:
+    """组装结果
+
+    Attributes:
+        messages: 发送给 API 的消息列表
+        cut: history 中第一条被原样保留的消息下标，之前的消息由摘要代替或被省略
+        stats: token 统计信息
+    """
+
+    def __init__(self, messages: List[Dict[str, Any]], cut: int, stats: Dict[str, Any]):
+        self.messages = messages
+        self.cut = cut
+        self.stats = stats
+
+    def needs_summary_update(self, summary_upto: int) -> bool:
+        """是否有被挤出窗口但尚未并入摘要的消息"""
+        return self.cut > summary_upto
+
+
+def build_context_window(system_messages: List[Dict[str, Any]],
+                         history: List[Dict[str, Any]],
+                         current: Dict[str, Any],
+                         budget: int,
+                         summary: Optional[str] = None,
+                         summary_upto: int = 0,
+                         compact_ratio: float = 1.0,
+                         recall: Optional[str] = None) -> ContextWindow:
+    """按 token 预算组装上下文
+
+    Args:
+        system_messages: 系统提示词、用户信息等固定消息
+        history: 已保存的历史消息（下标即消息 seq）
+        current: 本轮用户消息
+        budget: 消息 token 预算
+        summary: 对话头上保存的滚动摘要，覆盖 history[:summary_upto]
+        summary_upto: 摘要覆盖到的消息数
+        compact_ratio: 需要截断时历史按 budget * compact_ratio 填充（1.0 为填满预算）
+        recall: 从其他对话召回的片段，作为系统消息放在本轮消息之前
+    """
+    pinned = [to_api_message(m) for m in system_messages if m.get('content')]
+    current_message = to_api_message(current)
+    recall_message = {'role': 'system', 'content': recall} if recall else None
+    history_tokens = [count_message_tokens(m) if _is_sendable(m) else 0 for m in history]
+
+    pinned_tokens = sum(count_message_tokens(m) for m in pinned) + count_message_tokens(current_message)
+    if recall_message:
+        pinned_tokens += count_message_tokens(recall_message)
+    full_tokens = pinned_tokens + sum(history_tokens)
+
+    summary_message = None
+    if full_tokens <= budget:
+        cut = 0
+    else:
+        # 放不下全部历史：摘要覆盖的部分不再原样发送，剩余预算从最新一轮往前填
+        floor = min(summary_upto, len(history)) if summary else 0
+        if summary:
+            summary_message = {'role': 'system', 'content': f"{SUMMARY_HEADER}\n{summary}"}
+            pinned_tokens += count_message_tokens(summary_message)
+
+        if summary and pinned_tokens + sum(history_tokens[floor:]) <= budget:
+            # 摘要之后的历史全部放得下：截断位置就是摘要边界，与上一轮相同
+            cut = floor
+        else:
+            remaining = int(budget * compact_ratio) - pinned_tokens
+            cut = len(history)
+            starts = _turn_starts(history, floor)
+            for start, end in reversed(list(zip(starts, starts[1:] + [len(history)]))):
+                turn_tokens = sum(history_tokens[start:end])
+                if turn_tokens > remaining:
+                    break
+                remaining -= turn_tokens
+                cut = start
+
+    messages = list(pinned)
+    if summary_message:
+        messages.append(summary_message)
+    messages.extend(to_api_message(m) for m in history[cut:] if _is_sendable(m))
+    if recall_message:
+        messages.append(recall_message)
+    messages.append(current_message)
+
+    used_tokens = sum(count_message_tokens(m) for m in messages)
+    stats = {
+        'budget': budget,
+        'full_tokens': full_tokens,
+        'used_tokens': used_tokens,
+        'saved_tokens': max(0, full_tokens - used_tokens),
+        'history_messages': len(history),
+        'dropped_messages': cut,
+        'summary_used': summary_message is not None,
+        'recall_used': recall_message is not None,
+    }
+    return ContextWindow(messages, cut, stats)
+
+
+def format_messages_for_summary(messages: List[Dict[str, Any]], max_chars: int = 500) -> str:
+    """把待并入摘要的消息整理成纯文本"""
+    role_names = {'user': '用户', 'assistant': '助手', 'tool': '工具结果', 'system': '系统'}
+    lines = []
+    for message in messages:
+        content = message.get('content') or ''
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        if not content:
+            continue
+        if len(content) > max_chars:
+            content = content[:max_chars] + '...'
+        lines.append(f"{role_names.get(message.get('role'), message.get('role'))}: {content}")
+    return '\n'.join(lines)
+
+
+__all__ = [
+    'CHAT_CONTEXT_COMPACT_RATIO', 'CONTEXT_TOKEN_BUDGETS', 'ContextWindow', 'count_tokens', 'count_message_tokens',
+    'get_context_budget', 'build_context_window', 'format_messages_for_summary'
+]
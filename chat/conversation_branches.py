@@ -0,0 +1,198 @@
+"""
+对话分支（写时复制）
+
+编辑之前的某条消息或重新生成回答，原来只能把整段历史复制到一个新的 conversation_id，
+分支越多存储和写入越多。这里改为结构共享：
+
+- 分支在 conversations 表上记录父对话 parent_conversation_id 和分叉点 fork_seq：
+  继承父对话（物化后）seq < fork_seq 的消息，自己只保存 seq >= fork_seq 的消息。
+  seq 沿用父对话的编号，分支的 message_count 就是物化后的消息数，
+  追加写入（save_conversation_to_db）不需要任何改动
+- 读取时沿父对话链向上，按各层负责的 seq 区间用一次查询取出全部消息
+- 重新生成只写一行对话头和新的回答；编辑只写一行对话头、改过的用户消息和回答
+- 删除有分支的对话时，把子分支继承的、由被删对话自己保存的那一段消息复制给子分支，
+  子分支改挂到被删对话的父对话上，其余历史仍然共享
+- 父对话链达到 CONVERSATION_BRANCH_MAX_DEPTH 层时，新分支直接复制继承的消息
+  （fork_seq 记为 0，仍记录父对话），读取时的查询次数不会随分支层数无限增长
+
+这里的函数都在调用方的事务中执行，由调用方提交。
+
+环境变量：
+    CONVERSATION_BRANCH_MAX_DEPTH   父对话链的最大层数，默认 16
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymysql
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+CONVERSATION_BRANCH_MAX_DEPTH = int(os.getenv('CONVERSATION_BRANCH_MAX_DEPTH', '16'))
+
+
+def inherits(header: Dict[str, Any]) -> bool:
+    """对话是否从父对话继承消息"""
+    return bool(header.get('parent_conversation_id')) and bool(header.get('fork_seq'))
+
+
+def branch_ranges(chain: List[Dict[str, Any]]) -> List[Tuple[str, int, Optional[int]]]:
+    """父对话链上每一层负责的 seq 区间
+
+    Args:
+        chain: 对话头列表（conversation_id、parent_conversation_id、fork_seq），从当前对话开始沿父对话链向上
+
+    Returns:
+        [(conversation_id, 起始 seq, 结束 seq)]，结束 seq 不含，None 表示不限；跳过空区间
+    """
+    ranges = []
+    limit = None
+    for header in chain:
+        start = (header.get('fork_seq') or 0) if header.get('parent_conversation_id') else 0
+        if limit is None or start < limit:
+            ranges.append((header['conversation_id'], start, limit))
+            limit = start
+        if not inherits(header):
+            break
+    return ranges
+
+
+def reparent(child_fork: int, parent: Dict[str, Any]) -> Tuple[int, int, Optional[str], Optional[int]]:
+    """父对话被删除时子分支的处理：(需要复制的起始 seq, 结束 seq, 新的父对话, 新的分叉点)"""
+    if not parent.get('parent_conversation_id'):
+        return 0, child_fork, None, None
+    start = parent.get('fork_seq') or 0
+    return start, child_fork, parent['parent_conversation_id'], min(child_fork, start)
+
+
+def load_chain(cursor, username: str, conversation_id: str) -> List[Dict[str, Any]]:
+    """从当前对话开始沿父对话链向上读取对话头，对话不存在时返回空列表"""
+    chain = []
+    current = conversation_id
+    while current and len(chain) <= CONVERSATION_BRANCH_MAX_DEPTH:
+        cursor.execute(
+            "SELECT conversation_id, parent_conversation_id, fork_seq FROM conversations "
+            "WHERE username = %s AND conversation_id = %s",
+            (username, current)
+        )
+        header = cursor.fetchone()
+        if not header:
+            break
+        chain.append(header)
+        current = header['parent_conversation_id'] if inherits(header) else None
+    return chain
+
+
+def read_messages(cursor, username: str, chain: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按父对话链物化对话的全部消息（一次查询）"""
+    ranges = branch_ranges(chain)
+    if not ranges:
+        return []
+    clauses = []
+    params: List[Any] = [username]
+    for conversation_id, start, end in ranges:
+        if end is None:
+            clauses.append("(conversation_id = %s AND seq >= %s)")
+            params += [conversation_id, start]
+        else:
+            clauses.append("(conversation_id = %s AND seq >= %s AND seq < %s)")
+            params += [conversation_id, start, end]
+    cursor.execute(
+        "SELECT message FROM conversation_messages WHERE username = %s AND (" + " OR ".join(clauses) + ") "
+        "ORDER BY seq",
+        params
+    )
+    return [json.loads(row['message']) for row in cursor.fetchall()]
+
+
+def _copy_messages(cursor, username: str, source_id: str, target_id: str, start: int, end: int):
+    cursor.execute(
+        "INSERT INTO conversation_messages (conversation_id, username, seq, role, message, created_at) "
+        "SELECT %s, username, seq, role, message, created_at FROM conversation_messages "
+        "WHERE username = %s AND conversation_id = %s AND seq >= %s AND seq < %s",
+        (target_id, username, source_id, start, end)
+    )
+
+
+def create_branch(cursor, username: str, parent_id: str, fork_seq: int,
+                  conversation_id: str) -> Optional[Tuple[str, int]]:
+    """创建分支对话头：继承父对话的前 fork_seq 条消息
+
+    Returns:
+        None 表示成功，否则为 (错误信息, HTTP 状态码)
+    """
+    cursor.execute("SELECT 1 FROM conversations WHERE username = %s AND conversation_id = %s",
+                   (username, conversation_id))
+    if cursor.fetchone():
+        return '对话已存在', 409
+
+    cursor.execute(
+        "SELECT message_count, title, summary, summary_upto FROM conversations "
+        "WHERE username = %s AND conversation_id = %s FOR UPDATE",
+        (username, parent_id)
+    )
+    parent = cursor.fetchone()
+    if not parent:
+        return '父对话不存在或无权访问', 404
+    if fork_seq > parent['message_count']:
+        return f"分叉点超出父对话的消息数（{parent['message_count']}）", 400
+
+    own_fork = fork_seq
+    chain = load_chain(cursor, username, parent_id)
+    if len(chain) >= CONVERSATION_BRANCH_MAX_DEPTH:
+        # 父对话链太深：复制继承的消息，新分支不再依赖父对话链
+        leaf = {'conversation_id': conversation_id, 'parent_conversation_id': parent_id, 'fork_seq': fork_seq}
+        for source_id, start, end in branch_ranges([leaf] + chain)[1:]:
+            _copy_messages(cursor, username, source_id, conversation_id, start, end)
+        own_fork = 0
+
+    # 父对话的滚动摘要只覆盖分叉点之前的消息时，分支可以直接沿用
+    summary, summary_upto = None, 0
+    if parent['summary'] and parent['summary_upto'] <= fork_seq:
+        summary, summary_upto = parent['summary'], parent['summary_upto']
+
+    try:
+        cursor.execute(
+            "INSERT INTO conversations (conversation_id, username, parent_conversation_id, fork_seq, "
+            "message_count, title, summary, summary_upto, last_message_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)",
+            (conversation_id, username, parent_id, own_fork, fork_seq, parent['title'], summary, summary_upto)
+        )
+    except pymysql.err.IntegrityError:
+        return '对话已存在', 409
+    return None
+
+
+def detach_branches(cursor, username: str, conversation: Dict[str, Any]) -> List[Tuple[str, int, int]]:
+    """删除对话前让它的直接子分支不再依赖它
+
+    Args:
+        conversation: 被删对话的对话头（conversation_id、parent_conversation_id、fork_seq）
+
+    Returns:
+        [(子分支, 起始 seq, 结束 seq)]：从被删对话复制给各子分支的消息区间
+    """
+    cursor.execute(
+        "SELECT conversation_id, fork_seq FROM conversations "
+        "WHERE username = %s AND parent_conversation_id = %s FOR UPDATE",
+        (username, conversation['conversation_id'])
+    )
+    copied = []
+    for child in cursor.fetchall():
+        start, end, parent_id, fork_seq = reparent(child['fork_seq'] or 0, conversation)
+        if start < end:
+            _copy_messages(cursor, username, conversation['conversation_id'], child['conversation_id'], start, end)
+            copied.append((child['conversation_id'], start, end))
+        cursor.execute(
+            "UPDATE conversations SET parent_conversation_id = %s, fork_seq = %s, updated_at = updated_at "
+            "WHERE username = %s AND conversation_id = %s",
+            (parent_id, fork_seq, username, child['conversation_id'])
+        )
+    return copied
+
+
+__all__ = ['CONVERSATION_BRANCH_MAX_DEPTH', 'branch_ranges', 'create_branch', 'detach_branches', 'inherits',
+           'load_chain', 'read_messages', 'reparent']
@@ -0,0 +1,362 @@
+"""
+长期对话记忆
+
+用户经常在新对话里追问以前对话中的内容，目前只能一直在同一个对话里聊下去，
+历史越来越长，保存和提示词都随之膨胀。这里为每个用户的历史对话建一个检索索引：
+
+- 每轮对话结束后，把「用户消息 + 最终回答」作为一个片段写入 conversation_memory 表（后台线程）
+- 片段用本地哈希向量化：分词与工具路由相同（英文单词、中文 bigram），词频取对数后
+  哈希到固定维度，不依赖外部 embedding 服务
+- 检索时把该用户的片段向量加载为 numpy 矩阵并按用户缓存在进程内，之后只增量读取新写入的片段；
+  按该用户语料计算各维度的 IDF 加权后与本轮消息做余弦相似度，取 top-k
+- /api/chat 把其他对话中最相关的几个片段放在本轮消息之前，代替整段重放历史
+
+分支对话的历史包含父对话链上继承的消息，这些轮次的片段记在父对话名下，检索时按父对话链的
+seq 区间排除，不会作为“以前的对话”重复召回。
+
+删除对话时同时删除其片段；子分支复制了被删对话的一段消息时，这段消息的片段改记到子分支名下。
+其他进程缓存的索引在 MEMORY_CACHE_TTL 后完整重新加载时更新。
+
+环境变量：
+    MEMORY_ENABLED         是否启用，默认 1
+    MEMORY_TOP_K           每轮最多召回的片段数，默认 3
+    MEMORY_MIN_SCORE       召回的最低相似度，默认 0.15
+    MEMORY_VECTOR_DIM      哈希向量维度，默认 512
+    MEMORY_SNIPPET_CHARS   片段中用户消息和回答各保留的最大字符数，默认 500
+    MEMORY_MAX_ITEMS       每个用户参与检索的最近片段数，默认 2000
+    MEMORY_CACHE_USERS     进程内缓存索引的最大用户数，默认 100
+    MEMORY_CACHE_TTL       索引完整重新加载的间隔（秒），默认 600，其间只增量读取新片段
+"""
+
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from db import get_db_connection
+from tool_router import tokenize
+
+if TYPE_CHECKING:
+    import numpy
+
+load_dotenv()
+
+
+MEMORY_ENABLED = os.getenv('MEMORY_ENABLED', '1') not in ('0', 'false', 'False', '')
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', '3'))
+MEMORY_MIN_SCORE = float(os.getenv('MEMORY_MIN_SCORE', '0.15'))
+MEMORY_VECTOR_DIM = int(os.getenv('MEMORY_VECTOR_DIM', '512'))
+MEMORY_SNIPPET_CHARS = int(os.getenv('MEMORY_SNIPPET_CHARS', '500'))
+MEMORY_MAX_ITEMS = int(os.getenv('MEMORY_MAX_ITEMS', '2000'))
+MEMORY_CACHE_USERS = int(os.getenv('MEMORY_CACHE_USERS', '100'))
+MEMORY_CACHE_TTL = float(os.getenv('MEMORY_CACHE_TTL', '600'))
+
+# 少于这么多个不同的词（如“你好”“怎么样”）时不检索：太笼统，召回的多半是无关片段
+MIN_QUERY_TOKENS = 3
+
+MEMORY_HEADER = '以下是与本轮问题相关的历史对话片段（来自用户以前的其他对话），仅供参考：'
+
+
+def _clip(text: str, max_chars: int) -> str:
+    text = ' '.join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars] + '...'
+
+
+def turn_snippet(question: str, answer: str, max_chars: int = MEMORY_SNIPPET_CHARS) -> str:
+    """一轮对话的索引片段"""
+    return f"用户: {_clip(question, max_chars)}\n助手: {_clip(answer, max_chars)}"
+
+
+def hash_vector(text: str, dim: int = MEMORY_VECTOR_DIM) -> 'numpy.ndarray':
+    """哈希向量化：每个词按稳定哈希落到一个维度，符号由哈希的最高位决定，权重为 1 + log(词频)，L2 归一化"""
+    import numpy as np
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for token, count in Counter(tokenize(text)).items():
+        value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+        vector[value % dim] += (1.0 + math.log(count)) * (-1.0 if value >> 63 else 1.0)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def format_memories(memories: List[Dict[str, Any]]) -> Optional[str]:
+    """把召回的片段整理成一条系统消息的内容"""
+    if not memories:
+        return None
+    return '\n\n'.join([MEMORY_HEADER] + [memory['content'] for memory in memories])
+
+
+class _UserIndex:
+    """一个用户的片段矩阵（行向量已归一化）及按该用户语料计算的 IDF 加权矩阵"""
+
+    def __init__(self, dim: int):
+        import numpy as np
+
+        self.ids: List[int] = []
+        self.conversation_ids: List[str] = []
+        self.seqs: List[int] = []
+        self.contents: List[str] = []
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        self.last_id = 0
+        self.loaded_at = time.monotonic()
+        self._weighted = None
+
+    def extend(self, rows: List[Dict[str, Any]], dim: int, max_items: int):
+        import numpy as np
+
+        vectors = []
+        for row in rows:
+            vector = None
+            if row.get('vector') and len(row['vector']) == dim * 4:
+                vector = np.frombuffer(row['vector'], dtype=np.float32)
+            if vector is None:
+                # 迁移回填的片段没有向量，或向量维度已调整：按片段文本重新计算
+                vector = hash_vector(row['content'], dim)
+            vectors.append(vector)
+            self.ids.append(row['id'])
+            self.conversation_ids.append(row['conversation_id'])
+            self.seqs.append(row['seq'])
+            self.contents.append(row['content'])
+            self.last_id = max(self.last_id, row['id'])
+        if vectors:
+            self.matrix = np.vstack([self.matrix] + vectors)
+            if len(self.ids) > max_items:
+                drop = len(self.ids) - max_items
+                del self.ids[:drop], self.conversation_ids[:drop], self.seqs[:drop], self.contents[:drop]
+                self.matrix = self.matrix[drop:]
+            self._weighted = None
+
+    def weighted(self):
+        """(IDF 权重, 加权后重新归一化的矩阵)，在索引变化后第一次检索时计算"""
+        import numpy as np
+
+        if self._weighted is None:
+            document_frequency = np.count_nonzero(self.matrix, axis=0)
+            idf = np.log((len(self.ids) + 1) / (document_frequency + 1)).astype(np.float32) + 1
+            matrix = self.matrix * idf
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            self._weighted = (idf, matrix / norms)
+        return self._weighted
+
+
+class ConversationMemory:
+    """按用户划分的历史对话片段检索索引"""
+
+    def __init__(self, enabled: bool = MEMORY_ENABLED, dim: int = MEMORY_VECTOR_DIM,
+                 max_items: int = MEMORY_MAX_ITEMS, max_users: int = MEMORY_CACHE_USERS,
+                 ttl: float = MEMORY_CACHE_TTL):
+        self.enabled = enabled
+        self.dim = dim
+        self.max_items = max_items
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._users: 'OrderedDict[str, _UserIndex]' = OrderedDict()
+        self.indexed = 0
+        self.searches = 0
+        self.recalled = 0
+        self.full_loads = 0
+        self.errors = 0
+        self.last_search_ms = None
+
+    def _error(self, action: str, e: Exception):
+        print(f"⚠️  {action}: {e}")
+        with self._lock:
+            self.errors += 1
+
+    # ---- 存储 ----
+
+    def _insert_row(self, username: str, conversation_id: str, seq: int, content: str, vector: bytes):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT IGNORE INTO conversation_memory (username, conversation_id, seq, content, vector) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    (username, conversation_id, seq, content, vector)
+                )
+            conn.commit()
+
+    def _fetch_rows(self, username: str, after_id: int, limit: int) -> List[Dict[str, Any]]:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                if after_id:
+                    cursor.execute(
+                        "SELECT id, conversation_id, seq, content, vector FROM conversation_memory "
+                        "WHERE username = %s AND id > %s ORDER BY id LIMIT %s",
+                        (username, after_id, limit)
+                    )
+                    return list(cursor.fetchall())
+                # 完整加载只取最近的 limit 条
+                cursor.execute(
+                    "SELECT id, conversation_id, seq, content, vector FROM conversation_memory "
+                    "WHERE username = %s ORDER BY id DESC LIMIT %s",
+                    (username, limit)
+                )
+                return list(reversed(cursor.fetchall()))
+
+    def _copy_rows(self, username: str, source_id: str, target_id: str, start: int, end: int):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT IGNORE INTO conversation_memory (username, conversation_id, seq, content, vector) "
+                    "SELECT username, %s, seq, content, vector FROM conversation_memory "
+                    "WHERE username = %s AND conversation_id = %s AND seq >= %s AND seq < %s",
+                    (target_id, username, source_id, start, end)
+                )
+            conn.commit()
+
+    def _delete_rows(self, username: str, conversation_id: str):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM conversation_memory WHERE username = %s AND conversation_id = %s",
+                               (username, conversation_id))
+            conn.commit()
+
+    # ---- 写入与检索 ----
+
+    def add_turn(self, username: str, conversation_id: str, seq: int, question: str, answer: str):
+        """把一轮对话写入索引（在后台线程中调用）；seq 为该轮用户消息的 seq，重复写入会被忽略"""
+        if not self.enabled or not question or not answer:
+            return
+        try:
+            content = turn_snippet(question, answer)
+            self._insert_row(username, conversation_id, seq, content, hash_vector(content, self.dim).tobytes())
+            with self._lock:
+                self.indexed += 1
+        except Exception as e:
+            self._error("写入对话记忆失败", e)
+
+    def _index_for(self, username: str) -> _UserIndex:
+        """返回用户的索引：不在缓存中或超过 TTL 时完整加载，否则只读取新增的片段"""
+        with self._lock:
+            index = self._users.get(username)
+            if index is not None and time.monotonic() - index.loaded_at > self.ttl:
+                index = None
+            if index is not None:
+                self._users.move_to_end(username)
+
+        if index is None:
+            index = _UserIndex(self.dim)
+            index.extend(self._fetch_rows(username, 0, self.max_items), self.dim, self.max_items)
+            with self._lock:
+                self.full_loads += 1
+                self._users[username] = index
+                self._users.move_to_end(username)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            return index
+
+        rows = self._fetch_rows(username, index.last_id, self.max_items)
+        with self._lock:
+            # 并发的两次增量读取可能拿到相同的行，只追加比当前 last_id 新的部分
+            index.extend([row for row in rows if row['id'] > index.last_id], self.dim, self.max_items)
+        return index
+
+    def search(self, username: str, query: str, exclude_conversation: Optional[str] = None,
+               top_k: int = MEMORY_TOP_K, min_score: float = MEMORY_MIN_SCORE,
+               exclude_ranges: Iterable[Tuple[str, int, Optional[int]]] = ()) -> List[Dict[str, Any]]:
+        """召回与 query 最相关的片段，按相似度从高到低
+
+        Args:
+            exclude_conversation: 不召回该对话的片段
+            exclude_ranges: [(对话, 起始 seq, 结束 seq)]，结束 seq 为 None 表示不限；
+                不召回这些区间内的片段（分支从父对话链继承、已经在当前历史中的轮次）
+        """
+        if not self.enabled or top_k <= 0 or len(set(tokenize(query))) < MIN_QUERY_TOKENS:
+            return []
+        import numpy as np
+
+        start = time.monotonic()
+        try:
+            index = self._index_for(username)
+            with self._lock:
+                if not index.ids:
+                    return []
+                idf, matrix = index.weighted()
+                conversation_ids = list(index.conversation_ids)
+                seqs = list(index.seqs)
+                contents = list(index.contents)
+
+            query_vector = hash_vector(query, self.dim) * idf
+            norm = np.linalg.norm(query_vector)
+            if norm == 0:
+                return []
+            scores = matrix @ (query_vector / norm)
+            excluded = list(exclude_ranges)
+            if exclude_conversation is not None:
+                excluded.append((exclude_conversation, 0, None))
+            if excluded:
+                id_array, seq_array = np.array(conversation_ids), np.array(seqs)
+                for conversation_id, start, end in excluded:
+                    mask = (id_array == conversation_id) & (seq_array >= start)
+                    if end is not None:
+                        mask &= seq_array < end
+                    scores[mask] = -1
+            count = min(top_k, len(scores))
+            top = np.argpartition(-scores, count - 1)[:count]
+            top = top[np.argsort(-scores[top])]
+            memories = [{
+                'conversation_id': conversation_ids[i],
+                'seq': seqs[i],
+                'content': contents[i],
+                'score': round(float(scores[i]), 4)
+            } for i in top if scores[i] >= min_score]
+        except Exception as e:
+            self._error("检索对话记忆失败", e)
+            return []
+
+        with self._lock:
+            self.searches += 1
+            self.recalled += len(memories)
+            self.last_search_ms = round((time.monotonic() - start) * 1000, 2)
+        return memories
+
+    def forget_conversation(self, username: str, conversation_id: str,
+                            handover: Iterable[Tuple[str, int, int]] = ()):
+        """删除对话的全部片段，并丢弃该用户在本进程缓存的索引
+
+        Args:
+            handover: [(子分支, 起始 seq, 结束 seq)]：子分支复制了被删对话这段消息，
+                其中的片段先改记到子分支名下再删除
+        """
+        if not self.enabled:
+            return
+        try:
+            for target_id, start, end in handover:
+                self._copy_rows(username, conversation_id, target_id, start, end)
+            self._delete_rows(username, conversation_id)
+        except Exception as e:
+            self._error("删除对话记忆失败", e)
+        with self._lock:
+            self._users.pop(username, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'dim': self.dim,
+                'cached_users': len(self._users),
+                'cached_items': sum(len(index.ids) for index in self._users.values()),
+                'cached_mb': round(sum(index.matrix.nbytes for index in self._users.values()) * 2 / 1048576, 2),
+                'indexed': self.indexed,
+                'searches': self.searches,
+                'recalled': self.recalled,
+                'full_loads': self.full_loads,
+                'errors': self.errors,
+                'last_search_ms': self.last_search_ms,
+            }
+
+
+conversation_memory = ConversationMemory()
+
+
+__all__ = ['MEMORY_ENABLED', 'MEMORY_TOP_K', 'MEMORY_MIN_SCORE', 'MEMORY_VECTOR_DIM', 'ConversationMemory',
+           'conversation_memory', 'format_memories', 'hash_vector', 'turn_snippet']
@@ -0,0 +1,482 @@
+"""
+对话消息的延迟写入（write-behind）
+
+/api/chat 的生成任务原来在发送 done 事件之前同步写数据库（逐条 JSON 序列化、锁对话头、批量 INSERT），
+回复已经结束，客户端还要再等一次数据库往返，生成线程也一直被占用。
+
+这里把本轮新增的消息先追加到本进程的 WAL 文件（一行一个 JSON 条目，默认 fsync），立即返回；
+后台线程每隔 CONVERSATION_FLUSH_INTERVAL 秒把积累的条目按对话合并后批量写入数据库，
+写入成功后从 WAL 中移除：
+
+- 读己之写：get_conversation 等读取接口把尚未写入的消息按 seq 补在数据库结果之后。
+  除了本进程的队列，还读取同一 WAL 目录下其他进程的 WAL 文件，下一轮请求落到哪个工作进程
+  都能读到上一轮的消息
+- 崩溃恢复：启动时接管已退出进程（或本进程上一次运行）留下的 WAL 文件并重放；重放的条目按
+  base_seq 跳过数据库中已经存在的部分，写入成功但尚未从 WAL 移除的条目不会重复
+- 数据库暂时不可用时条目保留在 WAL 中，按指数退避重试
+
+WAL 目录需要在本机磁盘上（按 PID 判断进程是否存活），同一台机器上的所有工作进程使用同一个目录。
+
+多个工作进程同时延迟写入同一对话时，每个条目带着生成时看到的 base_seq 写入：数据库的消息条数
+小于 base_seq（之前的消息还在其他进程的队列里）时先不写，等待 CONVERSATION_GAP_TIMEOUT 秒后
+仍然缺失才追加到末尾；大于 base_seq 时逐条比较，已写入的部分跳过，被其他请求占用的 seq
+则整体追加到末尾，不会覆盖或错位。
+
+环境变量：
+    CONVERSATION_WRITE_BEHIND     是否启用延迟写入，默认 1（0 时同步写数据库）
+    CONVERSATION_WAL_DIR          WAL 目录，默认 chat/data/conversation_wal
+    CONVERSATION_FLUSH_INTERVAL   批量写入间隔（秒），默认 0.2
+    CONVERSATION_FLUSH_BATCH      每批最多写入的条目数，默认 200
+    CONVERSATION_WAL_FSYNC        每次追加后 fsync，默认 1
+    CONVERSATION_GAP_TIMEOUT      等待之前的消息写入的最长时间（秒），默认 30
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERSATION_WRITE_BEHIND = os.getenv('CONVERSATION_WRITE_BEHIND', '1') not in ('0', 'false', 'False', '')
+CONVERSATION_WAL_DIR = os.getenv('CONVERSATION_WAL_DIR', os.path.join(BASE_DIR, 'data', 'conversation_wal'))
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv('CONVERSATION_FLUSH_INTERVAL', '0.2'))
+CONVERSATION_FLUSH_BATCH = int(os.getenv('CONVERSATION_FLUSH_BATCH', '200'))
+CONVERSATION_WAL_FSYNC = os.getenv('CONVERSATION_WAL_FSYNC', '1') not in ('0', 'false', 'False', '')
+CONVERSATION_GAP_TIMEOUT = float(os.getenv('CONVERSATION_GAP_TIMEOUT', '30'))
+
+# 写入失败后的重试间隔上限（秒）
+MAX_RETRY_DELAY = 30
+# wait_flushed 等待对话的消息（包括其他进程的）写入数据库的默认时间（秒）
+FLUSH_WAIT_TIMEOUT = 5.0
+
+# save(conversation_id, username, messages, base_seq)：base_seq 为 None 时直接追加到末尾；
+# 否则 messages[0] 的 seq 应为 base_seq：数据库中已有且内容相同的部分跳过，
+# seq 被其他消息占用时整体追加到末尾，数据库的消息条数不足 base_seq 时抛出 SequenceGapError
+SaveFunction = Callable[[str, str, List[Dict[str, Any]], Optional[int]], None]
+
+
+class SequenceGapError(Exception):
+    """数据库中的消息条数少于条目的 base_seq：之前的消息还没有写入"""
+
+    def __init__(self, stored_count: int, base_seq: int):
+        super().__init__(f"数据库中只有 {stored_count} 条消息，条目从第 {base_seq} 条开始")
+        self.stored_count = stored_count
+        self.base_seq = base_seq
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_pending(stored: List[Dict[str, Any]], pending: List[Tuple[int, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """把尚未写入的 (seq, 消息) 按 seq 补在数据库结果之后（数据库中已有的 seq 和重复的 seq 跳过）"""
+    messages = list(stored)
+    for seq, message in sorted(pending, key=lambda item: item[0]):
+        if seq >= len(messages):
+            messages.append(message)
+    return messages
+
+
+def _entry_messages(entries: List[Dict[str, Any]], conversation_id: str,
+                    username: str) -> List[Tuple[int, Dict[str, Any]]]:
+    """条目中属于某个对话的 (seq, 消息)"""
+    return [(entry['base_seq'] + i, message)
+            for entry in entries
+            if entry['conversation_id'] == conversation_id and entry['username'] == username
+            for i, message in enumerate(entry['messages'])]
+
+
+class ConversationWriter:
+    """WAL + 后台批量写入"""
+
+    def __init__(self, directory: str = CONVERSATION_WAL_DIR, interval: float = CONVERSATION_FLUSH_INTERVAL,
+                 batch_size: int = CONVERSATION_FLUSH_BATCH, fsync: bool = CONVERSATION_WAL_FSYNC,
+                 enabled: bool = CONVERSATION_WRITE_BEHIND):
+        self.directory = directory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.enabled = enabled
+        self._save: Optional[SaveFunction] = None
+        self._cond = threading.Condition()
+        # 同一时间只有一批在写数据库（后台线程、手动 flush、discard 之间互斥）
+        self._flush_lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        self._next_id = 1
+        self._pid: Optional[int] = None
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._failures_in_row = 0
+        self.enqueued = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.replayed = 0
+        self.gap_waits = 0
+        self.resequenced = 0
+        self.peer_reads = 0
+        self.last_flush_ms: Optional[float] = None
+
+    def configure(self, save: SaveFunction):
+        """设置写数据库的函数（应用导入时调用，不启动线程）"""
+        self._save = save
+
+    @property
+    def wal_path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.wal")
+
+    def start(self):
+        """打开本进程的 WAL，重放遗留的 WAL 文件并启动后台写入线程（可重复调用，fork 后自动重新启动）"""
+        if not self.enabled or self._save is None:
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            # fork 出的子进程不接管父进程的条目和文件句柄（父进程的 WAL 由它自己或之后的重放处理）
+            self._pending = []
+            self._stopping = False
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.exists(self.wal_path) and os.path.getsize(self.wal_path) > 0:
+                # PID 被复用：本进程上一次运行留下的 WAL，改名后与其他遗留文件一起重放
+                os.rename(self.wal_path, os.path.join(self.directory, f"{self._pid}.replay-{self._pid}"))
+            self._file = open(self.wal_path, 'a', encoding='utf-8')
+            self._replay_orphans()
+            self._thread = threading.Thread(target=self._run, name='conversation-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+        print(f"📝 对话延迟写入已启动（WAL: {self.wal_path}）")
+
+    def _replay_orphans(self):
+        """接管已退出进程留下的 WAL（需持有锁）
+
+        <pid>.wal 是进程 pid 的 WAL，<pid>.replay-<认领者> 是正在被重放的文件；
+        所属进程已退出的文件先改名认领（多个进程同时启动时只有一个能改名成功），
+        条目写入本进程 WAL 后删除。
+        """
+        me = os.getpid()
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.wal'):
+                owner = name[:-len('.wal')]
+            elif '.replay-' in name:
+                owner = name.rsplit('-', 1)[1]
+            else:
+                continue
+            path = os.path.join(self.directory, name)
+            if not owner.isdigit() or path == self.wal_path:
+                continue
+            if int(owner) != me and _pid_alive(int(owner)):
+                continue
+
+            claimed = os.path.join(self.directory, f"{name.split('.', 1)[0]}.replay-{me}")
+            if path != claimed:
+                try:
+                    os.rename(path, claimed)
+                except FileNotFoundError:
+                    # 被其他进程抢先认领
+                    continue
+
+            entries = []
+            with open(claimed, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # 崩溃时没写完的最后一行
+                        continue
+            for entry in entries:
+                self._write_entry(dict(entry, replayed=True))
+            os.remove(claimed)
+            self.replayed += len(entries)
+            if entries:
+                print(f"♻️  重放对话 WAL {name}: {len(entries)} 条")
+
+    def _write_entry(self, entry: Dict[str, Any]):
+        """追加一个条目到 WAL 和内存队列（需持有锁）"""
+        entry['id'] = self._next_id
+        self._next_id += 1
+        self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._pending.append(entry)
+
+    def append(self, conversation_id: str, username: str, base_seq: int, messages: List[Dict[str, Any]]):
+        """追加一轮新增的消息（messages[0] 的 seq 为 base_seq）；未启用时同步写数据库"""
+        if not messages:
+            return
+        if not self.enabled:
+            self._save(conversation_id, username, messages, None)
+            return
+        self.start()
+        with self._cond:
+            self._write_entry({
+                'conversation_id': conversation_id,
+                'username': username,
+                'base_seq': base_seq,
+                'messages': messages,
+                'queued_at': time.time(),
+            })
+            self.enqueued += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+
+    def pending(self, conversation_id: str, username: str) -> List[Tuple[int, Dict[str, Any]]]:
+        """尚未写入数据库的消息 [(seq, 消息)]，包括同一 WAL 目录下其他进程的
+        （在读取数据库之前调用，配合 merge_pending）"""
+        with self._cond:
+            local = _entry_messages(self._pending, conversation_id, username)
+        return local + self._peer_pending(conversation_id, username)
+
+    def _peer_pending(self, conversation_id: str, username: str) -> List[Tuple[int, Dict[str, Any]]]:
+        """读取其他进程的 WAL 中某个对话的消息
+
+        其他进程写入数据库后才从 WAL 中移除条目，这里读到的条目可能已经在数据库中，
+        merge_pending 按 seq 跳过；WAL 整体替换是原子的，正在追加的最后一行不完整时忽略。
+        """
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        own = os.path.basename(self.wal_path)
+        # 先按对话 ID 过滤行，只解析相关的条目
+        needle = json.dumps(conversation_id, ensure_ascii=False)
+        entries = []
+        for name in os.listdir(self.directory):
+            if name == own or not (name.endswith('.wal') or '.replay-' in name):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if needle not in line:
+                            continue
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            continue
+            except FileNotFoundError:
+                # 重放或整理时被改名、删除
+                continue
+        if not entries:
+            return []
+        with self._cond:
+            self.peer_reads += 1
+        return _entry_messages(entries, conversation_id, username)
+
+    def wait_flushed(self, conversation_id: str, username: str, timeout: float = FLUSH_WAIT_TIMEOUT) -> bool:
+        """写入某个对话在本进程排队的消息，并等待其他进程写完该对话的消息；超时返回 False
+
+        分支、删除这类直接操作数据库的接口在此之前调用。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                local = _entry_messages(self._pending, conversation_id, username)
+            if local:
+                self.flush()
+            elif not self._peer_pending(conversation_id, username):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(self.interval, 0.1))
+
+    def discard(self, conversation_id: str, username: str) -> int:
+        """丢弃某个对话尚未写入的消息（删除对话时调用），返回丢弃的条目数"""
+        with self._flush_lock:
+            with self._cond:
+                before = len(self._pending)
+                self._pending = [entry for entry in self._pending
+                                 if not (entry['conversation_id'] == conversation_id and entry['username'] == username)]
+                dropped = before - len(self._pending)
+            if dropped:
+                self._compact()
+            return dropped
+
+    def _compact(self):
+        """按内存队列重写 WAL（需持有 _flush_lock，不能持有 _cond）
+
+        队列为空时直接清空文件。否则先在锁外把队列快照写入临时文件，append 不必等待磁盘写入；
+        再在锁内补上期间新追加的条目后替换 WAL。条目只在持有 _flush_lock 时移除，
+        快照之后队列只会增加。
+        """
+        with self._cond:
+            if self._file is None:
+                return
+            if not self._pending:
+                self._file.truncate(0)
+                self._file.seek(0)
+                return
+            snapshot = list(self._pending)
+
+        tmp_path = f"{self.wal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in snapshot:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+        with self._cond:
+            if self._file is None:
+                os.remove(tmp_path)
+                return
+            last_id = snapshot[-1]['id']
+            newer = [entry for entry in self._pending if entry['id'] > last_id]
+            if newer:
+                with open(tmp_path, 'a', encoding='utf-8') as f:
+                    for entry in newer:
+                        f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.wal_path)
+            self._file = open(self.wal_path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def _groups(batch: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """按对话分组；同一对话 seq 首尾相接的条目合并为一次写入"""
+        by_conversation: Dict[Tuple[str, str], List[List[Dict[str, Any]]]] = {}
+        for entry in batch:
+            groups = by_conversation.setdefault((entry['username'], entry['conversation_id']), [])
+            if groups:
+                last = groups[-1][-1]
+                if entry['base_seq'] == last['base_seq'] + len(last['messages']):
+                    groups[-1].append(entry)
+                    continue
+            groups.append([entry])
+        return [groups for groups in by_conversation.values()]
+
+    def _save_group(self, group: List[Dict[str, Any]]):
+        """按 base_seq 写入一组条目；之前的消息迟迟没有写入时追加到末尾"""
+        first = group[0]
+        messages = [message for entry in group for message in entry['messages']]
+        try:
+            self._save(first['conversation_id'], first['username'], messages, first['base_seq'])
+        except SequenceGapError as e:
+            waited = time.time() - first.get('queued_at', 0)
+            if waited < CONVERSATION_GAP_TIMEOUT:
+                with self._cond:
+                    self.gap_waits += 1
+                raise
+            print(f"⚠️  对话 {first['conversation_id']} 等待之前的消息 {waited:.0f} 秒仍未写入（{e}），追加到末尾")
+            self._save(first['conversation_id'], first['username'], messages, None)
+            with self._cond:
+                self.resequenced += 1
+
+    def flush(self) -> int:
+        """写入一批条目，返回写入成功的条目数"""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        with self._cond:
+            batch = list(self._pending[:self.batch_size])
+        if not batch:
+            return 0
+
+        started = time.monotonic()
+        done = set()
+        failed = False
+        for groups in self._groups(batch):
+            # 同一对话按顺序写入，前一组失败时后面的不再写（保持 seq 顺序）
+            for group in groups:
+                first = group[0]
+                try:
+                    self._save_group(group)
+                except SequenceGapError as e:
+                    failed = True
+                    print(f"⏳ 对话 {first['conversation_id']} 之前的消息尚未写入，稍后重试: {e}")
+                    break
+                except Exception as e:
+                    failed = True
+                    print(f"⚠️  对话 {first['conversation_id']} 写入数据库失败，稍后重试: {e}")
+                    break
+                done.update(entry['id'] for entry in group)
+
+        with self._cond:
+            self._pending = [entry for entry in self._pending if entry['id'] not in done]
+        # 没有写入成功的条目（如数据库不可用）时 WAL 不变，不必重写
+        if done:
+            self._compact()
+        with self._cond:
+            self.flushed += len(done)
+            self.batches += 1
+            if failed:
+                self.failures += 1
+                self._failures_in_row += 1
+            else:
+                self._failures_in_row = 0
+            self.last_flush_ms = round((time.monotonic() - started) * 1000, 1)
+        return len(done)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # 攒一个间隔的条目再写；队列满或正在停止时立即写
+                if len(self._pending) < self.batch_size and not self._stopping:
+                    self._cond.wait(self.interval)
+            self.flush()
+            if self._failures_in_row:
+                with self._cond:
+                    if self._stopping:
+                        # 停止时数据库不可用：条目留在 WAL 中，下次启动重放
+                        return
+                    self._cond.wait(min(MAX_RETRY_DELAY, self.interval * (2 ** self._failures_in_row)))
+
+    def stop(self, timeout: float = 10):
+        """写完剩余条目后停止后台线程（进程退出时调用）"""
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        thread.join(timeout)
+        with self._cond:
+            self._thread = None
+            self._pid = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                # 队列已经写完：删除空的 WAL
+                if not self._pending and os.path.exists(self.wal_path):
+                    os.remove(self.wal_path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'pending': len(self._pending),
+                'enqueued': self.enqueued,
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'failures': self.failures,
+                'replayed': self.replayed,
+                'gap_waits': self.gap_waits,
+                'resequenced': self.resequenced,
+                'peer_reads': self.peer_reads,
+                'last_flush_ms': self.last_flush_ms,
+            }
+
+
+conversation_writer = ConversationWriter()
+
+
+__all__ = ['ConversationWriter', 'SequenceGapError', 'conversation_writer', 'merge_pending']
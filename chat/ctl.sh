@@ -5,7 +5,10 @@ cd "$SCRIPT_DIR"
 
 PORT=8000
 LOG_FILE="$SCRIPT_DIR/chat.log"
-APP_FILE="app.py"
+APP_FILE="serve.py"
+# 工作进程之间没有粘性路由，断线续传的流式任务在进程内，默认单进程（见 serve.py）
+WORKERS="${SERVER_WORKERS:-1}"
+PID_FILE="$SCRIPT_DIR/chat.pid"
 
 is_running() {
     if netstat -tuln 2>/dev/null | grep -q ":${PORT} " || ss -tuln 2>/dev/null | grep -q ":${PORT} "; then
@@ -17,6 +20,14 @@ is_running() {
 
 get_pid_by_port() {
     local pid
+    # 多进程模式下优先使用主进程 PID（停止主进程会同时停止所有工作进程）
+    if [ -f "$PID_FILE" ]; then
+        pid=$(cat "$PID_FILE")
+        if [ -n "$pid" ] && kill -0 "$pid" 2>/dev/null; then
+            echo "$pid"
+            return 0
+        fi
+    fi
     pid=$(lsof -ti:${PORT} 2>/dev/null | head -1)
     if [ -n "$pid" ]; then
         echo "$pid"
@@ -72,7 +83,7 @@ except Exception as e:
     echo "=========================================="
     echo ""
 
-    nohup python $APP_FILE >> "$LOG_FILE" 2>&1 &
+    nohup python $APP_FILE --port "$PORT" --workers "$WORKERS" >> "$LOG_FILE" 2>&1 &
     local pid=$!
     sleep 1
     
@@ -0,0 +1,405 @@
+"""
+数据库连接池模块
+
+app.py、scheduler.py 以及各个技能共用同一个 MySQL 连接池，避免每次查询都重新
+建立 TCP 连接并完成认证握手。
+
+- 连接池大小有上限，池满时调用方排队等待（超时抛出 PoolTimeoutError）
+- 取出连接时对空闲过久的连接做 ping 健康检查，失效连接直接丢弃重建
+- 空闲超时或存活超过 recycle 时间的连接会被回收
+- get_pool_stats() 返回使用中/空闲连接数及等待耗时等统计信息
+
+在 Flask 应用中调用 init_app(app) 后，同一个请求内的所有 get_db_connection()
+共享一个连接（绑定在 flask.g 上），请求结束（包括流式响应结束）时归还连接池。
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+from dotenv import load_dotenv
+
+try:
+    from flask import g, has_app_context
+except ImportError:
+    g = None
+    has_app_context = None
+
+# 数据库配置在模块导入时读取，需先加载 .env
+load_dotenv()
+
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'port': int(os.getenv('DB_PORT', 3306)),
+    'user': os.getenv('DB_USER', 'root'),
+    'password': os.getenv('DB_PASSWORD', ''),
+    'database': os.getenv('DB_NAME', 'arc_logi_chat'),
+    'charset': os.getenv('DB_CHARSET', 'utf8mb4'),
+    'cursorclass': pymysql.cursors.DictCursor
+}
+
+# 连接池配置
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+DB_POOL_RECYCLE = float(os.getenv('DB_POOL_RECYCLE', 3600))
+DB_POOL_PING_INTERVAL = float(os.getenv('DB_POOL_PING_INTERVAL', 30))
+
+
+class PoolTimeoutError(Exception):
+    """在超时时间内未能从连接池获取到连接"""
+
+
+def _end_transaction(raw):
+    """回滚未结束的事务；服务端报告不在事务中时省去一次往返"""
+    status = getattr(raw, 'server_status', None)
+    if isinstance(status, int) and not status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+        return
+    raw.rollback()
+
+
+class PooledConnection:
+    """连接池中的连接代理
+
+    行为与 pymysql 连接一致，区别是 close() 会把连接归还给连接池而不是真正断开，
+    因此沿用 ``conn = ...; try: ... finally: conn.close()`` 写法的代码无需修改。
+    """
+
+    def __init__(self, pool: 'ConnectionPool', raw, created_at: float):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._last_used = time.monotonic()
+        self._checked_out = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """归还连接到连接池（重复调用无副作用）"""
+        if self._checked_out:
+            self._pool.release(self)
+
+
+class ConnectionPool:
+    """线程安全的 MySQL 连接池"""
+
+    def __init__(self, config: Dict[str, Any], max_size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT,
+                 idle_timeout: float = DB_POOL_IDLE_TIMEOUT,
+                 recycle: float = DB_POOL_RECYCLE,
+                 ping_interval: float = DB_POOL_PING_INTERVAL,
+                 connect=None):
+        self.config = config
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+        self._connect = connect or pymysql.connect
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _check_fork(self):
+        """子进程不能复用父进程的 socket，fork 后丢弃继承来的连接"""
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._size = 0
+            self._in_use = 0
+            self._waiting = 0
+            self._pid = os.getpid()
+
+    def _is_expired(self, conn: PooledConnection, now: float) -> bool:
+        if self.recycle and now - conn._created_at > self.recycle:
+            return True
+        if self.idle_timeout and now - conn._last_used > self.idle_timeout:
+            return True
+        return False
+
+    def _discard(self, conn: PooledConnection):
+        """真正关闭连接（调用方需持有锁）"""
+        self._size -= 1
+        self._stats['recycled'] += 1
+        try:
+            conn._raw.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn: PooledConnection, now: float) -> bool:
+        if not self.ping_interval or now - conn._last_used < self.ping_interval:
+            return True
+        try:
+            conn._raw.ping(reconnect=False)
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def acquire(self) -> PooledConnection:
+        """从连接池取出一个连接，池满时等待至多 timeout 秒"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                self._check_fork()
+                while True:
+                    now = time.monotonic()
+                    while self._idle:
+                        candidate = self._idle.pop()
+                        if self._is_expired(candidate, now):
+                            self._discard(candidate)
+                            continue
+                        conn = candidate
+                        break
+                    if conn:
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"获取数据库连接超时（{self.timeout}s，连接池大小 {self.max_size}）"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if create:
+                try:
+                    raw = self._connect(**self.config)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                conn = PooledConnection(self, raw, time.monotonic())
+                with self._cond:
+                    self._stats['created'] += 1
+            elif not self._healthy(conn, time.monotonic()):
+                with self._cond:
+                    self._discard(conn)
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._in_use += 1
+                self._stats['checkouts'] += 1
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+            conn._checked_out = True
+            return conn
+
+    def release(self, conn: PooledConnection):
+        """归还连接；未提交的事务会被回滚，避免脏状态泄漏给下一个使用者"""
+        if not conn._checked_out:
+            return
+        conn._checked_out = False
+
+        broken = False
+        try:
+            _end_transaction(conn._raw)
+        except Exception:
+            broken = True
+
+        with self._cond:
+            if conn._pool is not self or self._pid != os.getpid():
+                return
+            self._in_use -= 1
+            now = time.monotonic()
+            if broken or (self.recycle and now - conn._created_at > self.recycle):
+                self._discard(conn)
+            else:
+                conn._last_used = now
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        """关闭所有空闲连接（使用中的连接归还时会重新入池）"""
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop())
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池统计信息"""
+        with self._cond:
+            checkouts = self._stats['checkouts']
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'created': self._stats['created'],
+                'recycled': self._stats['recycled'],
+                'health_check_failures': self._stats['health_check_failures'],
+                'timeouts': self._stats['timeouts'],
+                'wait_time_total_ms': round(self._stats['wait_time_total'] * 1000, 2),
+                'wait_time_avg_ms': round(self._stats['wait_time_total'] * 1000 / checkouts, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(self._stats['wait_time_max'] * 1000, 2),
+            }
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """获取进程内共享的连接池（首次调用时创建）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_CONFIG)
+    return _pool
+
+
+class RequestScope:
+    """请求级连接作用域
+
+    第一次使用时才从连接池取连接，之后同一请求内的所有 get_db_connection()
+    复用它。最外层的 with 块结束时结束事务（未提交的修改会被回滚，与原先
+    "每次新建连接再关闭" 的语义保持一致），连接本身保留到请求结束。
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.connection: Optional[PooledConnection] = None
+        self.depth = 0
+        self.blocks = 0
+
+    def enter(self) -> PooledConnection:
+        if self.connection is None:
+            self.connection = self.pool.acquire()
+        self.depth += 1
+        self.blocks += 1
+        return self.connection
+
+    def exit(self, discard: bool = False):
+        self.depth -= 1
+        if self.depth > 0 or self.connection is None:
+            return
+        if discard:
+            self.release()
+            return
+        try:
+            _end_transaction(self.connection._raw)
+        except Exception:
+            self.release()
+
+    def release(self):
+        """把连接归还连接池；作用域仍然有效，下次使用时重新取出"""
+        if self.connection is not None and self.depth == 0:
+            self.connection.close()
+            self.connection = None
+
+
+_scope_enabled = False
+
+
+def _get_request_scope() -> Optional[RequestScope]:
+    if not _scope_enabled or has_app_context is None or not has_app_context():
+        return None
+    scope = g.get('_db_scope')
+    if scope is None:
+        scope = RequestScope(get_pool())
+        g._db_scope = scope
+    return scope
+
+
+def init_app(app):
+    """为 Flask 应用启用请求级连接复用"""
+    global _scope_enabled
+    _scope_enabled = True
+
+    @app.teardown_appcontext
+    def _release_request_connection(exc):
+        scope = g.pop('_db_scope', None)
+        if scope is not None:
+            scope.depth = 0
+            scope.release()
+
+
+def release_request_connection():
+    """提前归还当前请求占用的连接
+
+    流式响应在等待模型输出期间不需要数据库，先把连接还给连接池，
+    避免长时间占用；之后再访问数据库会自动重新取出。
+    """
+    scope = _get_request_scope()
+    if scope is not None:
+        scope.release()
+
+
+@contextmanager
+def get_db_connection():
+    """获取数据库连接的上下文管理器
+
+    在请求上下文中返回请求级共享连接，否则直接从连接池取出。
+    """
+    scope = _get_request_scope()
+    if scope is None:
+        connection = get_pool().acquire()
+        try:
+            yield connection
+        finally:
+            connection.close()
+        return
+
+    connection = scope.enter()
+    failed = False
+    try:
+        yield connection
+    except pymysql.err.OperationalError:
+        # 连接可能已断开，不再在本请求内复用
+        failed = True
+        raise
+    finally:
+        scope.exit(discard=failed)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """返回共享连接池的统计信息"""
+    return get_pool().stats()
+
+
+__all__ = [
+    'DB_CONFIG', 'ConnectionPool', 'PooledConnection', 'PoolTimeoutError',
+    'RequestScope', 'get_pool', 'get_db_connection', 'get_pool_stats',
+    'init_app', 'release_request_connection'
+]
@@ -0,0 +1,281 @@
+"""
+大模型客户端注册表
+
+进程内按 (base_url, api_key) 缓存 openai.OpenAI 客户端，所有接口和技能共用，
+不再每个请求新建客户端（每次都要重新建立连接池并做 TLS 握手）。
+同一主机的客户端共享一个 httpx 连接池，keep-alive 连接在请求之间复用。
+
+OpenAI 客户端本身是线程安全的；不同接口需要的超时、重试次数通过
+with_options() 派生，派生出的客户端仍然使用同一个连接池。
+
+环境变量：
+    LLM_POOL_MAX_CONNECTIONS   每个主机的最大连接数，默认 50
+    LLM_POOL_MAX_KEEPALIVE     每个主机保持的空闲连接数，默认 20
+    LLM_POOL_KEEPALIVE_EXPIRY  空闲连接保持时间（秒），默认 60
+"""
+
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    # openai SDK 导入较慢（约 0.7 秒），在第一次创建客户端时才导入
+    import openai
+
+load_dotenv()
+
+
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+DEEPSEEK_BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com/v1')
+
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv('LLM_POOL_MAX_CONNECTIONS', '50'))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv('LLM_POOL_MAX_KEEPALIVE', '20'))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv('LLM_POOL_KEEPALIVE_EXPIRY', '60'))
+
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_MAX_RETRIES = 2
+
+
+def base_url_for_model(model: str) -> str:
+    """根据模型名选择 API 地址"""
+    if model and model.startswith('deepseek'):
+        return DEEPSEEK_BASE_URL
+    return OPENAI_BASE_URL
+
+
+class _CountingStream(httpx.SyncByteStream):
+    """响应体读完或关闭时归还在途计数"""
+
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        for chunk in self._stream:
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            on_close, self._on_close = self._on_close, None
+            if on_close:
+                on_close()
+
+
+class _HostPool(httpx.BaseTransport):
+    """一个主机的共享连接池（包装 httpx.HTTPTransport，统计在途请求）"""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._transport = httpx.HTTPTransport(limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+        ))
+        self.http_client = httpx.Client(
+            transport=self,
+            timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=10.0),
+            follow_redirects=True
+        )
+
+    def handle_request(self, request):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException:
+            self._finish()
+            raise
+        # 流式响应在读完之前一直占用连接
+        response.stream = _CountingStream(response.stream, self._finish)
+        return response
+
+    def _finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        connections = list(getattr(self._transport._pool, 'connections', []))
+        idle = sum(1 for c in connections if c.is_idle())
+        with self._lock:
+            return {
+                'connections': len(connections),
+                'idle_connections': idle,
+                'active_connections': len(connections) - idle,
+                'max_connections': LLM_POOL_MAX_CONNECTIONS,
+                'requests': self.requests,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+            }
+
+    def close(self):
+        self._transport.close()
+
+
+class LLMClientRegistry:
+    """按 (base_url, api_key) 缓存的客户端注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._hosts: Dict[str, _HostPool] = {}
+        self._clients: Dict[Tuple[str, str], 'openai.OpenAI'] = {}
+
+    def _check_fork(self):
+        # fork 出的子进程不能复用父进程的连接
+        if self._pid != os.getpid():
+            self._hosts = {}
+            self._clients = {}
+            self._pid = os.getpid()
+
+    def get_client(self, base_url: str, api_key: str) -> 'openai.OpenAI':
+        key = (base_url.rstrip('/'), api_key)
+        with self._lock:
+            self._check_fork()
+            client = self._clients.get(key)
+            if client is None:
+                parts = urlsplit(key[0])
+                origin = f"{parts.scheme}://{parts.netloc}"
+                host = self._hosts.get(origin)
+                if host is None:
+                    host = self._hosts[origin] = _HostPool(origin)
+                import openai
+
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=key[0],
+                    timeout=DEFAULT_TIMEOUT,
+                    max_retries=DEFAULT_MAX_RETRIES,
+                    http_client=host.http_client
+                )
+                self._clients[key] = client
+            return client
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hosts = dict(self._hosts)
+            client_count = len(self._clients)
+        return {
+            'clients': client_count,
+            'hosts': {origin: host.stats() for origin, host in hosts.items()},
+        }
+
+    def close_all(self):
+        with self._lock:
+            hosts = list(self._hosts.values())
+            self._hosts = {}
+            self._clients = {}
+        for host in hosts:
+            host.http_client.close()
+
+
+_registry = LLMClientRegistry()
+
+
+def get_openai_client(base_url: Optional[str] = None, api_key: Optional[str] = None,
+                      timeout: Optional[float] = None, max_retries: Optional[int] = None) -> 'openai.OpenAI':
+    """获取共享的 OpenAI 兼容客户端
+
+    Args:
+        base_url: API 地址，默认 OPENAI_BASE_URL
+        api_key: API Key，默认 OPENAI_API_KEY
+        timeout: 本次使用的超时时间（秒），默认 60
+        max_retries: 本次使用的重试次数，默认 2
+    """
+    client = _registry.get_client(base_url or OPENAI_BASE_URL, api_key if api_key is not None else OPENAI_API_KEY)
+    options = {}
+    if timeout is not None and timeout != DEFAULT_TIMEOUT:
+        options['timeout'] = timeout
+    if max_retries is not None and max_retries != DEFAULT_MAX_RETRIES:
+        options['max_retries'] = max_retries
+    return client.with_options(**options) if options else client
+
+
+def get_client_for_model(model: str, timeout: Optional[float] = None,
+                         max_retries: Optional[int] = None) -> 'openai.OpenAI':
+    """按模型名获取共享客户端（deepseek-* 走 DeepSeek，其余走 OPENAI_BASE_URL）"""
+    return get_openai_client(base_url_for_model(model), timeout=timeout, max_retries=max_retries)
+
+
+class StreamedCompletion:
+    """流式 chat completion 的组装器
+
+    迭代时逐段产出文本内容，同时按 index 拼接 tool_calls 的增量片段；
+    迭代结束后 content、tool_calls、finish_reason 即为完整结果。
+    请求带 stream_options={"include_usage": True} 时，usage 为最后一个 chunk 中的用量。
+
+    Example:
+        completion = StreamedCompletion(client.chat.completions.create(..., stream=True))
+        for text in completion:
+            ...
+        if completion.tool_calls:
+            ...
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._tool_calls: Dict[int, Dict[str, Any]] = {}
+        self.content = ''
+        self.finish_reason = None
+        self.usage = None
+
+    def __iter__(self):
+        for chunk in self._stream:
+            if getattr(chunk, 'usage', None) is not None:
+                self.usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+            delta = choice.delta
+            if delta is None:
+                continue
+            for tool_call in delta.tool_calls or []:
+                slot = self._tool_calls.setdefault(tool_call.index, {
+                    'id': '', 'type': 'function', 'function': {'name': '', 'arguments': ''}
+                })
+                if tool_call.id:
+                    slot['id'] = tool_call.id
+                if tool_call.function:
+                    if tool_call.function.name:
+                        slot['function']['name'] += tool_call.function.name
+                    if tool_call.function.arguments:
+                        slot['function']['arguments'] += tool_call.function.arguments
+            if delta.content:
+                self.content += delta.content
+                yield delta.content
+
+    def close(self):
+        """提前结束流（网关的流会归还并发名额并断开连接）"""
+        close = getattr(self._stream, 'close', None)
+        if close is not None:
+            close()
+
+    @property
+    def tool_calls(self) -> List[Dict[str, Any]]:
+        """按 index 排序的完整 tool_calls"""
+        return [self._tool_calls[index] for index in sorted(self._tool_calls)]
+
+
+def get_llm_client_stats() -> Dict[str, Any]:
+    """客户端注册表和连接池使用情况"""
+    return _registry.stats()
+
+
+__all__ = [
+    'LLMClientRegistry', 'StreamedCompletion', 'base_url_for_model', 'get_openai_client',
+    'get_client_for_model', 'get_llm_client_stats'
+]
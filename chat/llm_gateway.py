@@ -0,0 +1,560 @@
+"""
+大模型调用网关
+
+所有接口和技能的大模型调用都经过这里，按提供方（API 主机）统一做：
+
+- 并发限制：每个提供方最多同时 N 个请求，其余排队等待，队列满或等待超时直接失败，
+  避免上游变慢时所有 Flask 工作线程都堵在同一个提供方上
+- 重试：连接错误、超时、429、5xx 按指数退避加随机抖动重试（SDK 自身不再重试）
+- 熔断：连续失败达到阈值后熔断一段时间，期间直接快速失败；冷却后放行一个探测请求
+- 对冲：调用方显式允许（hedge=True）的非流式请求超过该模型近期 p95 延迟仍未返回时，再发一个相同请求，
+  先返回者胜出。对冲会让慢请求的花费翻倍，只应用于输出短小、幂等的调用，默认不启用
+- 指标：按 提供方/模型 统计调用次数、错误、重试、对冲、延迟分位数、首字时间和 token 用量
+
+环境变量：
+    LLM_GATEWAY_MAX_CONCURRENCY    每个提供方的最大并发，默认 16
+    LLM_GATEWAY_LIMITS             按主机覆盖并发上限（JSON），如 {"api.deepseek.com": 32}
+    LLM_GATEWAY_MAX_QUEUE          每个提供方的最大排队数，默认 64
+    LLM_GATEWAY_QUEUE_TIMEOUT      排队等待超时（秒），默认 30
+    LLM_GATEWAY_MAX_RETRIES        最大重试次数，默认 2
+    LLM_GATEWAY_BREAKER_THRESHOLD  触发熔断的连续失败次数，默认 5
+    LLM_GATEWAY_BREAKER_COOLDOWN   熔断持续时间（秒），默认 30
+    LLM_GATEWAY_HEDGE              是否允许对冲请求（总开关，调用方仍需传 hedge=True），默认 1
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+from dotenv import load_dotenv
+
+from llm_clients import get_openai_client, base_url_for_model
+
+if TYPE_CHECKING:
+    import openai
+
+load_dotenv()
+
+
+LLM_GATEWAY_MAX_CONCURRENCY = int(os.getenv('LLM_GATEWAY_MAX_CONCURRENCY', '16'))
+LLM_GATEWAY_MAX_QUEUE = int(os.getenv('LLM_GATEWAY_MAX_QUEUE', '64'))
+LLM_GATEWAY_QUEUE_TIMEOUT = float(os.getenv('LLM_GATEWAY_QUEUE_TIMEOUT', '30'))
+LLM_GATEWAY_MAX_RETRIES = int(os.getenv('LLM_GATEWAY_MAX_RETRIES', '2'))
+LLM_GATEWAY_BACKOFF_BASE = float(os.getenv('LLM_GATEWAY_BACKOFF_BASE', '0.5'))
+LLM_GATEWAY_BACKOFF_MAX = float(os.getenv('LLM_GATEWAY_BACKOFF_MAX', '8'))
+LLM_GATEWAY_BREAKER_THRESHOLD = int(os.getenv('LLM_GATEWAY_BREAKER_THRESHOLD', '5'))
+LLM_GATEWAY_BREAKER_COOLDOWN = float(os.getenv('LLM_GATEWAY_BREAKER_COOLDOWN', '30'))
+LLM_GATEWAY_HEDGE = os.getenv('LLM_GATEWAY_HEDGE', '1') not in ('0', 'false', 'False', '')
+# 对冲延迟取该模型近期延迟的 p95，样本不足时不对冲
+LLM_GATEWAY_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_GATEWAY_HEDGE_MIN_SAMPLES', '20'))
+LLM_GATEWAY_HEDGE_MIN_DELAY = float(os.getenv('LLM_GATEWAY_HEDGE_MIN_DELAY', '2'))
+
+try:
+    LLM_GATEWAY_LIMITS = json.loads(os.getenv('LLM_GATEWAY_LIMITS', '{}'))
+except ValueError:
+    print("⚠️  LLM_GATEWAY_LIMITS 不是合法的 JSON，已忽略")
+    LLM_GATEWAY_LIMITS = {}
+
+LATENCY_WINDOW = 200
+
+
+class GatewayError(Exception):
+    """网关拒绝请求"""
+    pass
+
+
+class CircuitOpenError(GatewayError):
+    """提供方已熔断"""
+    pass
+
+
+class GatewayBusyError(GatewayError):
+    """提供方并发已满且排队超限或超时"""
+    pass
+
+
+def is_retryable(error: Exception) -> bool:
+    """连接错误、超时、限流和服务端错误可以重试"""
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def cached_prompt_tokens(usage) -> int:
+    """输入中命中提供方前缀缓存的 token 数
+
+    DeepSeek 返回 usage.prompt_cache_hit_tokens，OpenAI 返回 usage.prompt_tokens_details.cached_tokens。
+    """
+    if usage is None:
+        return 0
+    cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+    if cached is None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = getattr(details, 'cached_tokens', None) if details is not None else None
+    return cached or 0
+
+
+def backoff_delay(attempt: int, base: float = LLM_GATEWAY_BACKOFF_BASE,
+                  cap: float = LLM_GATEWAY_BACKOFF_MAX) -> float:
+    """指数退避加全抖动"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+class ConcurrencyLimiter:
+    """带等待队列的并发限制"""
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self.in_use < self.max_concurrency:
+                self.in_use += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise GatewayBusyError(f"大模型请求排队已满（{self.max_queue}），请稍后再试")
+            self.waiting += 1
+            try:
+                while self.in_use >= self.max_concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise GatewayBusyError(f"大模型请求排队超时（{timeout:g} 秒），请稍后再试")
+                    self._cond.wait(remaining)
+                self.in_use += 1
+            finally:
+                self.waiting -= 1
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_use < self.max_concurrency and self.waiting == 0:
+                self.in_use += 1
+                return True
+            return False
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+                'max_queue': self.max_queue,
+                'rejected': self.rejected,
+            }
+
+
+class CircuitBreaker:
+    """连续失败熔断器：closed -> open -> half_open -> closed"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.fast_failures = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self._trial_in_flight = False
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.fast_failures += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """半开状态的试探请求没有得出结果（排队失败、流没读完就关闭）时归还试探名额"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'trips': self.trips,
+                'fast_failures': self.fast_failures,
+            }
+
+
+class CallMetrics:
+    """某个 提供方/模型 的调用指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._ttfts = deque(maxlen=LATENCY_WINDOW)
+
+    def record_success(self, latency: float, usage=None, ttft: Optional[float] = None):
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(latency)
+            if ttft is not None:
+                self._ttfts.append(ttft)
+            if usage is not None:
+                self.prompt_tokens += getattr(usage, 'prompt_tokens', 0) or 0
+                self.cached_tokens += cached_prompt_tokens(usage)
+                self.completion_tokens += getattr(usage, 'completion_tokens', 0) or 0
+
+    def record_error(self):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def hedge_delay(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < LLM_GATEWAY_HEDGE_MIN_SAMPLES:
+                return None
+            latencies = list(self._latencies)
+        return max(LLM_GATEWAY_HEDGE_MIN_DELAY, _percentile(latencies, 0.95))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = list(self._latencies)
+            ttfts = list(self._ttfts)
+            result = {
+                'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'completion_tokens': self.completion_tokens,
+            }
+            if self.prompt_tokens:
+                result['cache_hit_ratio'] = round(self.cached_tokens / self.prompt_tokens, 3)
+        for name, values in (('latency', latencies), ('ttft', ttfts)):
+            if values:
+                result[f'{name}_avg_ms'] = round(sum(values) / len(values) * 1000, 1)
+                result[f'{name}_p50_ms'] = round(_percentile(values, 0.5) * 1000, 1)
+                result[f'{name}_p95_ms'] = round(_percentile(values, 0.95) * 1000, 1)
+        return result
+
+
+class _Provider:
+    def __init__(self, host: str):
+        self.host = host
+        self.limiter = ConcurrencyLimiter(
+            int(LLM_GATEWAY_LIMITS.get(host, LLM_GATEWAY_MAX_CONCURRENCY)), LLM_GATEWAY_MAX_QUEUE
+        )
+        self.breaker = CircuitBreaker(LLM_GATEWAY_BREAKER_THRESHOLD, LLM_GATEWAY_BREAKER_COOLDOWN)
+
+
+class GatewayStream:
+    """网关返回的流式响应：迭代产出原始 chunk，迭代结束或 close() 时归还并发名额"""
+
+    def __init__(self, gateway: 'LLMGateway', provider: _Provider, metrics: CallMetrics,
+                 label: str, stream, start: float):
+        self._gateway = gateway
+        self._provider = provider
+        self._metrics = metrics
+        self._label = label
+        self._stream = stream
+        self._start = start
+        self._released = False
+        self._finished = False
+
+    def __iter__(self):
+        ttft = None
+        usage = None
+        try:
+            for chunk in self._stream:
+                if ttft is None:
+                    ttft = time.monotonic() - self._start
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                yield chunk
+        except Exception as e:
+            if self._released:
+                # 调用方主动 close() 后读取中断（如对比模式超时），不算提供方失败
+                return
+            # 已经开始输出的流不能重试，只记录失败
+            self._finished = True
+            self._gateway._record_failure(self._provider, self._metrics, e)
+            raise
+        else:
+            self._finished = True
+            latency = time.monotonic() - self._start
+            self._provider.breaker.record_success()
+            self._metrics.record_success(latency, usage, ttft)
+            self._gateway._log(self._label, latency, usage, ttft)
+        finally:
+            self.close()
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._provider.limiter.release()
+        if not self._finished:
+            # 客户端断开等原因提前关闭：没有成功也没有失败，不能让熔断器一直等这次试探
+            self._provider.breaker.release_trial()
+        try:
+            self._stream.close()
+        except Exception:
+            pass
+
+    def __del__(self):
+        self.close()
+
+
+class LLMGateway:
+    """大模型调用网关"""
+
+    def __init__(self, max_retries: int = LLM_GATEWAY_MAX_RETRIES, queue_timeout: float = LLM_GATEWAY_QUEUE_TIMEOUT,
+                 hedge: bool = LLM_GATEWAY_HEDGE):
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.hedge = hedge
+        self._lock = threading.Lock()
+        self._providers: Dict[str, _Provider] = {}
+        self._metrics: Dict[str, CallMetrics] = {}
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='llm-hedge')
+
+    def _provider(self, base_url: str) -> _Provider:
+        host = urlsplit(base_url).netloc or base_url
+        with self._lock:
+            provider = self._providers.get(host)
+            if provider is None:
+                provider = self._providers[host] = _Provider(host)
+            return provider
+
+    def _call_metrics(self, label: str) -> CallMetrics:
+        with self._lock:
+            metrics = self._metrics.get(label)
+            if metrics is None:
+                metrics = self._metrics[label] = CallMetrics()
+            return metrics
+
+    def _record_failure(self, provider: _Provider, metrics: CallMetrics, error: Exception):
+        metrics.record_error()
+        if is_retryable(error):
+            provider.breaker.record_failure()
+        else:
+            # 4xx 等请求本身的问题说明提供方是可用的
+            provider.breaker.record_success()
+
+    def _log(self, label: str, latency: float, usage=None, ttft: Optional[float] = None):
+        parts = [f"[LLM] {label} {latency * 1000:.0f}ms"]
+        if ttft is not None:
+            parts.append(f"首字 {ttft * 1000:.0f}ms")
+        if usage is not None:
+            parts.append(f"tokens {getattr(usage, 'prompt_tokens', 0)}/{getattr(usage, 'completion_tokens', 0)}")
+            cached = cached_prompt_tokens(usage)
+            if cached:
+                parts.append(f"缓存命中 {cached}")
+        print('，'.join(parts))
+
+    def _admit(self, provider: _Provider, metrics: CallMetrics):
+        """检查熔断并占用一个并发名额"""
+        if not provider.breaker.allow():
+            metrics.record_error()
+            raise CircuitOpenError(f"大模型服务 {provider.host} 暂时不可用（已熔断），请稍后再试")
+        try:
+            provider.limiter.acquire(self.queue_timeout)
+        except GatewayBusyError:
+            provider.breaker.release_trial()
+            metrics.record_error()
+            raise
+
+    def _run_released(self, provider: _Provider, fn: Callable[[], Any]):
+        try:
+            return fn()
+        finally:
+            provider.limiter.release()
+
+    def _run_hedged(self, provider: _Provider, metrics: CallMetrics, fn: Callable[[], Any], delay: float):
+        primary = self._executor.submit(self._run_released, provider, fn)
+        done, _ = wait([primary], timeout=delay)
+        if done or not provider.limiter.try_acquire():
+            return primary.result()
+
+        metrics.incr('hedged')
+        backup = self._executor.submit(self._run_released, provider, fn)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        metrics.incr('hedge_wins')
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def call(self, model: str, fn: Callable[['openai.OpenAI'], Any], base_url: Optional[str] = None,
+             api_key: Optional[str] = None, timeout: Optional[float] = None, hedge: bool = False):
+        """通过网关执行一次非流式调用
+
+        Args:
+            model: 模型名（用于选择默认 API 地址和统计）
+            fn: 接收客户端并发起请求的函数
+            base_url: API 地址，默认按模型选择
+            api_key: API Key，默认 OPENAI_API_KEY
+            timeout: 单次请求超时（秒）
+            hedge: 是否允许对冲请求（仅用于幂等的非流式调用）
+        """
+        base_url = base_url or base_url_for_model(model)
+        provider = self._provider(base_url)
+        label = f"{provider.host}/{model}"
+        metrics = self._call_metrics(label)
+        client = get_openai_client(base_url, api_key, timeout=timeout, max_retries=0)
+
+        attempt = 0
+        while True:
+            self._admit(provider, metrics)
+            start = time.monotonic()
+            delay = metrics.hedge_delay() if (hedge and self.hedge) else None
+            try:
+                if delay is None:
+                    result = self._run_released(provider, lambda: fn(client))
+                else:
+                    result = self._run_hedged(provider, metrics, lambda: fn(client), delay)
+            except Exception as e:
+                self._record_failure(provider, metrics, e)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                metrics.incr('retries')
+                wait_seconds = backoff_delay(attempt)
+                print(f"⚠️  [LLM] {label} 调用失败，{wait_seconds:.1f} 秒后重试（第 {attempt + 1} 次）: {e}")
+                time.sleep(wait_seconds)
+                attempt += 1
+                continue
+
+            latency = time.monotonic() - start
+            usage = getattr(result, 'usage', None)
+            provider.breaker.record_success()
+            metrics.record_success(latency, usage)
+            self._log(label, latency, usage)
+            return result
+
+    def chat_completion(self, model: str, messages: List[Dict[str, Any]], base_url: Optional[str] = None,
+                        api_key: Optional[str] = None, timeout: Optional[float] = None,
+                        hedge: bool = False, **params):
+        """非流式 chat completion（只有输出短小、幂等的调用才应传 hedge=True）"""
+        return self.call(
+            model,
+            lambda client: client.chat.completions.create(model=model, messages=messages, **params),
+            base_url=base_url, api_key=api_key, timeout=timeout, hedge=hedge
+        )
+
+    def stream_chat_completion(self, model: str, messages: List[Dict[str, Any]], base_url: Optional[str] = None,
+                               api_key: Optional[str] = None, timeout: Optional[float] = None,
+                               **params) -> GatewayStream:
+        """流式 chat completion：建立连接阶段可以重试，开始输出后不再重试"""
+        base_url = base_url or base_url_for_model(model)
+        provider = self._provider(base_url)
+        label = f"{provider.host}/{model}"
+        metrics = self._call_metrics(label)
+        client = get_openai_client(base_url, api_key, timeout=timeout, max_retries=0)
+
+        attempt = 0
+        while True:
+            self._admit(provider, metrics)
+            start = time.monotonic()
+            try:
+                stream = client.chat.completions.create(model=model, messages=messages, stream=True, **params)
+            except Exception as e:
+                provider.limiter.release()
+                self._record_failure(provider, metrics, e)
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                metrics.incr('retries')
+                wait_seconds = backoff_delay(attempt)
+                print(f"⚠️  [LLM] {label} 流式调用失败，{wait_seconds:.1f} 秒后重试（第 {attempt + 1} 次）: {e}")
+                time.sleep(wait_seconds)
+                attempt += 1
+                continue
+            return GatewayStream(self, provider, metrics, label, stream, start)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            providers = dict(self._providers)
+            metrics = dict(self._metrics)
+        return {
+            'providers': {
+                host: {'limiter': p.limiter.stats(), 'breaker': p.breaker.stats()}
+                for host, p in providers.items()
+            },
+            'models': {label: m.stats() for label, m in metrics.items()},
+        }
+
+
+gateway = LLMGateway()
+
+call = gateway.call
+chat_completion = gateway.chat_completion
+stream_chat_completion = gateway.stream_chat_completion
+get_gateway_stats = gateway.stats
+
+
+__all__ = [
+    'GatewayError', 'CircuitOpenError', 'GatewayBusyError', 'LLMGateway', 'GatewayStream',
+    'gateway', 'call', 'chat_completion', 'stream_chat_completion', 'get_gateway_stats', 'cached_prompt_tokens'
+]
@@ -0,0 +1,399 @@
+"""
+初始表结构
+
+原 init_database() 中的建表语句：全部使用 CREATE TABLE IF NOT EXISTS，
+并保留对旧库的列/索引补齐逻辑，因此在已有数据库上执行也是安全的。
+"""
+
+
+def upgrade(cursor):
+    # 创建用户表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            email VARCHAR(100),
+            theme VARCHAR(20) DEFAULT 'dark',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_username (username),
+            INDEX idx_email (email)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建对话表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            conversation_id VARCHAR(64) NOT NULL,
+            username VARCHAR(50) NOT NULL,
+            messages JSON,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_conversation_id (conversation_id),
+            INDEX idx_username (username),
+            UNIQUE KEY uk_user_conv (username, conversation_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # 创建用户技能状态表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_skills (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL,
+            skill_name VARCHAR(100) NOT NULL,
+            enabled TINYINT(1) DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY uk_user_skill (username, skill_name),
+            INDEX idx_username (username)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建工作流表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS workflows (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            username VARCHAR(50) NOT NULL,
+            status ENUM('draft', 'active', 'paused', 'archived') DEFAULT 'draft',
+            definition JSON,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_username (username),
+            INDEX idx_status (status),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建工作流节点表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS workflow_nodes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            workflow_id INT NOT NULL,
+            node_id VARCHAR(50) NOT NULL,
+            node_type ENUM('start', 'end', 'llm', 'script', 'condition', 'input', 'output', 'delay', 'base64', 'json', 'sql', 'http') NOT NULL,
+            name VARCHAR(100),
+            config JSON,
+            position_x INT DEFAULT 0,
+            position_y INT DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_workflow_id (workflow_id),
+            INDEX idx_node_type (node_type),
+            UNIQUE KEY uk_workflow_node (workflow_id, node_id),
+            FOREIGN KEY (workflow_id) REFERENCES workflows(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建工作流边表（节点连接关系）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS workflow_edges (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            workflow_id INT NOT NULL,
+            source_node_id VARCHAR(50) NOT NULL,
+            target_node_id VARCHAR(50) NOT NULL,
+            `condition` TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_workflow_id (workflow_id),
+            INDEX idx_source_target (source_node_id, target_node_id),
+            FOREIGN KEY (workflow_id) REFERENCES workflows(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建工作流执行表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS workflow_executions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            workflow_id INT NOT NULL,
+            username VARCHAR(50) NOT NULL,
+            execution_id VARCHAR(64) NOT NULL,
+            status ENUM('pending', 'running', 'completed', 'failed', 'cancelled') DEFAULT 'pending',
+            input_data JSON,
+            output_data JSON,
+            error_message TEXT,
+            started_at DATETIME,
+            completed_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_workflow_id (workflow_id),
+            INDEX idx_username (username),
+            INDEX idx_execution_id (execution_id),
+            INDEX idx_status (status),
+            INDEX idx_created_at (created_at),
+            FOREIGN KEY (workflow_id) REFERENCES workflows(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建工作流节点执行表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS workflow_node_executions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            execution_id INT NOT NULL,
+            node_id VARCHAR(50) NOT NULL,
+            node_type VARCHAR(50) NOT NULL,
+            status ENUM('pending', 'running', 'completed', 'failed', 'skipped') DEFAULT 'pending',
+            input_data JSON,
+            output_data JSON,
+            error_message TEXT,
+            started_at DATETIME,
+            completed_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_execution_id (execution_id),
+            INDEX idx_node_id (node_id),
+            INDEX idx_status (status),
+            FOREIGN KEY (execution_id) REFERENCES workflow_executions(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # 创建定时任务表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            username VARCHAR(50) NOT NULL,
+            cron VARCHAR(50) NOT NULL,
+            preset VARCHAR(50),
+            command TEXT NOT NULL,
+            status ENUM('active', 'paused') DEFAULT 'active',
+            last_run_at DATETIME,
+            next_run_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_username (username),
+            INDEX idx_username_created (username, created_at),
+            INDEX idx_status (status),
+            INDEX idx_next_run_at (next_run_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # 创建定时任务执行表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schedule_executions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            schedule_id INT NOT NULL,
+            username VARCHAR(50) NOT NULL,
+            execution_id VARCHAR(64) NOT NULL,
+            status ENUM('pending', 'running', 'completed', 'failed') DEFAULT 'pending',
+            output TEXT,
+            error_message TEXT,
+            started_at DATETIME,
+            completed_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_schedule_id (schedule_id),
+            INDEX idx_username (username),
+            INDEX idx_status (status),
+            INDEX idx_created_at (created_at),
+            FOREIGN KEY (schedule_id) REFERENCES schedules(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # 创建异步任务表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS async_tasks (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL,
+            task_name VARCHAR(100) NOT NULL,
+            description TEXT,
+            command TEXT NOT NULL,
+            status ENUM('pending', 'scheduled', 'running', 'completed', 'failed', 'cancelled') DEFAULT 'pending',
+            output TEXT,
+            error_message TEXT,
+            execution_id VARCHAR(64) NOT NULL,
+            scheduled_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            completed_at DATETIME,
+            INDEX idx_username (username),
+            INDEX idx_username_created (username, created_at),
+            INDEX idx_status (status),
+            INDEX idx_execution_id (execution_id),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # 创建提示词表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS prompts (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            content TEXT NOT NULL,
+            description TEXT,
+            username VARCHAR(50) NOT NULL,
+            tags VARCHAR(255),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_username (username),
+            INDEX idx_name (name),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建Agent表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agents (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            system_prompt TEXT,
+            prompt_id INT,
+            model VARCHAR(50) DEFAULT 'gpt-4',
+            temperature FLOAT DEFAULT 0.7,
+            max_tokens INT DEFAULT 2000,
+            username VARCHAR(50) NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_username (username),
+            INDEX idx_name (name),
+            INDEX idx_prompt_id (prompt_id),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建Agent技能关联表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS agent_skills (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            agent_id INT NOT NULL,
+            skill_name VARCHAR(100) NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY uk_agent_skill (agent_id, skill_name),
+            INDEX idx_agent_id (agent_id),
+            INDEX idx_skill_name (skill_name),
+            FOREIGN KEY (agent_id) REFERENCES agents(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建工作流搜索历史表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS workflow_search_history (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL,
+            search_keyword VARCHAR(200) NOT NULL,
+            search_type VARCHAR(20) DEFAULT 'workflow',
+            search_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_username (username),
+            INDEX idx_search_time (search_time),
+            INDEX idx_keyword (search_keyword)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # 创建热门搜索表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS popular_searches (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            keyword VARCHAR(200) NOT NULL,
+            search_type VARCHAR(20) DEFAULT 'workflow',
+            search_count INT DEFAULT 1,
+            last_searched_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uk_keyword_type (keyword, search_type),
+            INDEX idx_search_count (search_count),
+            INDEX idx_last_searched (last_searched_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # 为 workflows 表添加 username 索引（如果不存在）
+    try:
+        cursor.execute("""
+            SHOW INDEX FROM workflows WHERE Key_name = 'idx_username'
+        """)
+        if not cursor.fetchone():
+            cursor.execute("""
+                ALTER TABLE workflows ADD INDEX idx_username (username)
+            """)
+            print("✅ 已添加 username 索引到 workflows 表")
+    except Exception as e:
+        print(f"添加 username 索引失败: {e}")
+
+    # 为 async_tasks 表添加 scheduled_at 列（如果不存在）
+    try:
+        cursor.execute("""
+            SELECT COLUMN_NAME 
+            FROM INFORMATION_SCHEMA.COLUMNS 
+            WHERE TABLE_SCHEMA = DATABASE() 
+            AND TABLE_NAME = 'async_tasks' 
+            AND COLUMN_NAME = 'scheduled_at'
+        """)
+        if not cursor.fetchone():
+            cursor.execute("""
+                ALTER TABLE async_tasks 
+                ADD COLUMN scheduled_at DATETIME NULL DEFAULT NULL
+            """)
+            print("✅ 已添加 scheduled_at 列到 async_tasks 表")
+    except Exception as e:
+        print(f"添加 scheduled_at 列失败: {e}")
+    
+    # 为 async_tasks 表添加 scheduled 状态到 status 枚举（如果不存在）
+    try:
+        cursor.execute("""
+            SELECT COLUMN_TYPE 
+            FROM INFORMATION_SCHEMA.COLUMNS 
+            WHERE TABLE_SCHEMA = DATABASE() 
+            AND TABLE_NAME = 'async_tasks' 
+            AND COLUMN_NAME = 'status'
+        """)
+        row = cursor.fetchone()
+        if row and 'scheduled' not in row['COLUMN_TYPE']:
+            cursor.execute("""
+                ALTER TABLE async_tasks 
+                MODIFY COLUMN status ENUM('pending', 'running', 'completed', 'failed', 'scheduled') DEFAULT 'pending'
+            """)
+            print("✅ 已添加 scheduled 状态到 async_tasks 表")
+    except Exception as e:
+        print(f"修改 status 枚举失败: {e}")
+    
+    # 创建知识库表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_base (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            username VARCHAR(50) NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_username (username),
+            INDEX idx_created_at (created_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建知识条目表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_item (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            knowledge_base_id INT NOT NULL,
+            title VARCHAR(200) NOT NULL,
+            content TEXT NOT NULL,
+            type ENUM('text', 'qa', 'concept', 'procedure') DEFAULT 'text',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_knowledge_base_id (knowledge_base_id),
+            INDEX idx_type (type),
+            INDEX idx_created_at (created_at),
+            FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_base(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    
+    # 创建知识关系表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_relation (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            knowledge_base_id INT NOT NULL,
+            source_item_id INT DEFAULT NULL,
+            target_item_id INT NOT NULL,
+            relation_type ENUM('related', 'parent', 'child', 'similar', 'tag') DEFAULT 'related',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_knowledge_base_id (knowledge_base_id),
+            INDEX idx_source_item_id (source_item_id),
+            INDEX idx_target_item_id (target_item_id),
+            FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_base(id) ON DELETE CASCADE,
+            FOREIGN KEY (source_item_id) REFERENCES knowledge_item(id) ON DELETE CASCADE,
+            FOREIGN KEY (target_item_id) REFERENCES knowledge_item(id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
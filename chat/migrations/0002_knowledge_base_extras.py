@@ -0,0 +1,54 @@
+"""
+知识库扩展表（标签、分类、版本、历史）
+
+原先由 KnowledgeBaseSkill._ensure_tables_exist() 在每次写入知识前执行，
+现在只在迁移时执行一次。
+"""
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_tag (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(50) NOT NULL UNIQUE,
+            color VARCHAR(20) DEFAULT '#1890ff',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_category (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            parent_id INT DEFAULT NULL,
+            knowledge_base_id INT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_base(id) ON DELETE CASCADE
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_version (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            item_id INT NOT NULL,
+            version_number INT NOT NULL,
+            title VARCHAR(200),
+            content TEXT,
+            metadata JSON,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            created_by VARCHAR(50),
+            FOREIGN KEY (item_id) REFERENCES knowledge_item(id) ON DELETE CASCADE
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS knowledge_history (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            item_id INT,
+            action VARCHAR(20) NOT NULL,
+            old_data JSON,
+            new_data JSON,
+            username VARCHAR(50),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
@@ -0,0 +1,67 @@
+"""
+对话消息按行存储
+
+新增 conversation_messages 表，每条消息一行并带顺序号 seq，新一轮对话只追加新消息，
+不再整体重写 conversations.messages。conversations 表保留为对话头（归属、更新时间），
+其 messages 列从此不再写入，仅作为历史数据保留。
+
+同时把已有 conversations.messages 中的消息回填到新表。
+"""
+
+import json
+
+BACKFILL_BATCH_SIZE = 200
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_messages (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            conversation_id VARCHAR(64) NOT NULL,
+            username VARCHAR(50) NOT NULL,
+            seq INT NOT NULL,
+            role VARCHAR(20) NOT NULL,
+            message JSON NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uk_user_conv_seq (username, conversation_id, seq)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    last_id = 0
+    total = 0
+    while True:
+        cursor.execute(
+            "SELECT id, conversation_id, username, messages FROM conversations "
+            "WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, BACKFILL_BATCH_SIZE)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        values = []
+        for row in rows:
+            last_id = row['id']
+            try:
+                messages = json.loads(row['messages']) if row['messages'] else []
+            except (TypeError, ValueError):
+                print(f"跳过无法解析的对话 {row['conversation_id']} ({row['username']})")
+                continue
+            for seq, message in enumerate(messages):
+                if not isinstance(message, dict):
+                    continue
+                values.append((
+                    row['conversation_id'], row['username'], seq,
+                    message.get('role', ''), json.dumps(message, ensure_ascii=False)
+                ))
+
+        if values:
+            cursor.executemany(
+                "INSERT IGNORE INTO conversation_messages (conversation_id, username, seq, role, message) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                values
+            )
+            total += len(values)
+            cursor.connection.commit()
+
+    print(f"✅ 已回填 {total} 条对话消息到 conversation_messages")
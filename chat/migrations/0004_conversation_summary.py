@@ -0,0 +1,66 @@
+"""
+对话列表摘要列
+
+conversations 表新增 title、message_count、last_message_at、preview 四列，
+由 save_conversation_to_db() 在写入时维护，/api/conversations 列表不再读取消息内容。
+新增 (username, updated_at, id) 索引用于列表的 keyset 分页。
+
+回填时显式保留 updated_at，避免 ON UPDATE CURRENT_TIMESTAMP 打乱列表顺序。
+"""
+
+
+from migrations import add_missing_columns
+
+
+def upgrade(cursor):
+    add_missing_columns(cursor, 'conversations', [
+        ('title', 'VARCHAR(100) NULL DEFAULT NULL'),
+        ('message_count', 'INT NOT NULL DEFAULT 0'),
+        ('last_message_at', 'DATETIME NULL DEFAULT NULL'),
+        ('preview', 'VARCHAR(200) NULL DEFAULT NULL'),
+    ], indexes=[
+        ('idx_user_updated', '(username, updated_at, id)'),
+    ])
+
+    cursor.execute("""
+        UPDATE conversations c
+        JOIN (
+            SELECT username, conversation_id, COUNT(*) AS message_count
+            FROM conversation_messages
+            GROUP BY username, conversation_id
+        ) m ON m.username = c.username AND m.conversation_id = c.conversation_id
+        SET c.message_count = m.message_count,
+            c.last_message_at = c.updated_at,
+            c.updated_at = c.updated_at
+    """)
+
+    # 标题：第一条用户消息的前 50 个字符
+    cursor.execute("""
+        UPDATE conversations c
+        JOIN (
+            SELECT username, conversation_id, MIN(seq) AS seq
+            FROM conversation_messages
+            WHERE role = 'user'
+            GROUP BY username, conversation_id
+        ) f ON f.username = c.username AND f.conversation_id = c.conversation_id
+        JOIN conversation_messages cm
+            ON cm.username = f.username AND cm.conversation_id = f.conversation_id AND cm.seq = f.seq
+        SET c.title = LEFT(JSON_UNQUOTE(JSON_EXTRACT(cm.message, '$.content')), 50),
+            c.updated_at = c.updated_at
+    """)
+
+    # 预览：最后一条有内容的用户/助手消息
+    cursor.execute("""
+        UPDATE conversations c
+        JOIN (
+            SELECT username, conversation_id, MAX(seq) AS seq
+            FROM conversation_messages
+            WHERE role IN ('user', 'assistant')
+            AND JSON_UNQUOTE(JSON_EXTRACT(message, '$.content')) <> ''
+            GROUP BY username, conversation_id
+        ) l ON l.username = c.username AND l.conversation_id = c.conversation_id
+        JOIN conversation_messages cm
+            ON cm.username = l.username AND cm.conversation_id = l.conversation_id AND cm.seq = l.seq
+        SET c.preview = LEFT(JSON_UNQUOTE(JSON_EXTRACT(cm.message, '$.content')), 100),
+            c.updated_at = c.updated_at
+    """)
@@ -0,0 +1,17 @@
+"""
+对话滚动摘要
+
+conversations 表新增 summary、summary_upto 两列：当对话历史超出模型的上下文预算时，
+被挤出窗口的早期消息会被压缩进 summary，summary_upto 记录摘要覆盖到的消息条数（seq 上界），
+下一轮请求直接用摘要代替这些消息。
+"""
+
+
+from migrations import add_missing_columns
+
+
+def upgrade(cursor):
+    add_missing_columns(cursor, 'conversations', [
+        ('summary', 'TEXT NULL DEFAULT NULL'),
+        ('summary_upto', 'INT NOT NULL DEFAULT 0'),
+    ])
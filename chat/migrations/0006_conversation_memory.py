@@ -0,0 +1,91 @@
+"""
+长期对话记忆
+
+新增 conversation_memory 表：每轮对话（用户消息 + 最终回答）一行，保存检索用的片段文本和哈希向量
+（float32 字节串），供 /api/chat 跨对话召回相关的历史片段。
+
+同时把 conversation_messages 中已有的对话按轮回填片段文本；回填的行不带向量，
+首次加载索引时按文本计算（见 conversation_memory.py）。
+"""
+
+import json
+
+BACKFILL_BATCH_SIZE = 200
+
+# 与 conversation_memory.MEMORY_SNIPPET_CHARS 的默认值一致
+SNIPPET_CHARS = 500
+
+
+def _clip(text, max_chars=SNIPPET_CHARS):
+    text = ' '.join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars] + '...'
+
+
+def _turns(rows):
+    """按轮拆分一个对话的消息：(用户消息 seq, 用户消息, 该轮最后一条有内容的助手回复)"""
+    turns = []
+    for row in rows:
+        try:
+            message = json.loads(row['message'])
+        except (TypeError, ValueError):
+            continue
+        content = message.get('content') if isinstance(message, dict) else None
+        if not isinstance(content, str) or not content:
+            continue
+        if row['role'] == 'user':
+            turns.append([row['seq'], content, None])
+        elif row['role'] == 'assistant' and turns:
+            turns[-1][2] = content
+    return [turn for turn in turns if turn[2]]
+
+
+def upgrade(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_memory (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) NOT NULL,
+            conversation_id VARCHAR(64) NOT NULL,
+            seq INT NOT NULL,
+            content TEXT NOT NULL,
+            vector BLOB NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uk_user_conv_seq (username, conversation_id, seq),
+            KEY idx_user_id (username, id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    last_id = 0
+    total = 0
+    while True:
+        cursor.execute(
+            "SELECT id, conversation_id, username FROM conversations WHERE id > %s ORDER BY id LIMIT %s",
+            (last_id, BACKFILL_BATCH_SIZE)
+        )
+        conversations = cursor.fetchall()
+        if not conversations:
+            break
+
+        values = []
+        for conversation in conversations:
+            last_id = conversation['id']
+            cursor.execute(
+                "SELECT seq, role, message FROM conversation_messages "
+                "WHERE username = %s AND conversation_id = %s ORDER BY seq",
+                (conversation['username'], conversation['conversation_id'])
+            )
+            for seq, question, answer in _turns(cursor.fetchall()):
+                values.append((
+                    conversation['username'], conversation['conversation_id'], seq,
+                    f"用户: {_clip(question)}\n助手: {_clip(answer)}"
+                ))
+
+        if values:
+            cursor.executemany(
+                "INSERT IGNORE INTO conversation_memory (username, conversation_id, seq, content) "
+                "VALUES (%s, %s, %s, %s)",
+                values
+            )
+            total += len(values)
+            cursor.connection.commit()
+
+    print(f"✅ 已回填 {total} 个对话片段到 conversation_memory")
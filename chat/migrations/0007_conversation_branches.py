@@ -0,0 +1,18 @@
+"""
+对话分支
+
+conversations 表新增 parent_conversation_id、fork_seq 两列：分支对话继承父对话 seq < fork_seq 的消息，
+自己只保存之后的消息（见 conversation_branches.py）。已有对话都是根对话，两列为 NULL。
+"""
+
+
+from migrations import add_missing_columns
+
+
+def upgrade(cursor):
+    add_missing_columns(cursor, 'conversations', [
+        ('parent_conversation_id', 'VARCHAR(64) NULL DEFAULT NULL'),
+        ('fork_seq', 'INT NULL DEFAULT NULL'),
+    ], indexes=[
+        ('idx_user_parent', '(username, parent_conversation_id)'),
+    ])
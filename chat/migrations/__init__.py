@@ -0,0 +1,206 @@
+"""
+数据库迁移模块
+
+表结构变更以有序的迁移文件形式放在本目录下，文件名格式为 ``NNNN_描述.py``，
+每个文件提供 ``upgrade(cursor)`` 函数。已执行的版本记录在 ``schema_version`` 表中。
+
+启动时调用 ensure_schema()：数据库已是最新版本时只做一次版本查询，
+否则在 MySQL 命名锁保护下依次执行尚未应用的迁移（多进程同时启动也只会执行一次）。
+业务代码的写入路径上不再执行任何 DDL。
+
+MySQL 的 DDL 会隐式提交，迁移中途失败时前面的语句已经生效、版本却没有记录，
+下次启动会重新执行整个迁移。因此每个迁移都要能重复执行：建表用 CREATE TABLE IF NOT EXISTS，
+加列和索引用 add_missing_columns()，只补上还不存在的部分。
+"""
+
+import os
+import re
+import threading
+import importlib.util
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+import pymysql
+
+from db import get_db_connection
+
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATION_LOCK_NAME = 'arc_logi_chat_schema_migration'
+MIGRATION_LOCK_TIMEOUT = 60
+
+_MIGRATION_FILE_RE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+Migration = namedtuple('Migration', ['version', 'name', 'path'])
+
+_schema_checked = False
+_schema_lock = threading.Lock()
+
+
+def discover_migrations(migrations_dir: str = None) -> List[Migration]:
+    """按版本号顺序列出所有迁移文件"""
+    if migrations_dir is None:
+        migrations_dir = MIGRATIONS_DIR
+
+    migrations = []
+    for filename in os.listdir(migrations_dir):
+        match = _MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append(Migration(
+                version=int(match.group(1)),
+                name=match.group(2),
+                path=os.path.join(migrations_dir, filename)
+            ))
+
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"迁移版本号重复: {versions}")
+    return migrations
+
+
+def latest_version(migrations_dir: str = None) -> int:
+    """迁移文件中的最高版本号"""
+    migrations = discover_migrations(migrations_dir)
+    return migrations[-1].version if migrations else 0
+
+
+def _load_upgrade(migration: Migration):
+    spec = importlib.util.spec_from_file_location(
+        f"migrations.m{migration.version:04d}_{migration.name}", migration.path
+    )
+    if spec is None:
+        raise ImportError(f"无法从路径 {migration.path} 创建模块规范")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    upgrade = getattr(module, 'upgrade', None)
+    if not callable(upgrade):
+        raise ValueError(f"迁移 {migration.path} 缺少 upgrade(cursor) 函数")
+    return upgrade
+
+
+def get_schema_version() -> int:
+    """数据库当前的表结构版本（schema_version 表不存在时为 0）"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute("SELECT MAX(version) AS version FROM schema_version")
+            except pymysql.err.ProgrammingError as e:
+                # 1146: Table doesn't exist
+                if e.args and e.args[0] == 1146:
+                    return 0
+                raise
+            row = cursor.fetchone()
+            return (row and row['version']) or 0
+
+
+def add_missing_columns(cursor, table: str, columns: List[Tuple[str, str]],
+                        indexes: List[Tuple[str, str]] = ()) -> List[str]:
+    """给表补上尚不存在的列和索引（可重复执行）
+
+    Args:
+        table: 表名
+        columns: [(列名, 列定义)]，如 ('title', 'VARCHAR(100) NULL DEFAULT NULL')
+        indexes: [(索引名, 索引列)]，如 ('idx_user_updated', '(username, updated_at, id)')
+
+    Returns:
+        本次实际添加的列名和索引名
+    """
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,)
+    )
+    existing_columns = {row['COLUMN_NAME'].lower() for row in cursor.fetchall()}
+    cursor.execute(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,)
+    )
+    existing_indexes = {row['INDEX_NAME'].lower() for row in cursor.fetchall()}
+
+    added = []
+    clauses = []
+    for name, definition in columns:
+        if name.lower() not in existing_columns:
+            clauses.append(f"ADD COLUMN {name} {definition}")
+            added.append(name)
+    for name, definition in indexes:
+        if name.lower() not in existing_indexes:
+            clauses.append(f"ADD INDEX {name} {definition}")
+            added.append(name)
+
+    if clauses:
+        cursor.execute(f"ALTER TABLE {table} " + ", ".join(clauses))
+    return added
+
+
+def run_migrations(migrations_dir: str = None) -> List[int]:
+    """执行所有尚未应用的迁移，返回本次执行的版本号列表"""
+    migrations = discover_migrations(migrations_dir)
+    applied_now = []
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT GET_LOCK(%s, %s) AS locked",
+                (MIGRATION_LOCK_NAME, MIGRATION_LOCK_TIMEOUT)
+            )
+            row = cursor.fetchone()
+            if not row or not row['locked']:
+                raise RuntimeError("获取数据库迁移锁超时，可能有其他进程正在执行迁移")
+
+            try:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INT PRIMARY KEY,
+                        name VARCHAR(100) NOT NULL,
+                        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """)
+                cursor.execute("SELECT version FROM schema_version")
+                applied = {r['version'] for r in cursor.fetchall()}
+
+                for migration in migrations:
+                    if migration.version in applied:
+                        continue
+                    upgrade = _load_upgrade(migration)
+                    upgrade(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                        (migration.version, migration.name)
+                    )
+                    conn.commit()
+                    applied_now.append(migration.version)
+                    print(f"✅ 已执行数据库迁移 {migration.version:04d}_{migration.name}")
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+
+    return applied_now
+
+
+def ensure_schema(migrations_dir: str = None) -> Optional[List[int]]:
+    """确认表结构为最新版本，每个进程只检查一次
+
+    Returns:
+        本次执行的迁移版本号列表；已检查过或无需迁移时返回 None
+    """
+    global _schema_checked
+    if _schema_checked:
+        return None
+
+    with _schema_lock:
+        if _schema_checked:
+            return None
+
+        applied = None
+        if get_schema_version() < latest_version(migrations_dir):
+            applied = run_migrations(migrations_dir)
+        print("✅ 数据库表结构已是最新版本")
+        _schema_checked = True
+        return applied
+
+
+__all__ = [
+    'Migration', 'discover_migrations', 'latest_version', 'get_schema_version',
+    'run_migrations', 'ensure_schema', 'add_missing_columns'
+]
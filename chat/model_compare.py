@@ -0,0 +1,172 @@
+"""
+多模型对比：同一个问题同时发给多个模型
+
+团队经常把同一个问题依次发给 deepseek-chat、deepseek-coder、gpt-3.5-turbo、gpt-4 比较回答，
+总耗时是各模型耗时之和。对比模式下每个模型的流式请求在各自的线程中同时进行，
+文本片段按到达顺序合并到同一个 SSE 连接，用 model 字段区分，总耗时取决于最慢的模型。
+
+每个模型记录：
+- ttft_ms     从发起请求到收到第一段文本的时间
+- latency_ms  从发起请求到流结束的时间
+
+单个模型出错或超过 CHAT_COMPARE_TIMEOUT 仍未结束只影响该模型的结果，其余模型照常返回；
+超时的模型的流会被关闭，归还网关的并发名额，不再继续生成（和计费）没人读取的内容。
+
+环境变量：
+    CHAT_COMPARE_MAX_MODELS   一次最多对比的模型数，默认 4
+    CHAT_COMPARE_TIMEOUT      一次对比的总超时（秒），默认 180
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from dotenv import load_dotenv
+
+from llm_gateway import cached_prompt_tokens
+
+load_dotenv()
+
+
+CHAT_COMPARE_MAX_MODELS = int(os.getenv('CHAT_COMPARE_MAX_MODELS', '4'))
+CHAT_COMPARE_TIMEOUT = float(os.getenv('CHAT_COMPARE_TIMEOUT', '180'))
+
+
+def usage_to_dict(usage) -> Optional[Dict[str, int]]:
+    """把流最后一个 chunk 中的 usage 整理成可序列化的字典"""
+    if usage is None:
+        return None
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'cached_tokens': cached_prompt_tokens(usage),
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+    }
+
+
+class ModelFanOut:
+    """并发的多模型流式请求
+
+    迭代时按到达顺序产出事件：
+        {'model': 模型, 'content': 文本片段}
+        {'model': 模型, 'finished': 该模型的耗时、用量和错误信息}
+    迭代结束后 results 为按请求顺序排列的各模型结果（含完整回答 content），
+    wall_ms 为总耗时，sequential_ms 为依次调用时的耗时（各模型 latency_ms 之和）。
+
+    Example:
+        fan_out = ModelFanOut(models, lambda model: StreamedCompletion(stream_chat_completion(model=model, ...)))
+        for event in fan_out:
+            ...
+        best = fan_out.results[0]['content']
+    """
+
+    def __init__(self, models: Sequence[str], open_stream: Callable[[str], Iterable[str]],
+                 timeout: float = CHAT_COMPARE_TIMEOUT):
+        """
+        Args:
+            models: 参与对比的模型
+            open_stream: 为一个模型发起流式请求，返回逐段产出文本的可迭代对象
+                （如 StreamedCompletion，迭代结束后的 usage 属性会被记录，超时时调用其 close()）
+            timeout: 总超时（秒），到时仍未结束的模型记为超时
+        """
+        self.models = list(models)
+        self._open_stream = open_stream
+        self.timeout = timeout
+        self.results: List[Dict[str, Any]] = [
+            {'model': model, 'content': '', 'ttft_ms': None, 'latency_ms': None, 'usage': None, 'error': None}
+            for model in self.models
+        ]
+        self.wall_ms: Optional[int] = None
+        self._lock = threading.Lock()
+        self._completions: Dict[int, Any] = {}
+        self._cancelled = set()
+
+    @property
+    def sequential_ms(self) -> int:
+        return sum(result['latency_ms'] or 0 for result in self.results)
+
+    @staticmethod
+    def summary(result: Dict[str, Any]) -> Dict[str, Any]:
+        """单个模型的结果（不含回答正文）"""
+        return {key: value for key, value in result.items() if key != 'content'}
+
+    def _run(self, index: int, events: queue.Queue):
+        usage = error = None
+        try:
+            completion = self._open_stream(self.models[index])
+            with self._lock:
+                self._completions[index] = completion
+                cancelled = index in self._cancelled
+            if cancelled:
+                # 建立连接期间已经超时
+                self._close(completion)
+                return
+            for text in completion:
+                events.put((index, 'content', text, time.monotonic()))
+            usage = usage_to_dict(getattr(completion, 'usage', None))
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        events.put((index, 'end', (usage, error), time.monotonic()))
+
+    @staticmethod
+    def _close(completion):
+        close = getattr(completion, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            print(f"⚠️  [Compare] 关闭超时的流失败: {e}")
+
+    def _cancel(self, index: int):
+        """关闭超时模型的流；还在建立连接的，由其线程在连接建立后关闭"""
+        with self._lock:
+            self._cancelled.add(index)
+            completion = self._completions.get(index)
+        if completion is not None:
+            self._close(completion)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        events = queue.Queue()
+        start = time.monotonic()
+        deadline = start + self.timeout
+        for index, model in enumerate(self.models):
+            threading.Thread(target=self._run, args=(index, events),
+                             name=f'compare-{model}', daemon=True).start()
+
+        running = set(range(len(self.models)))
+        while running:
+            try:
+                index, kind, value, at = events.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                # 超时的模型关闭流，后台线程读取中断后退出，结果被丢弃
+                for index in sorted(running):
+                    self._cancel(index)
+                    result = self.results[index]
+                    result['error'] = f'超过 {self.timeout:g} 秒未完成'
+                    print(f"⚠️  [Compare] {result['model']} {result['error']}")
+                    yield {'model': result['model'], 'finished': self.summary(result)}
+                break
+
+            result = self.results[index]
+            elapsed_ms = round((at - start) * 1000)
+            if kind == 'content':
+                if result['ttft_ms'] is None:
+                    result['ttft_ms'] = elapsed_ms
+                result['content'] += value
+                yield {'model': result['model'], 'content': value}
+            else:
+                running.discard(index)
+                result['latency_ms'] = elapsed_ms
+                result['usage'], result['error'] = value
+                if result['error']:
+                    print(f"⚠️  [Compare] {result['model']} 失败: {result['error']}")
+                yield {'model': result['model'], 'finished': self.summary(result)}
+
+        self.wall_ms = round((time.monotonic() - start) * 1000)
+        print(f"[Compare] {len(self.models)} 个模型总耗时 {self.wall_ms}ms（依次调用约 {self.sequential_ms}ms）: "
+              + ', '.join(f"{r['model']} 首字 {r['ttft_ms']}ms/完成 {r['latency_ms']}ms" for r in self.results))
+
+
+__all__ = ['CHAT_COMPARE_MAX_MODELS', 'CHAT_COMPARE_TIMEOUT', 'ModelFanOut', 'usage_to_dict']
@@ -0,0 +1,276 @@
+"""
+大模型响应缓存
+
+Linux/Git 命令查询、菜谱生成、经典解读这类接口用固定的系统提示词加一个很短的输入
+（"ls"、"git rebase"、"红烧肉"）调用大模型，热门输入每天重复成千上万次。
+这里按 (接口, 模型, 规范化输入, 提示词版本) 缓存生成结果：
+
+- 进程内 LRU，条目带 TTL
+- 可选 Redis 二级缓存，多个工作进程共享
+- single-flight：同一个 key 同时只有一个请求调用上游，其他请求等待并共享结果；
+  启用 Redis 时用 SET NX 锁把合并范围扩展到所有进程
+
+提示词版本取系统提示词和生成参数的哈希，修改提示词后旧缓存自然失效。
+
+环境变量：
+    RESPONSE_CACHE_SIZE        进程内缓存条目数，默认 2000
+    RESPONSE_CACHE_TTL         缓存有效期（秒），默认 86400
+    RESPONSE_CACHE_REDIS_URL   Redis 地址（可选）
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2000'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL', '')
+
+REDIS_KEY_PREFIX = 'arc_logi_chat:resp:'
+# 跨进程 single-flight 锁的有效期，以及等待其他进程结果时的轮询间隔
+REDIS_LOCK_TTL = 180
+REDIS_POLL_INTERVAL = 0.2
+# 只删除自己持有的锁：生成超过 REDIS_LOCK_TTL 时锁已过期，可能已被另一个进程重新拿到
+REDIS_UNLOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_input(text: str) -> str:
+    """规范化输入：全角转半角、去掉首尾空白、合并连续空白
+
+    不转小写：命令参数区分大小写（ls -l 和 ls -L、git log -s 和 git log -S 含义不同）。
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def prompt_version(*parts: Any) -> str:
+    """系统提示词和生成参数的哈希"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+def make_cache_key(endpoint: str, model: str, user_input: str, version: str) -> str:
+    digest = hashlib.sha1(normalize_input(user_input).encode('utf-8')).hexdigest()
+    return f"{endpoint}:{model}:{version}:{digest}"
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """带 single-flight 的两级响应缓存"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 redis_client=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._redis = redis_client
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._flights: Dict[str, _Flight] = {}
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _error(self, action: str, e: Exception):
+        print(f"⚠️  {action}: {e}")
+        with self._lock:
+            self.errors += 1
+
+    def _get_local(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _set_local(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _get_redis(self, key: str):
+        if self._redis is None:
+            return None
+        try:
+            raw = self._redis.get(REDIS_KEY_PREFIX + key)
+        except Exception as e:
+            self._error("读取响应缓存失败", e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    def _set_redis(self, key: str, value: Any):
+        if self._redis is None:
+            return
+        try:
+            self._redis.set(REDIS_KEY_PREFIX + key, json.dumps(value, ensure_ascii=False), ex=int(self.ttl))
+        except Exception as e:
+            self._error("写入响应缓存失败", e)
+
+    def get(self, key: str):
+        """读取缓存（先本地后 Redis），未命中返回 None"""
+        value = self._get_local(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+        value = self._get_redis(key)
+        if value is not None:
+            self._set_local(key, value)
+            with self._lock:
+                self.redis_hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        self._set_local(key, value)
+        self._set_redis(key, value)
+
+    def _compute_across_processes(self, key: str, compute: Callable[[], Any]):
+        """启用 Redis 时，同一个 key 在所有进程中只由拿到锁的一方调用上游"""
+        if self._redis is None:
+            return compute()
+
+        lock_key = REDIS_KEY_PREFIX + 'lock:' + key
+        token = uuid.uuid4().hex
+        try:
+            locked = self._redis.set(lock_key, token, nx=True, ex=REDIS_LOCK_TTL)
+        except Exception as e:
+            self._error("获取响应缓存锁失败", e)
+            return compute()
+
+        if locked:
+            try:
+                return compute()
+            finally:
+                try:
+                    self._redis.eval(REDIS_UNLOCK_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    self._error("释放响应缓存锁失败", e)
+
+        # 其他进程正在生成：轮询结果，锁消失仍没有结果（对方失败）时自己生成
+        deadline = time.monotonic() + REDIS_LOCK_TTL
+        while time.monotonic() < deadline:
+            time.sleep(REDIS_POLL_INTERVAL)
+            value = self._get_redis(key)
+            if value is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return value
+            try:
+                if not self._redis.exists(lock_key):
+                    break
+            except Exception:
+                break
+        return compute()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any],
+                       cacheable: Callable[[Any], bool] = bool) -> Any:
+        """命中直接返回；否则同一个 key 只有一个调用者执行 compute()，其他调用者等待共享结果
+
+        Args:
+            key: 缓存键
+            compute: 生成结果的函数
+            cacheable: 判断结果是否写入缓存（默认非空才缓存）
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = self._compute_across_processes(key, compute)
+            if cacheable(value):
+                self.set(key, value)
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.redis_hits + self.misses + self.coalesced
+            return {
+                'backend': 'memory+redis' if self._redis is not None else 'memory',
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'redis_hits': self.redis_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'in_flight': len(self._flights),
+                'errors': self.errors,
+            }
+
+
+def _create_cache() -> ResponseCache:
+    redis_client = None
+    if RESPONSE_CACHE_REDIS_URL:
+        try:
+            import redis
+            redis_client = redis.Redis.from_url(RESPONSE_CACHE_REDIS_URL, decode_responses=True)
+        except Exception as e:
+            print(f"⚠️  响应缓存无法使用 Redis，改用进程内缓存: {e}")
+    return ResponseCache(redis_client=redis_client)
+
+
+response_cache = _create_cache()
+
+
+__all__ = [
+    'ResponseCache', 'normalize_input', 'prompt_version', 'make_cache_key', 'response_cache'
+]
@@ -4,28 +4,19 @@ import uuid
 import subprocess
 from datetime import datetime, timedelta
 from croniter import croniter
-import pymysql
 import os
-from contextlib import contextmanager
 
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'port': int(os.getenv('DB_PORT', 3306)),
-    'user': os.getenv('DB_USER', 'root'),
-    'password': os.getenv('DB_PASSWORD', ''),
-    'database': os.getenv('DB_NAME', 'arc_logi_chat'),
-    'charset': os.getenv('DB_CHARSET', 'utf8mb4'),
-    'cursorclass': pymysql.cursors.DictCursor
-}
+import pymysql
+from dotenv import load_dotenv
 
-@contextmanager
-def get_db_connection():
-    """获取数据库连接的上下文管理器"""
-    connection = pymysql.connect(**DB_CONFIG)
-    try:
-        yield connection
-    finally:
-        connection.close()
+from db import get_db_connection, DB_CONFIG
+
+load_dotenv()
+
+# 多进程部署时只有一个进程（主节点）执行调度，其余进程定期尝试接管
+SCHEDULER_LEADER_ELECTION = os.getenv('SCHEDULER_LEADER_ELECTION', '1') not in ('0', 'false', 'False', '')
+SCHEDULER_LOCK_NAME = os.getenv('SCHEDULER_LOCK_NAME', 'arc_logi_chat:scheduler')
+SCHEDULER_LEADER_RETRY = float(os.getenv('SCHEDULER_LEADER_RETRY', '10'))
 
 def execute_schedule_command(schedule_id, execution_id, command):
     """执行定时任务命令"""
@@ -82,14 +73,96 @@ def calculate_next_run_time(cron_str, from_time=None):
         print(f"Cron 解析错误: {e}")
         return None
 
+class LeaderLock:
+    """基于 MySQL GET_LOCK 的主节点选举
+    
+    GET_LOCK 是会话级的命名锁：持有锁的连接断开（进程退出、崩溃、网络中断）时 MySQL 自动释放，
+    其他进程下一次尝试时即可接管。锁占用一条独立于连接池的专用连接，整个任期内保持打开。
+    """
+    
+    def __init__(self, name=SCHEDULER_LOCK_NAME, connect=None):
+        self.name = name
+        self._connect = connect or (lambda: pymysql.connect(
+            **DB_CONFIG, autocommit=True, connect_timeout=5, read_timeout=10, write_timeout=10
+        ))
+        self._conn = None
+        self.is_leader = False
+        self.leader_since = None
+        self.acquisitions = 0
+        self.losses = 0
+    
+    def _query_value(self, sql, args=()):
+        with self._conn.cursor() as cursor:
+            cursor.execute(sql, args)
+            row = cursor.fetchone()
+        if isinstance(row, dict):
+            return next(iter(row.values()))
+        return row[0]
+    
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+    
+    def _step_down(self, reason):
+        print(f"⚠️  [调度器] 进程 {os.getpid()} 失去主节点身份: {reason}")
+        self.is_leader = False
+        self.leader_since = None
+        self.losses += 1
+        # 关闭连接，确保锁一定被释放
+        self._close()
+    
+    def ensure(self):
+        """尝试成为主节点，已是主节点时确认锁仍由当前连接持有；返回当前是否为主节点"""
+        try:
+            if self._conn is None:
+                self._conn = self._connect()
+            if self.is_leader:
+                if self._query_value("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (self.name,)) != 1:
+                    self._step_down('锁已不由当前连接持有')
+                return self.is_leader
+            if self._query_value("SELECT GET_LOCK(%s, 0)", (self.name,)) == 1:
+                self.is_leader = True
+                self.leader_since = datetime.now()
+                self.acquisitions += 1
+                print(f"👑 [调度器] 进程 {os.getpid()} 成为主节点")
+            return self.is_leader
+        except Exception as e:
+            if self.is_leader:
+                self._step_down(e)
+            else:
+                self._close()
+            return False
+    
+    def release(self):
+        """主动释放锁（进程正常退出时）"""
+        if self.is_leader and self._conn is not None:
+            try:
+                self._query_value("SELECT RELEASE_LOCK(%s)", (self.name,))
+            except Exception:
+                pass
+        self.is_leader = False
+        self.leader_since = None
+        self._close()
+
 class ScheduleScheduler:
-    """定时任务调度器"""
+    """定时任务调度器
     
-    def __init__(self, check_interval=60):
+    传入 leader_lock 时，多个进程中只有持有锁的主节点执行调度；
+    其他进程每 SCHEDULER_LEADER_RETRY 秒尝试一次，主节点进程退出后自动接管。
+    """
+    
+    def __init__(self, check_interval=60, leader_lock=None):
         self.check_interval = check_interval
+        self.leader_lock = leader_lock
         self.running = False
         self.thread = None
         self.lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._initialized = False
         
     def start(self):
         """启动调度器"""
@@ -99,6 +172,7 @@ class ScheduleScheduler:
                 return
             
             self.running = True
+            self._wakeup.clear()
             self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
             self.thread.start()
             print("✅ 定时任务调度器已启动")
@@ -110,19 +184,53 @@ class ScheduleScheduler:
                 return
             
             self.running = False
+            self._wakeup.set()
             if self.thread:
                 self.thread.join(timeout=5)
+            if self.leader_lock is not None:
+                self.leader_lock.release()
             print("⏹️ 定时任务调度器已停止")
     
+    def is_leader(self):
+        """当前进程是否负责执行调度（未启用选举时总是 True）"""
+        if self.leader_lock is None:
+            return True
+        leader = self.leader_lock.ensure()
+        if not leader:
+            # 失去主节点身份后重新当选时需要重新初始化
+            self._initialized = False
+        return leader
+    
     def _run_scheduler(self):
-        """调度器主循环"""
+        """调度器主循环：只有主节点执行调度，其他进程等待接管"""
         while self.running:
+            if not self.is_leader():
+                self._wakeup.wait(SCHEDULER_LEADER_RETRY)
+                continue
+            
+            if not self._initialized:
+                self.initialize_schedules()
+                self._initialized = True
+            
             try:
                 self._check_and_execute_schedules()
             except Exception as e:
                 print(f"调度器执行错误: {e}")
             
-            time.sleep(self.check_interval)
+            self._wakeup.wait(self.check_interval)
+    
+    def stats(self):
+        """调度器状态"""
+        lock = self.leader_lock
+        return {
+            'running': self.running,
+            'leader_election': lock is not None,
+            'leader': lock.is_leader if lock is not None else self.running,
+            'leader_since': lock.leader_since.isoformat() if lock is not None and lock.leader_since else None,
+            'acquisitions': lock.acquisitions if lock is not None else 0,
+            'losses': lock.losses if lock is not None else 0,
+            'pid': os.getpid(),
+        }
     
     def _check_and_execute_schedules(self):
         """检查并执行到期的定时任务"""
@@ -389,4 +497,7 @@ class ScheduleScheduler:
         except Exception as e:
             print(f"初始化定时任务失败: {e}")
 
-scheduler = ScheduleScheduler(check_interval=60)
+scheduler = ScheduleScheduler(
+    check_interval=60,
+    leader_lock=LeaderLock() if SCHEDULER_LEADER_ELECTION else None
+)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+生产环境多进程入口
+
+app.py 末尾的 app.run(debug=True) 只适合开发：单进程，且在进程内启动定时任务调度器。
+这里由主进程预先导入应用（加载技能注册表、初始化数据库表）并监听端口，然后 fork 出
+N 个工作进程共享同一个监听 socket：
+
+- 每个工作进程运行多线程 WSGI 服务器
+- 每个工作进程都启动调度器线程，但只有通过 MySQL GET_LOCK 选举出的主节点执行调度，
+  主节点进程退出后其他进程自动接管（见 scheduler.LeaderLock）
+- 工作进程异常退出时主进程自动重新 fork
+- 主进程收到 SIGTERM / SIGINT 后通知所有工作进程退出
+
+fork 之后，数据库连接池和大模型 HTTP 连接池会检测到进程变化并在子进程中重新创建。
+
+多进程的限制：工作进程共享同一个监听 socket，由内核把连接分给任意一个进程，没有按用户或对话的粘性。
+
+- 延迟写入（conversation_writer）中尚未写入数据库的消息：所有工作进程共用同一个 WAL 目录，
+  读取对话时也读取其他进程的 WAL，下一轮请求落到哪个进程都能读到上一轮的消息
+- 可恢复的流式任务（stream_jobs）只保存在创建它的进程中：/api/chat/stream/<job_id> 和
+  /api/chat/active 落到其他进程时返回 404 / 没有进行中的任务，断线续传失效
+  （回答生成完成后从任意进程读取对话都是完整的）。启动多个工作进程时打印警告
+
+默认启动 1 个工作进程。
+
+用法：
+    python serve.py                          # 1 个工作进程，端口 8000
+    python serve.py --workers 4
+
+环境变量：
+    SERVER_HOST                 监听地址，默认 0.0.0.0
+    SERVER_PORT                 监听端口，默认 8000
+    SERVER_WORKERS              工作进程数，默认 1
+    SERVER_PID_FILE             主进程 PID 文件（ctl.sh 停止服务时使用），默认 chat.pid
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from werkzeug.serving import make_server
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8000'))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '1'))
+SERVER_PID_FILE = os.getenv('SERVER_PID_FILE', os.path.join(BASE_DIR, 'chat.pid'))
+
+# 工作进程在启动后这么短的时间内退出，视为启动失败，放慢重新 fork 的速度
+MIN_WORKER_UPTIME = 5
+RESPAWN_DELAY = 1
+
+
+def create_listener(host, port):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+    return listener
+
+
+def multi_worker_warning(workers):
+    """多个工作进程时只在原进程上有效的功能说明，单进程时返回 None"""
+    if workers <= 1:
+        return None
+    return ("可恢复的流式任务只保存在创建它的进程中，工作进程之间没有粘性路由，"
+            "生成过程中断线续传可能落到其他进程而失败（回答完成后从任意进程读取对话都是完整的）")
+
+
+def run_worker(app, listener, host, port):
+    """工作进程：启动调度器（参与选举）并处理请求，直到收到 SIGTERM"""
+    from app import start_scheduler, start_conversation_writer
+    from conversation_writer import conversation_writer
+    from scheduler import scheduler
+
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+
+    def shutdown(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    start_scheduler()
+    start_conversation_writer()
+    print(f"🧵 工作进程 {os.getpid()} 已启动")
+    try:
+        server.serve_forever()
+    finally:
+        scheduler.stop()
+        # 工作进程以 os._exit 退出，不会执行 atexit，这里写完剩余的对话消息
+        conversation_writer.stop()
+
+
+class Master:
+    """主进程：fork 并看护工作进程"""
+
+    def __init__(self, app, listener, host, port, workers):
+        self.app = app
+        self.listener = listener
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.listener, self.host, self.port)
+            except SystemExit as e:
+                code = e.code or 0
+            except Exception as e:
+                print(f"❌ 工作进程 {os.getpid()} 异常退出: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self.children.pop(pid, None)
+            if self.stopping or started is None:
+                continue
+            print(f"⚠️  工作进程 {pid} 已退出（状态 {status}），重新启动")
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                time.sleep(RESPAWN_DELAY)
+            self.spawn()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI Chat Platform 生产环境入口')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    warning = multi_worker_warning(workers)
+    if warning:
+        print(f"⚠️  {workers} 个工作进程：{warning}")
+
+    # 预加载：导入应用（注册技能），初始化数据库表，之后 fork 的工作进程直接共享
+    from app import app, init_database_safely, skill_registry
+    init_database_safely()
+
+    listener = create_listener(args.host, args.port)
+    with open(SERVER_PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+    print("\n" + "=" * 50)
+    print("🚀 AI Chat Platform (production)")
+    print(f"🎯 已加载技能: {len(skill_registry)} 个")
+    print(f"🧵 工作进程: {workers}")
+    print(f"📝 访问地址: http://{args.host}:{args.port}")
+    print("=" * 50 + "\n")
+
+    try:
+        Master(app, listener, args.host, args.port, workers).run()
+    finally:
+        listener.close()
+        if os.path.exists(SERVER_PID_FILE):
+            os.remove(SERVER_PID_FILE)
+    print("⏹️ 服务已停止")
+
+
+if __name__ == '__main__':
+    main()
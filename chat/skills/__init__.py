@@ -9,13 +9,31 @@ Skills 模块 - AI 对话平台的技能系统
 - 其他资源文件（可选）
 
 技能会被自动发现和加载。
+
+导入技能模块会连带导入各自的依赖，启动时全部导入拖慢冷启动。注册时改为读取技能清单
+（名称、描述、参数等元数据，按技能目录下源文件的修改时间和大小校验），技能模块在第一次
+执行时才导入；清单中没有或已过期的技能在启动时导入一次并更新清单。
+没有 scripts/skill.py 的技能优先使用 SKILL.md 头部（--- 之间）的 name / description。
+
+环境变量：
+    SKILL_LAZY_LOAD      是否按需导入技能，默认 1
+    SKILL_MANIFEST_PATH  技能清单文件，默认 skills/.skill_manifest.json
 """
 
+import json
 import os
 import sys
 import importlib.util
 from pathlib import Path
-from .base import BaseSkill, SkillRegistry
+from .base import BaseSkill, LazySkill, SkillRegistry
+
+
+SKILL_LAZY_LOAD = os.getenv('SKILL_LAZY_LOAD', '1') not in ('0', 'false', 'False', '')
+SKILL_MANIFEST_PATH = os.getenv(
+    'SKILL_MANIFEST_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.skill_manifest.json')
+)
+# 清单格式变化时递增，旧清单整体作废
+MANIFEST_VERSION = 1
 
 
 def discover_skills(skills_dir: str = None, user_skills_dir: str = None) -> dict:
@@ -127,18 +145,38 @@ def load_skill_from_file(skill_name: str, skill_path: str) -> BaseSkill:
         raise ImportError(f"加载技能 '{skill_name}' 失败: {str(e)}")
 
 
+def read_skill_md_metadata(skill_md: str) -> dict:
+    """解析 SKILL.md 头部 --- 之间的 key: value（只取顶层的单行字段）"""
+    lines = skill_md.splitlines()
+    if not lines or lines[0].strip() != '---':
+        return {}
+    metadata = {}
+    for line in lines[1:]:
+        if line.strip() == '---':
+            return metadata
+        if not line[:1].strip() or ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        value = value.strip().strip('"\'')
+        if value:
+            metadata[key.strip()] = value
+    # 没有结束的 ---，不是头部
+    return {}
+
+
 def load_skill_from_md(skill_name: str, skill_path: str, skill_md_path: str) -> BaseSkill:
     """从 SKILL.md 创建简单技能（无需 scripts/skill.py）"""
     from skills.base import BaseSkill
     
-    description = skill_name.replace('-', ' ').replace('_', ' ').title()
-    
     # 读取 SKILL.md 内容
     skill_md = ""
     if os.path.isfile(skill_md_path):
         with open(skill_md_path, 'r', encoding='utf-8') as f:
             skill_md = f.read()
     
+    metadata = read_skill_md_metadata(skill_md)
+    description = metadata.get('description') or skill_name.replace('-', ' ').replace('_', ' ').title()
+    
     class SimpleSkill(BaseSkill):
         def get_name(self):
             return skill_name
@@ -163,13 +201,68 @@ def load_skill_from_md(skill_name: str, skill_path: str, skill_md_path: str) ->
     return SimpleSkill()
 
 
-def register_all_skills() -> SkillRegistry:
+def skill_fingerprint(skill_path: str) -> list:
+    """技能目录下源文件（*.py 和 SKILL.md）的 [相对路径, 修改时间, 大小]，任一变化都使清单条目失效"""
+    files = []
+    for root, dirs, names in os.walk(skill_path):
+        dirs[:] = sorted(d for d in dirs if d not in ('__pycache__', 'tests'))
+        for name in sorted(names):
+            if name.endswith('.py') or name == 'SKILL.md':
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files.append([os.path.relpath(path, skill_path), stat.st_mtime_ns, stat.st_size])
+    return files
+
+
+def skill_metadata(skill: BaseSkill) -> dict:
+    """技能清单中保存的元数据"""
+    return {
+        'name': skill.name,
+        'description': skill.description,
+        'parameters': skill.parameters,
+        'timeout': skill.timeout,
+        'keywords': list(skill.keywords or []),
+    }
+
+
+def load_manifest(path: str = None) -> dict:
+    """读取技能清单 {技能目录名: {fingerprint, metadata}}，不存在或格式不对时返回空清单"""
+    path = path or SKILL_MANIFEST_PATH
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('skills', {})
+
+
+def save_manifest(skills: dict, path: str = None):
+    """写入技能清单（先写临时文件再替换；目录不可写时跳过）"""
+    path = path or SKILL_MANIFEST_PATH
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'skills': skills}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"⚠️  写入技能清单失败: {e}")
+
+
+def register_all_skills(lazy: bool = None, manifest_path: str = None) -> SkillRegistry:
     """
     自动发现并注册所有技能
     
+    Args:
+        lazy: 是否按需导入技能模块，默认 SKILL_LAZY_LOAD
+        manifest_path: 技能清单文件，默认 SKILL_MANIFEST_PATH
+    
     Returns:
         SkillRegistry: 包含所有已注册技能的注册表
     """
+    if lazy is None:
+        lazy = SKILL_LAZY_LOAD
     registry = SkillRegistry()
     
     # 发现所有技能
@@ -181,19 +274,44 @@ def register_all_skills() -> SkillRegistry:
     
     print(f"\n📥 开始加载技能...")
     
+    manifest = load_manifest(manifest_path) if lazy else {}
+    updated = {}
+    from_manifest = 0
+    
     # 加载并注册每个技能
     for skill_name, skill_info in discovered.items():
         try:
             skill_path = skill_info['path']
-            skill_instance = load_skill(skill_name, skill_path)
             skill_dir = os.path.dirname(skill_path)
-            registry.register(skill_instance, skill_dir)
+            if not lazy:
+                registry.register(load_skill(skill_name, skill_path), skill_dir)
+                continue
+            
+            fingerprint = skill_fingerprint(skill_path)
+            entry = manifest.get(skill_name)
+            skill_instance = None
+            if entry is not None and entry.get('fingerprint') == fingerprint:
+                from_manifest += 1
+            else:
+                skill_instance = load_skill(skill_name, skill_path)
+                entry = {'fingerprint': fingerprint, 'metadata': skill_metadata(skill_instance)}
+            updated[skill_name] = entry
+            
+            loader = lambda name=skill_name, path=skill_path: load_skill(name, path)
+            registry.register(LazySkill(entry['metadata'], loader, skill_instance), skill_dir)
         except Exception as e:
             print(f"   ❌ {skill_name}: {str(e)}")
     
-    print(f"\n✅ 技能加载完成！共注册 {len(registry)} 个技能\n")
+    if lazy and updated != manifest:
+        save_manifest(updated, manifest_path)
+    
+    if lazy:
+        print(f"\n✅ 技能加载完成！共注册 {len(registry)} 个技能（{from_manifest} 个读取自技能清单，首次执行时导入）\n")
+    else:
+        print(f"\n✅ 技能加载完成！共注册 {len(registry)} 个技能\n")
     
     return registry
 
 
-__all__ = ['BaseSkill', 'SkillRegistry', 'register_all_skills', 'discover_skills', 'load_skill']
+__all__ = ['BaseSkill', 'LazySkill', 'SkillRegistry', 'register_all_skills', 'discover_skills', 'load_skill',
+           'read_skill_md_metadata']
@@ -20,6 +20,7 @@ except ImportError:
 
 try:
     import pymysql
+    from db import get_pool
 except ImportError:
     pymysql = None
 
@@ -27,6 +28,8 @@ except ImportError:
 class AsyncTaskSkill(BaseSkill):
     """异步任务技能"""
 
+    keywords = ['后台', '异步', '长时间', '执行命令', '脚本']
+
     def get_name(self) -> str:
         return "async_task"
 
@@ -111,25 +114,11 @@ class AsyncTaskSkill(BaseSkill):
             raise ValueError("未提供用户名，请先登录")
         return username
 
-    def _get_db_config(self):
-        """获取数据库配置"""
-        if pymysql is None:
-            raise ImportError("pymysql 库未安装，请运行: pip install pymysql")
-        return {
-            'host': os.getenv('DB_HOST', 'localhost'),
-            'port': int(os.getenv('DB_PORT', 3306)),
-            'user': os.getenv('DB_USER', 'root'),
-            'password': os.getenv('DB_PASSWORD', ''),
-            'database': os.getenv('DB_NAME', 'arc_logi_chat'),
-            'charset': os.getenv('DB_CHARSET', 'utf8mb4'),
-            'cursorclass': pymysql.cursors.DictCursor
-        }
-
     def _get_db_connection(self):
-        """获取数据库连接"""
+        """从共享连接池获取数据库连接（close() 即归还连接池）"""
         if pymysql is None:
             raise ImportError("pymysql 库未安装，请运行: pip install pymysql")
-        return pymysql.connect(**self._get_db_config())
+        return get_pool().acquire()
 
     def _convert_datetime_fields(self, obj):
         """将 datetime 字段转换为 ISO 格式字符串"""
@@ -293,6 +282,7 @@ class AsyncTaskSkill(BaseSkill):
         
         def update_output_in_db(output_text, error_msg=None, status=None):
             """更新数据库中的输出"""
+            connection = None
             try:
                 connection = self._get_db_connection()
                 with connection.cursor() as cursor:
@@ -328,14 +318,16 @@ class AsyncTaskSkill(BaseSkill):
         
         try:
             connection = self._get_db_connection()
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE async_tasks SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE id = %s",
-                    (task_id,)
-                )
-                connection.commit()
-            connection.close()
-            
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE async_tasks SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE id = %s",
+                        (task_id,)
+                    )
+                    connection.commit()
+            finally:
+                connection.close()
+
             proc = subprocess.Popen(
                 command,
                 shell=True,
@@ -3,9 +3,19 @@
 """
 
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Any, List, Optional, Iterator, Tuple
 import json
 import os
+import threading
+import time
+
+
+# 技能并发执行的线程数上限，以及未单独设置 timeout 的技能的默认超时（秒）
+SKILL_MAX_WORKERS = int(os.getenv('SKILL_MAX_WORKERS', '8'))
+SKILL_DEFAULT_TIMEOUT = float(os.getenv('SKILL_DEFAULT_TIMEOUT', '60'))
+# 调用在线程池中排队等待开始执行的最长时间（秒），不计入技能本身的超时
+SKILL_QUEUE_TIMEOUT = float(os.getenv('SKILL_QUEUE_TIMEOUT', '60'))
 
 
 class BaseSkill(ABC):
@@ -16,8 +26,14 @@ class BaseSkill(ABC):
     2. 实现所有抽象方法
     3. 放在独立的文件夹中，文件夹名即为技能标识
     4. 包含 SKILL.md 文档说明
+    
+    子类可以设置 timeout 类属性（秒）覆盖默认的执行超时；
+    keywords 类属性补充描述中没有、但用户常用的说法，供工具路由匹配。
     """
     
+    timeout: Optional[float] = None
+    keywords: List[str] = []
+    
     def __init__(self):
         self.name = self.get_name()
         self.description = self.get_description()
@@ -79,6 +95,54 @@ class BaseSkill(ABC):
         return None
 
 
+class LazySkill(BaseSkill):
+    """按需导入的技能代理
+    
+    名称、描述、参数、timeout 和 keywords 来自技能清单（见 skills.register_all_skills），
+    注册和生成工具定义时不需要导入技能模块；第一次执行时才调用 loader 导入真正的技能。
+    """
+    
+    def __init__(self, metadata: Dict[str, Any], loader: Callable[[], BaseSkill],
+                 skill: Optional[BaseSkill] = None):
+        self._metadata = metadata
+        self._loader = loader
+        self._skill = skill
+        self._load_lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.timeout = metadata.get('timeout')
+        self.keywords = metadata.get('keywords') or []
+        super().__init__()
+    
+    def get_name(self) -> str:
+        return self._metadata['name']
+    
+    def get_description(self) -> str:
+        return self._metadata['description']
+    
+    def get_parameters(self) -> Dict[str, Any]:
+        return self._metadata['parameters']
+    
+    @property
+    def loaded(self) -> bool:
+        return self._skill is not None
+    
+    def load(self) -> BaseSkill:
+        """导入真正的技能（只导入一次）"""
+        if self._skill is None:
+            with self._load_lock:
+                if self._skill is None:
+                    started = time.monotonic()
+                    skill = self._loader()
+                    skill.skill_dir = self.skill_dir
+                    self.load_seconds = time.monotonic() - started
+                    print(f"📦 技能 {self.name} 已按需加载（{self.load_seconds:.2f}s）")
+                    self._skill = skill
+        return self._skill
+    
+    def execute(self, **kwargs) -> Dict[str, Any]:
+        return self.load().execute(**kwargs)
+
+
 class SkillRegistry:
     """技能注册表
     
@@ -88,6 +152,8 @@ class SkillRegistry:
     def __init__(self):
         self._skills: Dict[str, BaseSkill] = {}
         self._skill_dirs: Dict[str, str] = {}  # {skill_name: skill_directory}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
     
     def register(self, skill: BaseSkill, skill_dir: str = None) -> None:
         """
@@ -168,6 +234,90 @@ class SkillRegistry:
                 "error": str(e)
             }
     
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=SKILL_MAX_WORKERS, thread_name_prefix='skill'
+                )
+            return self._executor
+    
+    def get_skill_timeout(self, skill_name: str) -> float:
+        """获取技能的执行超时（秒）"""
+        skill = self.get_skill(skill_name)
+        if skill and skill.timeout:
+            return skill.timeout
+        return SKILL_DEFAULT_TIMEOUT
+    
+    def execute_skills(self, calls: List[Tuple[str, Dict[str, Any]]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        并发执行多个技能调用
+        
+        所有调用提交到有界线程池中同时执行。每个调用从开始执行时按各自技能的超时时间计时，
+        在线程池中排队（其他请求的技能占满线程）的时间不计入；排队超过 SKILL_QUEUE_TIMEOUT
+        仍未开始的调用取消执行。超时的调用返回失败结果（其线程会在后台执行完毕后被丢弃）。
+        
+        Args:
+            calls: [(技能名称, 参数), ...]
+            
+        Yields:
+            (调用下标, 执行结果)，按完成先后顺序产出
+        """
+        executor = self._get_executor()
+        started = {}
+        
+        def run(index, skill_name, kwargs):
+            started[index] = time.monotonic()
+            return self.execute_skill(skill_name, **kwargs)
+        
+        submitted = time.monotonic()
+        pending = {}
+        for index, (skill_name, kwargs) in enumerate(calls):
+            future = executor.submit(run, index, skill_name, kwargs)
+            pending[future] = (index, skill_name)
+        
+        def deadline(index, skill_name):
+            if index in started:
+                return started[index] + self.get_skill_timeout(skill_name)
+            return submitted + SKILL_QUEUE_TIMEOUT
+        
+        while pending:
+            next_deadline = min(deadline(index, skill_name) for index, skill_name in pending.values())
+            done, _ = wait(pending, timeout=max(0, next_deadline - time.monotonic()),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                index, _ = pending.pop(future)
+                yield index, future.result()
+            
+            now = time.monotonic()
+            for future, (index, skill_name) in list(pending.items()):
+                if deadline(index, skill_name) > now or future.done():
+                    continue
+                if index in started:
+                    del pending[future]
+                    yield index, {
+                        "success": False,
+                        "error": f"技能 '{skill_name}' 执行超时（{self.get_skill_timeout(skill_name):g} 秒）"
+                    }
+                elif future.cancel():
+                    # 还没开始执行；cancel 失败说明刚开始执行，下一轮按执行超时计时
+                    del pending[future]
+                    yield index, {
+                        "success": False,
+                        "error": f"技能 '{skill_name}' 排队超过 {SKILL_QUEUE_TIMEOUT:g} 秒仍未开始执行，系统繁忙，请稍后再试"
+                    }
+    
+    def stats(self) -> Dict[str, Any]:
+        skills = list(self._skills.values())
+        lazy = [skill for skill in skills if isinstance(skill, LazySkill)]
+        return {
+            'skills': len(skills),
+            'lazy': len(lazy),
+            'loaded': len(skills) - sum(1 for skill in lazy if not skill.loaded),
+            'load_seconds': {skill.name: round(skill.load_seconds, 3)
+                             for skill in lazy if skill.load_seconds is not None},
+        }
+    
     def __len__(self) -> int:
         """返回已注册技能数量"""
         return len(self._skills)
@@ -23,6 +23,8 @@ except ImportError:
 class WeatherSkill(BaseSkill):
     """获取指定城市当前天气信息的技能"""
 
+    timeout = 25  # 地理编码 + 天气查询两次请求，各 10 秒超时
+
     def get_name(self) -> str:
         return "get_weather"
 
@@ -50,33 +50,15 @@ def _convert_datetime_fields(data):
     else:
         return _serialize_datetime(data)
 
-try:
-    from skills.base import BaseSkill
-    from app import get_db_connection
-except ImportError:
-    from skills.base import BaseSkill
-    import pymysql
-    from contextlib import contextmanager
-    
-    @contextmanager
-    def get_db_connection():
-        connection = pymysql.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            port=int(os.getenv('DB_PORT', 3306)),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', ''),
-            database=os.getenv('DB_NAME', 'arc_logi_chat'),
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        try:
-            yield connection
-        finally:
-            connection.close()
+from skills.base import BaseSkill
+from db import get_db_connection
+from migrations import ensure_schema
 
 
 class KnowledgeBaseSkill(BaseSkill):
     
+    keywords = ['记住', '记下', '笔记', '备忘', '我之前说过', '查一下我的', '资料']
+    
     def get_name(self) -> str:
         return "knowledge_base"
     
@@ -213,70 +195,21 @@ class KnowledgeBaseSkill(BaseSkill):
             return {'id': cursor.lastrowid, 'name': '默认知识库', 'is_default': True}
     
     def _ensure_tables_exist(self):
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            tables_to_create = [
-                """
-                CREATE TABLE IF NOT EXISTS knowledge_tag (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(50) NOT NULL UNIQUE,
-                    color VARCHAR(20) DEFAULT '#1890ff',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS knowledge_category (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    parent_id INT DEFAULT NULL,
-                    knowledge_base_id INT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (knowledge_base_id) REFERENCES knowledge_base(id) ON DELETE CASCADE
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS knowledge_version (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    item_id INT NOT NULL,
-                    version_number INT NOT NULL,
-                    title VARCHAR(200),
-                    content TEXT,
-                    metadata JSON,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    created_by VARCHAR(50),
-                    FOREIGN KEY (item_id) REFERENCES knowledge_item(id) ON DELETE CASCADE
-                )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS knowledge_history (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    item_id INT,
-                    action VARCHAR(20) NOT NULL,
-                    old_data JSON,
-                    new_data JSON,
-                    username VARCHAR(50),
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            ]
-            
-            for sql in tables_to_create:
-                cursor.execute(sql)
-            conn.commit()
+        """确认表结构已迁移到最新版本（每个进程只检查一次，不在写入路径上执行 DDL）"""
+        ensure_schema()
     
     def _write_knowledge(self, content: str, title: Optional[str] = None,
                          tags: Optional[List[str]] = None, category: Optional[str] = None,
                          item_type: str = "text", knowledge_base_id: Optional[int] = None,
                          **kwargs) -> Dict[str, Any]:
         
-        self._ensure_tables_exist()
-        
         username = _get_username(kwargs)
         
         if not content:
             return {"success": False, "error": "知识内容不能为空"}
         
+        self._ensure_tables_exist()
+        
         if not title:
             title = content[:50] + "..." if len(content) > 50 else content
         
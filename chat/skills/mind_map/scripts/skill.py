@@ -21,6 +21,8 @@ except ImportError:
 class MindMapSkill(BaseSkill):
     """生成文本的思维导图"""
 
+    timeout = 120  # 需要调用大模型提取关键点
+
     def get_name(self) -> str:
         return "mind_map"
 
@@ -121,14 +123,13 @@ class MindMapSkill(BaseSkill):
             }
         """
         try:
-            import openai
+            from llm_gateway import chat_completion
             
             # 构建提示词
             prompt = self._build_extraction_prompt(text, language, max_depth)
             
             # 调用 OpenAI API
-            client = openai.OpenAI()
-            response = client.chat.completions.create(
+            response = chat_completion(
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "你是一个专业的文本分析助手，擅长从文本中提取关键点并构建清晰的层次结构。"},
@@ -21,6 +21,8 @@ except ImportError:
 class ProductManagerSkill(BaseSkill):
     """产品经理技能 - 生成产品方案"""
 
+    timeout = 120  # 需要调用大模型生成方案
+
     def get_name(self) -> str:
         return "product_manager"
 
@@ -90,14 +92,13 @@ class ProductManagerSkill(BaseSkill):
     def _generate_with_ai(self, topic: str, detail_level: str, target_audience: str, 
                          innovation_level: str) -> Dict[str, Any]:
         """使用OpenAI生成产品方案"""
-        import openai
+        from llm_gateway import chat_completion
         
         # 构建提示词
         prompt = self._build_prompt(topic, detail_level, target_audience, innovation_level)
         
         # 调用OpenAI API
-        client = openai.OpenAI()
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "你是一位资深产品经理，擅长提出有建设性的产品方案和创意。请严格按照指定的JSON格式输出。"},
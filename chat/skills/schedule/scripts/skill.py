@@ -21,6 +21,7 @@ except ImportError:
 try:
     import pymysql
     from croniter import croniter
+    from db import get_pool
 except ImportError:
     pymysql = None
     croniter = None
@@ -29,6 +30,8 @@ except ImportError:
 class ScheduleSkill(BaseSkill):
     """定时任务技能"""
 
+    keywords = ['提醒', '定时', '每天', '每周', '闹钟', '周期', '到点', 'cron']
+
     def get_name(self) -> str:
         return "create_schedule"
 
@@ -145,25 +148,11 @@ class ScheduleSkill(BaseSkill):
             raise ValueError("未提供用户名，请先登录")
         return username
 
-    def _get_db_config(self):
-        """获取数据库配置"""
-        if pymysql is None:
-            raise ImportError("pymysql 库未安装，请运行: pip install pymysql")
-        return {
-            'host': os.getenv('DB_HOST', 'localhost'),
-            'port': int(os.getenv('DB_PORT', 3306)),
-            'user': os.getenv('DB_USER', 'root'),
-            'password': os.getenv('DB_PASSWORD', ''),
-            'database': os.getenv('DB_NAME', 'arc_logi_chat'),
-            'charset': os.getenv('DB_CHARSET', 'utf8mb4'),
-            'cursorclass': pymysql.cursors.DictCursor
-        }
-
     def _get_db_connection(self):
-        """获取数据库连接"""
+        """从共享连接池获取数据库连接（close() 即归还连接池）"""
         if pymysql is None:
             raise ImportError("pymysql 库未安装，请运行: pip install pymysql")
-        return pymysql.connect(**self._get_db_config())
+        return get_pool().acquire()
 
     def _validate_cron(self, cron_str):
         """验证 cron 表达式并返回下次执行时间"""
@@ -22,6 +22,8 @@ except ImportError:
 class WebSearchNewsSkill(BaseSkill):
     """联网搜索最新新闻和事件的技能"""
 
+    timeout = 30
+
     def get_name(self) -> str:
         return "web_search_news"
 
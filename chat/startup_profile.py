@@ -0,0 +1,149 @@
+"""
+启动耗时统计
+
+进程冷启动（导入 app.py）要导入 Flask、各个共享模块和全部依赖，启动变慢时很难看出是哪个包拖慢的。
+这里在 sys.meta_path 最前面插入一个查找器，为每个从文件加载的模块的执行计时：
+
+- 自身耗时：模块代码本身的执行时间（不含它导入的其他模块）
+- 累计耗时：包含它导入的其他模块，与 python -X importtime 的 cumulative 含义相同
+
+启动完成后按顶层包汇总自身耗时打印最慢的几个，完整数据通过 /health 的 startup 字段查看。
+启动之后按需导入的重依赖（如第一次调用大模型时导入 openai）同样会被记录，列在 lazy 中。
+
+环境变量：
+    STARTUP_PROFILE       是否记录导入耗时，默认 1
+    STARTUP_PROFILE_TOP   启动报告列出的包数量，默认 10
+"""
+
+import importlib.machinery
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE', '1') not in ('0', 'false', 'False', '')
+STARTUP_PROFILE_TOP = int(os.getenv('STARTUP_PROFILE_TOP', '10'))
+
+_FILE_LOADERS = (importlib.machinery.SourceFileLoader, importlib.machinery.SourcelessFileLoader,
+                 importlib.machinery.ExtensionFileLoader)
+
+
+class _TimingFinder:
+    """查找真正的模块规范，并给文件加载器的 exec_module 套上计时"""
+
+    def __init__(self, profile: 'StartupProfile'):
+        self.profile = profile
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        # 其他查找器内部可能再调用 importlib.util.find_spec（如 pytest 的断言改写），此时不再进入
+        if getattr(self._local, 'searching', False):
+            return None
+        self._local.searching = True
+        try:
+            spec = self._find_spec(fullname, path, target)
+        finally:
+            self._local.searching = False
+        if spec is not None:
+            # 文件加载器每个模块一个实例，可以直接替换实例上的方法；内置、冻结模块的加载器是共享的类，不计时
+            loader = spec.loader
+            if isinstance(loader, _FILE_LOADERS) and 'exec_module' not in vars(loader):
+                loader.exec_module = self.profile.timed(fullname, loader.exec_module)
+        return spec
+
+    def _find_spec(self, fullname, path, target):
+        for finder in sys.meta_path:
+            if isinstance(finder, _TimingFinder) or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                return spec
+        return None
+
+
+class StartupProfile:
+    """模块导入耗时记录"""
+
+    def __init__(self, enabled: bool = STARTUP_PROFILE, top: int = STARTUP_PROFILE_TOP):
+        self.enabled = enabled
+        self.top = top
+        self._finder = _TimingFinder(self)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started: Optional[float] = None
+        self.startup_seconds: Optional[float] = None
+        # {模块名: [自身耗时, 累计耗时, 是否在启动完成之后导入]}
+        self.modules: Dict[str, List[Any]] = {}
+
+    def begin(self):
+        """开始记录（在导入其他模块之前调用）"""
+        if not self.enabled or self._started is not None:
+            return
+        self._started = time.perf_counter()
+        if self._finder not in sys.meta_path:
+            sys.meta_path.insert(0, self._finder)
+
+    def end(self):
+        """启动完成：打印报告，之后导入的模块记为按需导入"""
+        if self._started is None or self.startup_seconds is not None:
+            return
+        self.startup_seconds = time.perf_counter() - self._started
+        top = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.by_package(startup=True)[:self.top])
+        print(f"⏱️  启动耗时 {self.startup_seconds:.2f}s，导入 {len(self.modules)} 个模块，最慢: {top}")
+
+    def stop(self):
+        """移除查找器，不再记录"""
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    def timed(self, name: str, exec_module):
+        def wrapper(module):
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                stack = self._local.stack = []
+            # [开始时间, 子模块耗时]
+            frame = [time.perf_counter(), 0.0]
+            stack.append(frame)
+            try:
+                exec_module(module)
+            finally:
+                stack.pop()
+                cumulative = time.perf_counter() - frame[0]
+                if stack:
+                    stack[-1][1] += cumulative
+                with self._lock:
+                    self.modules[name] = [cumulative - frame[1], cumulative, self.startup_seconds is not None]
+        return wrapper
+
+    def by_package(self, startup: bool = True) -> List[tuple]:
+        """按顶层包汇总自身耗时，从慢到快排序"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, (self_seconds, _, lazy) in self.modules.items():
+                if lazy == (not startup):
+                    package = name.split('.', 1)[0]
+                    totals[package] = totals.get(package, 0.0) + self_seconds
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count = len(self.modules)
+        return {
+            'enabled': self.enabled,
+            'startup_seconds': round(self.startup_seconds, 3) if self.startup_seconds is not None else None,
+            'modules': count,
+            'slowest_packages': [(name, round(seconds, 4)) for name, seconds in self.by_package(startup=True)[:self.top]],
+            'lazy': [(name, round(seconds, 4)) for name, seconds in self.by_package(startup=False)],
+        }
+
+
+startup_profile = StartupProfile()
+
+
+__all__ = ['StartupProfile', 'startup_profile']
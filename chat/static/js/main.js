@@ -7,7 +7,7 @@ let currentSystemPrompt = '';
 let agents = [];
 let currentUser = null;
 let currentTheme = 'dark';
-let currentPage = 1;
+let nextConversationCursor = null;
 let hasMoreConversations = false;
 let isRecording = false;
 let recognition = null;
@@ -592,44 +592,43 @@ async function sendMessage() {
             throw new Error('请求失败');
         }
 
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        let fullResponse = '';
+        // 生成在服务端作为任务运行，断线后凭任务 ID 和最后收到的事件编号续传
+        const stream = {
+            jobId: response.headers.get('X-Chat-Job-Id'),
+            lastEventId: 0,
+            fullResponse: '',
+            finished: false
+        };
+        let attempt = 0;
+        let current = response;
 
         while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n');
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    try {
-                        const data = JSON.parse(line.slice(6));
-                        
-                        if (data.error) {
-                            showError(data.error);
-                            break;
-                        }
-                        
-                        if (data.content) {
-                            fullResponse += data.content;
-                            updateMessage(assistantMessageId, fullResponse);
-                        }
-                        
-                        if (data.thinking) {
-                            updateThinking(assistantMessageId, data.thinking);
-                        }
-                        
-                        if (data.done) {
-                            removeTypingIndicator(assistantMessageId);
-                        }
-                    } catch (e) {
-                        console.error('解析响应错误:', e);
-                    }
+            if (current) {
+                try {
+                    await readChatStream(current, stream, assistantMessageId);
+                } catch (e) {
+                    console.warn('流式响应中断:', e);
                 }
             }
+            if (stream.finished || !stream.jobId || attempt >= CHAT_RESUME_MAX_ATTEMPTS) break;
+
+            attempt += 1;
+            await new Promise(resolve => setTimeout(resolve, Math.min(1000 * attempt, 5000)));
+            current = null;
+            try {
+                const resumed = await fetch(`/api/chat/stream/${stream.jobId}`, {
+                    credentials: 'same-origin',
+                    headers: { 'Last-Event-ID': String(stream.lastEventId) }
+                });
+                if (resumed.status === 404) break;
+                if (resumed.ok) current = resumed;
+            } catch (e) {
+                console.warn('续传失败:', e);
+            }
+        }
+
+        if (!stream.finished) {
+            showError('连接中断，回答会在服务端继续生成并保存，稍后刷新对话即可查看');
         }
 
         // 更新对话列表
@@ -645,6 +644,72 @@ async function sendMessage() {
     }
 }
 
+const CHAT_RESUME_MAX_ATTEMPTS = 5;
+
+// 读取 /api/chat 的 SSE 事件，记录最后的事件编号（id 字段）供续传使用
+async function readChatStream(response, stream, assistantMessageId) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+            let eventId = null;
+            let payload = null;
+            for (const line of event.split('\n')) {
+                if (line.startsWith('id: ')) {
+                    eventId = parseInt(line.slice(4), 10);
+                } else if (line.startsWith('data: ')) {
+                    payload = line.slice(6);
+                }
+            }
+            if (payload === null) continue;
+            if (eventId !== null) {
+                stream.lastEventId = eventId;
+            }
+
+            try {
+                const data = JSON.parse(payload);
+                
+                if (data.error) {
+                    showError(data.error);
+                    stream.finished = true;
+                    return;
+                }
+                
+                // 续传时所需事件已不在服务端缓冲区中，用完整文本快照替换
+                if (data.snapshot) {
+                    stream.fullResponse = data.snapshot.content;
+                    updateMessage(assistantMessageId, stream.fullResponse);
+                }
+                
+                if (data.content) {
+                    stream.fullResponse += data.content;
+                    updateMessage(assistantMessageId, stream.fullResponse);
+                }
+                
+                if (data.thinking) {
+                    updateThinking(assistantMessageId, data.thinking);
+                }
+                
+                if (data.done) {
+                    stream.finished = true;
+                    removeTypingIndicator(assistantMessageId);
+                }
+            } catch (e) {
+                console.error('解析响应错误:', e);
+            }
+        }
+    }
+}
+
 // 添加消息到界面
 function appendMessage(role, content, isTyping = false) {
     const messageId = generateUUID();
@@ -770,16 +835,17 @@ function formatMessage(content) {
 async function loadConversations(reset = true) {
     try {
         if (reset) {
-            currentPage = 1;
+            nextConversationCursor = null;
             elements.conversationsList.innerHTML = '';
         }
         
-        const response = await fetch(`/api/conversations?page=${currentPage}&limit=10`, {
+        const response = await fetch(`/api/conversations?limit=10`, {
             credentials: 'same-origin'
         });
         const data = await response.json();
         
         hasMoreConversations = data.has_more;
+        nextConversationCursor = data.next_cursor;
         
         if (elements.loadMoreContainer) {
             elements.loadMoreContainer.style.display = hasMoreConversations ? 'block' : 'none';
@@ -826,13 +892,13 @@ async function loadMoreConversations() {
     }
     
     try {
-        currentPage++;
-        const response = await fetch(`/api/conversations?page=${currentPage}&limit=10`, {
+        const response = await fetch(`/api/conversations?limit=10&cursor=${encodeURIComponent(nextConversationCursor || '')}`, {
             credentials: 'same-origin'
         });
         const data = await response.json();
         
         hasMoreConversations = data.has_more;
+        nextConversationCursor = data.next_cursor;
         
         if (elements.loadMoreContainer) {
             elements.loadMoreContainer.style.display = hasMoreConversations ? 'block' : 'none';
@@ -875,7 +941,6 @@ async function loadMoreConversations() {
         }
     } catch (error) {
         console.error('加载更多对话失败:', error);
-        currentPage--;
         if (elements.loadMoreBtn) {
             elements.loadMoreBtn.style.display = 'block';
         }
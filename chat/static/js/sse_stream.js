@@ -0,0 +1,62 @@
+// 内容生成接口的流式请求（?stream=1），事件格式与 /api/chat 相同：
+// {"content": 增量文本}、{"done": true}、{"error": 错误信息}
+// 参数校验失败时接口仍返回 JSON（{success: false, error}），这里统一转成 onError 回调
+
+async function streamGenerate(url, body, { onContent, onDone, onError }) {
+    const response = await fetch(url + (url.includes('?') ? '&' : '?') + 'stream=1', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(body)
+    });
+
+    const contentType = response.headers.get('Content-Type') || '';
+    if (!contentType.includes('text/event-stream')) {
+        const data = await response.json();
+        if (data.success) {
+            onContent(data.content, data.content);
+            onDone(data.content);
+        } else {
+            onError(data.error);
+        }
+        return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let fullContent = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+            if (!event.startsWith('data: ')) continue;
+            let data;
+            try {
+                data = JSON.parse(event.slice(6));
+            } catch (e) {
+                console.error('解析响应错误:', e);
+                continue;
+            }
+
+            if (data.error) {
+                onError(data.error);
+                return;
+            }
+            if (data.content) {
+                fullContent += data.content;
+                onContent(data.content, fullContent);
+            }
+            if (data.done) {
+                onDone(fullContent);
+            }
+        }
+    }
+}
@@ -0,0 +1,371 @@
+"""
+可续传的流式生成任务
+
+/api/chat 原来在 HTTP 响应的生成器里直接调用大模型，浏览器断线（移动网络切换、代理空闲超时）
+生成器就随之终止：回答只生成了一半、没有保存，用户只能重新发送并再付一次完整调用的费用。
+
+这里把一次生成与 HTTP 连接解耦，作为后台任务运行：
+
+- 任务产生的每个事件按顺序编号，保存在有界的环形缓冲区中
+- 客户端通过 SSE 读取事件，每个事件带 id；断线后携带 Last-Event-ID 重新连接，
+  从断点之后继续读取
+- 断线时间过长、所需事件已被挤出缓冲区时，先发送一个 snapshot 事件（到目前为止的完整文本，
+  多模型对比时另有按模型区分的 models），再继续发送之后的事件
+- 任务不依赖客户端连接，没有客户端在读时也会运行到结束（包括保存对话）
+- 结束的任务保留 CHAT_STREAM_RETENTION 秒供断线客户端取回结果，之后清理
+- 同一对话已有任务在运行时不再启动新任务，直接返回正在运行的任务（客户端断线后重发不会叠加生成）
+- 运行中的任务数按用户和全局限制，超出时拒绝（/api/chat 返回 429）；任务在大小为
+  CHAT_STREAM_MAX_JOBS 的线程池中运行，并发用户再多，生成占用的线程数也不超过这个上限
+
+任务保存在当前进程内存中，多进程部署时续传请求需要落到同一个进程（按会话粘滞）。
+
+环境变量：
+    CHAT_STREAM_BUFFER_SIZE   每个任务缓冲的事件数，默认 2000
+    CHAT_STREAM_RETENTION     任务结束后保留的时间（秒），默认 300
+    CHAT_STREAM_HEARTBEAT     没有新事件时发送心跳注释的间隔（秒），默认 15
+    CHAT_STREAM_MAX_JOBS      全局同时运行的任务数上限，默认 64
+    CHAT_STREAM_MAX_JOBS_PER_USER  每个用户同时运行的任务数上限，默认 3
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+CHAT_STREAM_BUFFER_SIZE = int(os.getenv('CHAT_STREAM_BUFFER_SIZE', '2000'))
+CHAT_STREAM_RETENTION = float(os.getenv('CHAT_STREAM_RETENTION', '300'))
+CHAT_STREAM_HEARTBEAT = float(os.getenv('CHAT_STREAM_HEARTBEAT', '15'))
+CHAT_STREAM_MAX_JOBS = int(os.getenv('CHAT_STREAM_MAX_JOBS', '64'))
+CHAT_STREAM_MAX_JOBS_PER_USER = int(os.getenv('CHAT_STREAM_MAX_JOBS_PER_USER', '3'))
+
+
+class StreamJobLimitError(Exception):
+    """运行中的任务数达到上限"""
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """解析 Last-Event-ID，无效时从头开始"""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class StreamJob:
+    """一次流式生成：编号事件的环形缓冲区"""
+
+    def __init__(self, username: str, conversation_id: Optional[str] = None,
+                 buffer_size: int = CHAT_STREAM_BUFFER_SIZE):
+        self.id = uuid.uuid4().hex
+        self.username = username
+        self.conversation_id = conversation_id
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._cond = threading.Condition()
+        self._events: deque = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._text = []
+        self._model_text: Dict[str, list] = {}
+        self._async_waiters = set()
+        self.subscribers = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def last_event_id(self) -> int:
+        return self._last_id
+
+    def publish(self, payload: Dict[str, Any]) -> int:
+        """追加一个事件，返回事件编号"""
+        data = json.dumps(payload)
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, data))
+            if payload.get('content'):
+                # 对比模式的文本片段带 model 字段，按模型分别累积
+                if payload.get('model'):
+                    self._model_text.setdefault(payload['model'], []).append(payload['content'])
+                else:
+                    self._text.append(payload['content'])
+            self._cond.notify_all()
+            self._wake_async_waiters()
+            return self._last_id
+
+    def finish(self):
+        with self._cond:
+            if self.finished_at is None:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+            self._wake_async_waiters()
+
+    def _pending(self, cursor: int) -> list:
+        """cursor 之后的事件（需持有锁）；断点之后的事件已被挤出缓冲区时返回快照事件"""
+        oldest = self._events[0][0] if self._events else self._last_id + 1
+        if cursor + 1 < oldest and cursor < self._last_id:
+            snapshot = {'content': ''.join(self._text)}
+            if self._model_text:
+                snapshot['models'] = {model: ''.join(text) for model, text in self._model_text.items()}
+            return [(self._last_id, json.dumps({'snapshot': snapshot}))]
+        return [event for event in self._events if event[0] > cursor]
+
+    def events(self, last_event_id: int = 0, heartbeat: float = CHAT_STREAM_HEARTBEAT) -> Iterator[Optional[tuple]]:
+        """产出 (编号, JSON 数据)；等待超过 heartbeat 秒没有新事件时产出 None（用于发送心跳）
+
+        last_event_id 之后的事件已被挤出缓冲区时，先产出一个 snapshot 事件（编号为当前最新编号），
+        包含到目前为止的完整文本。任务结束且事件读完后停止。
+        """
+        with self._cond:
+            cursor = min(last_event_id, self._last_id)
+        while True:
+            with self._cond:
+                pending = self._pending(cursor)
+                if not pending:
+                    if self.finished:
+                        return
+                    self._cond.wait(heartbeat)
+                    if self._last_id <= cursor and not self.finished:
+                        pending = [None]
+            for event in pending:
+                if event is not None:
+                    cursor = event[0]
+                yield event
+
+    async def aevents(self, last_event_id: int = 0,
+                      heartbeat: float = CHAT_STREAM_HEARTBEAT) -> AsyncIterator[Optional[tuple]]:
+        """events() 的异步版本：等待新事件时只挂起协程，不占用线程（ASGI 模式使用）"""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        waiter = (loop, wakeup)
+        with self._cond:
+            cursor = min(last_event_id, self._last_id)
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                wakeup.clear()
+                with self._cond:
+                    pending = self._pending(cursor)
+                    finished = self.finished
+                if pending:
+                    for event in pending:
+                        cursor = event[0]
+                        yield event
+                    continue
+                if finished:
+                    return
+                try:
+                    await asyncio.wait_for(wakeup.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+    def _wake_async_waiters(self):
+        """唤醒等待中的协程（需持有锁）"""
+        for loop, wakeup in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'id': self.id,
+                'conversation_id': self.conversation_id,
+                'events': self._last_id,
+                'buffered': len(self._events),
+                'finished': self.finished,
+                'subscribers': self.subscribers,
+            }
+
+
+class StreamJobManager:
+    """在有界线程池中运行生成任务，按编号保存事件供客户端读取和续传"""
+
+    def __init__(self, buffer_size: int = CHAT_STREAM_BUFFER_SIZE, retention: float = CHAT_STREAM_RETENTION,
+                 max_jobs: int = CHAT_STREAM_MAX_JOBS, max_jobs_per_user: int = CHAT_STREAM_MAX_JOBS_PER_USER):
+        self.buffer_size = buffer_size
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self.max_jobs_per_user = max_jobs_per_user
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, StreamJob] = {}
+        # 运行中的任务数不超过 max_jobs，线程池不会排队
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='stream-job')
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.resumed = 0
+        self.reused = 0
+        self.rejected = 0
+
+    def _cleanup(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and now - job.finished_at > self.retention]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _running(self, username: str, conversation_id: Optional[str]) -> Optional[StreamJob]:
+        """对话正在运行的任务（需持有锁）"""
+        for job in self._jobs.values():
+            if not job.finished and job.username == username and job.conversation_id == conversation_id:
+                return job
+        return None
+
+    def _check_limits(self, username: str):
+        """运行中的任务数达到上限时抛出 StreamJobLimitError（需持有锁）"""
+        running = [job for job in self._jobs.values() if not job.finished]
+        if len(running) >= self.max_jobs:
+            self.rejected += 1
+            raise StreamJobLimitError('服务器繁忙，请稍后再试')
+        if sum(1 for job in running if job.username == username) >= self.max_jobs_per_user:
+            self.rejected += 1
+            raise StreamJobLimitError(f'同时进行的对话不能超过 {self.max_jobs_per_user} 个，请等待回答完成')
+
+    def running(self, username: str, conversation_id: str) -> Optional[StreamJob]:
+        """对话正在运行的任务，没有时返回 None"""
+        with self._lock:
+            return self._running(username, conversation_id)
+
+    def check_limits(self, username: str):
+        """启动前检查任务数上限（在创建分支等有副作用的操作之前调用），超出时抛出 StreamJobLimitError"""
+        self._cleanup()
+        with self._lock:
+            self._check_limits(username)
+
+    def start(self, username: str, producer: Callable[[], Iterable[Dict[str, Any]]],
+              conversation_id: Optional[str] = None) -> StreamJob:
+        """启动任务：在线程池中迭代 producer() 产出的事件
+
+        producer 抛出的异常转换为 {"error": ...} 事件；无论是否有客户端在读，任务都会运行到结束。
+        同一对话已有任务在运行时不启动新任务，返回正在运行的任务；
+        运行中的任务数达到上限时抛出 StreamJobLimitError。
+        """
+        self._cleanup()
+        with self._lock:
+            if conversation_id is not None:
+                running = self._running(username, conversation_id)
+                if running is not None:
+                    self.reused += 1
+                    return running
+            self._check_limits(username)
+            job = StreamJob(username, conversation_id, self.buffer_size)
+            self._jobs[job.id] = job
+            self.started += 1
+
+        def run():
+            ok = True
+            try:
+                for payload in producer():
+                    job.publish(payload)
+            except Exception as e:
+                ok = False
+                print(f"❌ 流式任务 {job.id} 失败: {e}")
+                job.publish({'error': str(e)})
+            finally:
+                job.finish()
+                with self._lock:
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+        self._executor.submit(run)
+        return job
+
+    def get(self, job_id: str, username: str) -> Optional[StreamJob]:
+        """按编号查找任务（只能访问自己的任务）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.username != username:
+            return None
+        return job
+
+    def find_active(self, username: str, conversation_id: str) -> Optional[StreamJob]:
+        """查找某个对话最近一次仍可读取的任务（页面刷新后续传用）"""
+        self._cleanup()
+        with self._lock:
+            candidates = [job for job in self._jobs.values()
+                          if job.username == username and job.conversation_id == conversation_id]
+        return max(candidates, key=lambda job: job.created_at) if candidates else None
+
+    def sse(self, job: StreamJob, last_event_id: int = 0, heartbeat: float = CHAT_STREAM_HEARTBEAT) -> Iterator[str]:
+        """把任务事件格式化为 SSE 文本（带 id 字段），客户端断开不影响任务本身"""
+        if last_event_id:
+            with self._lock:
+                self.resumed += 1
+        with self._lock:
+            job.subscribers += 1
+        try:
+            for event in job.events(last_event_id, heartbeat):
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"id: {event[0]}\ndata: {event[1]}\n\n"
+        finally:
+            with self._lock:
+                job.subscribers -= 1
+
+    async def asse(self, job: StreamJob, last_event_id: int = 0,
+                   heartbeat: float = CHAT_STREAM_HEARTBEAT) -> AsyncIterator[str]:
+        """sse() 的异步版本（ASGI 模式使用）"""
+        if last_event_id:
+            with self._lock:
+                self.resumed += 1
+        with self._lock:
+            job.subscribers += 1
+        try:
+            async for event in job.aevents(last_event_id, heartbeat):
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield f"id: {event[0]}\ndata: {event[1]}\n\n"
+        finally:
+            with self._lock:
+                job.subscribers -= 1
+
+    def lookup(self, job_id: str) -> Optional[StreamJob]:
+        """按编号查找任务，不校验用户（调用方已经过 Flask 视图鉴权）"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+            return {
+                'jobs': len(jobs),
+                'running': sum(1 for job in jobs if not job.finished),
+                'detached': sum(1 for job in jobs if not job.finished and job.subscribers == 0),
+                'started': self.started,
+                'completed': self.completed,
+                'failed': self.failed,
+                'resumed': self.resumed,
+                'reused': self.reused,
+                'rejected': self.rejected,
+                'max_jobs': self.max_jobs,
+                'max_jobs_per_user': self.max_jobs_per_user,
+                'buffer_size': self.buffer_size,
+                'retention': self.retention,
+            }
+
+
+stream_jobs = StreamJobManager()
+
+
+__all__ = ['StreamJob', 'StreamJobLimitError', 'StreamJobManager', 'parse_last_event_id', 'stream_jobs']
@@ -0,0 +1,108 @@
+import unittest
+import sys
+import os
+import asyncio
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import patch
+from flask import Flask, Response, request, stream_with_context, jsonify
+
+import asgi
+from stream_jobs import StreamJob, StreamJobManager
+
+
+def make_app(manager):
+    app = Flask(__name__)
+
+    @app.route('/json', methods=['POST'])
+    def json_view():
+        return jsonify({'echo': request.get_json(), 'q': request.args.get('q')})
+
+    @app.route('/wsgi-stream')
+    def wsgi_stream():
+        def generate():
+            for i in range(3):
+                yield f"data: {request.path}:{i}\n\n"
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+    @app.route('/job/<job_id>')
+    def job_stream(job_id):
+        job = manager.lookup(job_id)
+        return Response(manager.sse(job), mimetype='text/event-stream', headers={'X-Chat-Job-Id': job.id})
+
+    return app
+
+
+async def call(path, method='GET', body=b'', query=b'', headers=()):
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query, 'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers),
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 5000), 'scheme': 'http', 'http_version': '1.1',
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    disconnect = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.application(scope, receive, send)
+    disconnect.set()
+    status = sent[0]['status']
+    headers = dict(sent[0]['headers'])
+    return status, headers, b''.join(m.get('body', b'') for m in sent[1:]).decode('utf-8')
+
+
+class TestAsgi(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = StreamJobManager()
+        patcher = patch.multiple(asgi, flask_app=make_app(self.manager), stream_jobs=self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_json_api_is_unchanged(self):
+        status, headers, body = asyncio.run(call('/json', 'POST', json.dumps({'a': 1}).encode(), b'q=%E4%B8%AD'))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {'echo': {'a': 1}, 'q': '中'})
+
+    def test_wsgi_stream_keeps_request_context(self):
+        status, headers, body = asyncio.run(call('/wsgi-stream'))
+        self.assertEqual(body, 'data: /wsgi-stream:0\n\ndata: /wsgi-stream:1\n\ndata: /wsgi-stream:2\n\n')
+
+    def test_job_stream_is_read_asynchronously(self):
+        def producer():
+            yield {'content': 'a'}
+            yield {'content': 'b'}
+            yield {'done': True}
+
+        job = self.manager.start('alice', producer)
+        status, headers, body = asyncio.run(call(f'/job/{job.id}', headers=[(b'last-event-id', b'1')]))
+        self.assertEqual(headers[b'x-chat-job-id'], job.id.encode())
+        self.assertEqual(body, 'id: 2\ndata: {"content": "b"}\n\nid: 3\ndata: {"done": true}\n\n')
+        self.assertEqual(job.subscribers, 0)
+
+    def test_async_reader_waits_without_thread(self):
+        async def run():
+            pending = StreamJob('alice')
+            reader = pending.aevents(0, heartbeat=5)
+            task = asyncio.ensure_future(reader.__anext__())
+            await asyncio.sleep(0.01)
+            self.assertFalse(task.done())
+            # 在其他线程中发布事件，协程被唤醒
+            await asyncio.get_running_loop().run_in_executor(None, pending.publish, {'content': 'x'})
+            return await asyncio.wait_for(task, 1)
+
+        self.assertEqual(asyncio.run(run()), (1, '{"content": "x"}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import MagicMock
+
+from chat_context_cache import ChatContextCache
+
+
+class TestChatContextCache(unittest.TestCase):
+
+    def test_get_or_load_caches_including_none(self):
+        cache = ChatContextCache(max_users=10, ttl=60)
+        loader = MagicMock(return_value=None)
+        self.assertIsNone(cache.get_or_load('alice', 'user_info', loader))
+        self.assertIsNone(cache.get_or_load('alice', 'user_info', loader))
+        loader.assert_called_once()
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_invalidate_drops_only_that_user(self):
+        cache = ChatContextCache(max_users=10, ttl=60)
+        cache.set('alice', 'tools', [1])
+        cache.set('alice', 'agent:1', {'model': 'gpt-4'})
+        cache.set('bob', 'tools', [2])
+        cache.invalidate('alice')
+        self.assertEqual(cache.get('alice', 'tools'), (False, None))
+        self.assertEqual(cache.get('alice', 'agent:1'), (False, None))
+        self.assertEqual(cache.get('bob', 'tools'), (True, [2]))
+
+    def test_lru_evicts_least_recent_user(self):
+        cache = ChatContextCache(max_users=2, ttl=60)
+        cache.set('a', 'tools', 1)
+        cache.set('b', 'tools', 2)
+        cache.get('a', 'tools')
+        cache.set('c', 'tools', 3)
+        self.assertTrue(cache.get('a', 'tools')[0])
+        self.assertFalse(cache.get('b', 'tools')[0])
+
+    def test_entries_expire(self):
+        cache = ChatContextCache(max_users=10, ttl=0)
+        cache.set('alice', 'tools', [1])
+        self.assertFalse(cache.get('alice', 'tools')[0])
+
+    def test_redis_backend(self):
+        store = {}
+        redis_client = MagicMock()
+        redis_client.hget.side_effect = lambda key, field: store.get((key, field))
+        pipe = redis_client.pipeline.return_value
+        pipe.hset.side_effect = lambda key, field, value: store.__setitem__((key, field), value)
+        redis_client.delete.side_effect = lambda key: [store.pop(k) for k in list(store) if k[0] == key]
+
+        cache = ChatContextCache(redis_client=redis_client)
+        cache.set('alice', 'tools', [{'type': 'function'}])
+        self.assertEqual(cache.get('alice', 'tools'), (True, [{'type': 'function'}]))
+        cache.invalidate('alice')
+        self.assertEqual(cache.get('alice', 'tools'), (False, None))
+        self.assertEqual(cache.stats()['backend'], 'redis')
+
+    def test_redis_errors_fall_back_to_loader(self):
+        redis_client = MagicMock()
+        redis_client.hget.side_effect = ConnectionError('down')
+        redis_client.pipeline.side_effect = ConnectionError('down')
+        cache = ChatContextCache(redis_client=redis_client)
+        self.assertEqual(cache.get_or_load('alice', 'tools', lambda: [1]), [1])
+        self.assertEqual(cache.stats()['errors'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import classic_store
+from classic_store import ClassicStore, build_store, corpus_questions, load_passages, passage_question
+
+
+class TestClassicStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_corpus_matches_templates(self):
+        passages = load_passages('sanzijing')
+        self.assertEqual(passages[0], '人之初，性本善，性相近，习相远。')
+        self.assertTrue(load_passages('qianziwen'))
+        questions = corpus_questions()
+        self.assertIn(('三字经', passage_question(passages[0])), questions)
+        self.assertEqual(len(questions), len(set(questions)))
+
+    def test_build_and_lookup(self):
+        result = build_store(workers=4, directory=self.directory,
+                             generate=lambda name, content: f"{name}|{content}")
+        self.assertEqual(result['generated'], result['total'])
+
+        store = ClassicStore(self.directory)
+        question = passage_question('人之初，性本善，性相近，习相远。')
+        self.assertEqual(store.get('三字经', question), f"三字经|{question}")
+        # 输入按 response_cache 的规则规范化
+        self.assertEqual(store.get('三字经', f"  {question} "), f"三字经|{question}")
+        self.assertIsNone(store.get('三字经', '三字经的作者是谁？'))
+        self.assertEqual(store.stats()['entries'], result['total'])
+
+    def test_bounded_parallelism_and_incremental_rebuild(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def generate(name, content):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.001)
+            with lock:
+                active.pop()
+            if '人之初' in content:
+                raise RuntimeError('rate limited')
+            return content
+
+        first = build_store(workers=3, directory=self.directory, generate=generate)
+        self.assertLessEqual(max(peak), 3)
+        self.assertEqual(first['failed'], 1)
+
+        second = build_store(workers=3, directory=self.directory, generate=lambda name, content: content)
+        self.assertEqual(second['reused'], first['generated'])
+        self.assertEqual(second['generated'], 1)
+
+    def test_other_prompt_version_is_ignored(self):
+        build_store(workers=2, directory=self.directory, generate=lambda name, content: content)
+        store = ClassicStore(self.directory, version='0000deadbeef')
+        self.assertIsNone(store.get('三字经', classic_store.summary_question('三字经')))
+        self.assertFalse(store.stats()['loaded'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import sys
+import os
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import app as app_module
+
+
+def make_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class FakeStream:
+
+    def __init__(self, parts, error=None):
+        self.parts = parts
+        self.error = error
+        self.closed = False
+
+    def __iter__(self):
+        for part in self.parts:
+            yield make_chunk(part)
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def parse_events(response):
+    return [json.loads(line[6:]) for line in response.get_data(as_text=True).split('\n\n') if line.startswith('data: ')]
+
+
+class TestContentStream(unittest.TestCase):
+
+    def setUp(self):
+        app_module.response_cache._entries.clear()
+        self.client = app_module.app.test_client()
+        with self.client.session_transaction() as session:
+            session['username'] = 'tester'
+
+    def test_stream_emits_chat_format_and_fills_cache(self):
+        stream = FakeStream(['## ls', '\n列出目录'])
+        with patch.object(app_module, 'stream_chat_completion', return_value=stream) as create:
+            response = self.client.post('/api/linux/query?stream=1', json={'command': 'ls'})
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            events = parse_events(response)
+
+        self.assertEqual(events, [{'content': '## ls'}, {'content': '\n列出目录'}, {'done': True}])
+        self.assertTrue(stream.closed)
+        self.assertEqual(create.call_args.kwargs['max_tokens'], 2000)
+
+        # 非流式请求命中同一个缓存键
+        with patch.object(app_module, 'chat_completion') as completion:
+            data = self.client.post('/api/linux/query', json={'command': ' ｌｓ '}).get_json()
+        completion.assert_not_called()
+        self.assertEqual(data, {'success': True, 'content': '## ls\n列出目录'})
+
+    def test_cached_result_is_streamed_in_one_event(self):
+        completion = MagicMock()
+        completion.return_value.choices = [SimpleNamespace(message=SimpleNamespace(content='git rebase 用法'))]
+        with patch.object(app_module, 'chat_completion', completion):
+            self.client.post('/api/git/query', json={'command': 'rebase'})
+        with patch.object(app_module, 'stream_chat_completion') as create:
+            events = parse_events(self.client.post('/api/git/query?stream=1', json={'command': 'rebase'}))
+        create.assert_not_called()
+        self.assertEqual(events, [{'content': 'git rebase 用法'}, {'done': True}])
+
+    def test_uncached_endpoint_and_upstream_error(self):
+        stream = FakeStream(['标题'], error=RuntimeError('upstream reset'))
+        with patch.object(app_module, 'stream_chat_completion', return_value=stream) as create:
+            events = parse_events(self.client.post('/api/wechat/generate?stream=1',
+                                                   json={'niche': 'AI', 'trends': '大模型'}))
+        self.assertEqual(events, [{'content': '标题'}, {'error': 'upstream reset'}])
+        self.assertIn('细分领域：AI', create.call_args.kwargs['messages'][1]['content'])
+        self.assertEqual(app_module.response_cache.stats()['entries'], 0)
+
+    def test_validation_errors_stay_json(self):
+        response = self.client.post('/api/weibo/generate?stream=1', json={'keyword': ''})
+        self.assertEqual(response.get_json(), {'success': False, 'error': '请输入关键词或主题'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import context_window
+from context_window import build_context_window, count_message_tokens, count_tokens, SUMMARY_HEADER
+
+
+def turn(i, size=40):
+    return [
+        {'role': 'user', 'content': f'问题{i} ' + 'x' * size},
+        {'role': 'assistant', 'content': '', 'tool_calls': [{'id': f'call_{i}'}]},
+        {'role': 'tool', 'tool_call_id': f'call_{i}', 'content': '{"success": true}'},
+        {'role': 'assistant', 'content': f'回答{i} ' + 'y' * size},
+    ]
+
+
+class TestContextWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.system = [{'role': 'system', 'content': '你是助手'}]
+        self.current = {'role': 'user', 'content': '新问题', 'timestamp': '2024-01-01T00:00:00'}
+        self.history = [m for i in range(10) for m in turn(i)]
+
+    def test_count_tokens(self):
+        self.assertEqual(count_tokens(''), 0)
+        self.assertGreater(count_tokens('你好世界'), count_tokens('abcd'))
+
+    def test_everything_fits(self):
+        window = build_context_window(self.system, self.history, self.current, budget=100000)
+        self.assertEqual(window.cut, 0)
+        self.assertEqual(window.stats['saved_tokens'], 0)
+        # 工具中间消息不回放，时间戳等字段被去掉
+        self.assertEqual(len(window.messages), 1 + 20 + 1)
+        self.assertEqual(window.messages[-1], {'role': 'user', 'content': '新问题'})
+
+    def test_budget_keeps_latest_whole_turns(self):
+        turn_tokens = sum(count_message_tokens(m) for m in turn(9) if m.get('content') and m['role'] != 'tool')
+        fixed = count_message_tokens(self.system[0]) + count_message_tokens(self.current)
+        window = build_context_window(self.system, self.history, self.current, budget=fixed + turn_tokens * 3 + 1)
+
+        self.assertEqual(window.cut, 28)
+        self.assertEqual(window.messages[1]['role'], 'user')
+        self.assertTrue(window.messages[1]['content'].startswith('问题7'))
+        self.assertLessEqual(window.stats['used_tokens'], window.stats['budget'])
+        self.assertGreater(window.stats['saved_tokens'], 0)
+        self.assertTrue(window.needs_summary_update(0))
+
+    def test_summary_replaces_covered_messages(self):
+        window = build_context_window(self.system, self.history, self.current, budget=200,
+                                      summary='用户在问 x 和 y', summary_upto=20)
+        self.assertTrue(window.stats['summary_used'])
+        self.assertEqual(window.messages[1]['role'], 'system')
+        self.assertTrue(window.messages[1]['content'].startswith(SUMMARY_HEADER))
+        self.assertGreaterEqual(window.cut, 20)
+        self.assertFalse(any(m['content'].startswith('问题4') for m in window.messages))
+
+    def test_summary_ignored_when_history_fits(self):
+        window = build_context_window(self.system, self.history, self.current, budget=100000,
+                                      summary='旧摘要', summary_upto=8)
+        self.assertFalse(window.stats['summary_used'])
+        self.assertFalse(window.needs_summary_update(8))
+
+    def test_compaction_leaves_headroom(self):
+        budget = 200
+        window = build_context_window(self.system, self.history, self.current, budget=budget, compact_ratio=0.6)
+        self.assertLessEqual(window.stats['used_tokens'], budget * 0.6)
+        full = build_context_window(self.system, self.history, self.current, budget=budget)
+        self.assertGreater(window.cut, full.cut)
+
+    def test_cut_stays_at_summary_boundary_while_tail_fits(self):
+        # 摘要已经覆盖到上一次截断的位置，之后每轮只追加消息，前缀保持不变
+        first = build_context_window(self.system, self.history[:32], self.current, budget=200,
+                                     summary='摘要', summary_upto=24, compact_ratio=0.6)
+        second = build_context_window(self.system, self.history[:36], self.current, budget=200,
+                                      summary='摘要', summary_upto=24, compact_ratio=0.6)
+        self.assertEqual((first.cut, second.cut), (24, 24))
+        self.assertEqual(second.messages[:len(first.messages) - 1], first.messages[:-1])
+        self.assertFalse(second.needs_summary_update(24))
+
+    def test_recall_sits_before_current_message(self):
+        plain = build_context_window(self.system, self.history, self.current, budget=100000)
+        window = build_context_window(self.system, self.history, self.current, budget=100000, recall='相关片段')
+        self.assertEqual(window.messages[-2], {'role': 'system', 'content': '相关片段'})
+        self.assertEqual(window.messages[:-2], plain.messages[:-1])
+        self.assertTrue(window.stats['recall_used'])
+        self.assertFalse(plain.stats['recall_used'])
+
+        # 召回片段占用预算，历史相应少放
+        tight = build_context_window(self.system, self.history, self.current, budget=200,
+                                     recall='相关片段 ' + 'z' * 200)
+        self.assertLessEqual(tight.stats['used_tokens'], 200 + count_tokens('z' * 200))
+        self.assertGreater(tight.cut, build_context_window(self.system, self.history, self.current, budget=200).cut)
+
+    def test_model_budget(self):
+        self.assertEqual(context_window.get_context_budget('gpt-4'), context_window.CONTEXT_TOKEN_BUDGETS['gpt-4'])
+        self.assertEqual(context_window.get_context_budget('unknown'), context_window.DEFAULT_CONTEXT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import unittest
+import sys
+import os
+import json
+import sqlite3
+from unittest.mock import patch
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversation_branches
+from conversation_branches import branch_ranges, create_branch, detach_branches, load_chain, read_messages, reparent
+
+
+class SqliteCursor:
+    """用 SQLite 模拟 pymysql 的 DictCursor（占位符换成 ?，去掉 FOR UPDATE）"""
+
+    def __init__(self, connection):
+        self._cursor = connection.cursor()
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace('%s', '?').replace(' FOR UPDATE', ''), tuple(params))
+
+    def _row(self, row):
+        return dict(zip([column[0] for column in self._cursor.description], row))
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+
+class TestConversationBranches(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.executescript("""
+            CREATE TABLE conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL,
+                username TEXT NOT NULL,
+                parent_conversation_id TEXT,
+                fork_seq INTEGER,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                title TEXT,
+                summary TEXT,
+                summary_upto INTEGER NOT NULL DEFAULT 0,
+                last_message_at TEXT,
+                updated_at TEXT,
+                UNIQUE (username, conversation_id)
+            );
+            CREATE TABLE conversation_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL,
+                username TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                message TEXT NOT NULL,
+                created_at TEXT,
+                UNIQUE (username, conversation_id, seq)
+            );
+        """)
+        self.cursor = SqliteCursor(self.db)
+        self.append('root', ['q0', 'a0', 'q1', 'a1', 'q2', 'a2'])
+        self.db.execute("UPDATE conversations SET title = 'q0', summary = '摘要', summary_upto = 2 "
+                        "WHERE conversation_id = 'root'")
+
+    def append(self, conversation_id, texts):
+        """和 save_conversation_to_db 一样从 message_count 开始追加"""
+        self.db.execute("INSERT OR IGNORE INTO conversations (conversation_id, username) VALUES (?, 'alice')",
+                        (conversation_id,))
+        start = self.db.execute("SELECT message_count FROM conversations WHERE conversation_id = ?",
+                                (conversation_id,)).fetchone()[0]
+        for offset, text in enumerate(texts):
+            role = 'user' if text.startswith('q') else 'assistant'
+            self.db.execute(
+                "INSERT INTO conversation_messages (conversation_id, username, seq, role, message) "
+                "VALUES (?, 'alice', ?, ?, ?)",
+                (conversation_id, start + offset, role, json.dumps({'role': role, 'content': text}))
+            )
+        self.db.execute("UPDATE conversations SET message_count = ? WHERE conversation_id = ?",
+                        (start + len(texts), conversation_id))
+
+    def branch(self, parent_id, fork_seq, conversation_id):
+        return create_branch(self.cursor, 'alice', parent_id, fork_seq, conversation_id)
+
+    def read(self, conversation_id):
+        chain = load_chain(self.cursor, 'alice', conversation_id)
+        return [m['content'] for m in read_messages(self.cursor, 'alice', chain)]
+
+    def stored_rows(self, conversation_id):
+        return self.db.execute("SELECT COUNT(*) FROM conversation_messages WHERE conversation_id = ?",
+                               (conversation_id,)).fetchone()[0]
+
+    def test_regenerate_costs_one_header_and_the_new_answer(self):
+        self.assertIsNone(self.branch('root', 5, 'regen'))
+        self.append('regen', ['a2-v2'])
+
+        self.assertEqual(self.read('regen'), ['q0', 'a0', 'q1', 'a1', 'q2', 'a2-v2'])
+        self.assertEqual(self.read('root'), ['q0', 'a0', 'q1', 'a1', 'q2', 'a2'])
+        self.assertEqual(self.stored_rows('regen'), 1)
+        header = self.db.execute("SELECT fork_seq, message_count, title, summary, summary_upto FROM conversations "
+                                 "WHERE conversation_id = 'regen'").fetchone()
+        self.assertEqual(header, (5, 6, 'q0', '摘要', 2))
+
+    def test_nested_branches(self):
+        self.branch('root', 2, 'edit')
+        self.append('edit', ['q1-edited', 'a1-edited', 'q2b', 'a2b'])
+        self.branch('edit', 3, 'edit2')
+        self.append('edit2', ['a1-again'])
+        # 从更早的位置再分支：只继承根对话
+        self.branch('edit2', 1, 'early')
+
+        self.assertEqual(self.read('edit'), ['q0', 'a0', 'q1-edited', 'a1-edited', 'q2b', 'a2b'])
+        self.assertEqual(self.read('edit2'), ['q0', 'a0', 'q1-edited', 'a1-again'])
+        self.assertEqual(self.read('early'), ['q0'])
+        # 摘要覆盖到分叉点之后的消息时不沿用
+        self.assertEqual(self.db.execute("SELECT summary FROM conversations WHERE conversation_id = 'early'")
+                         .fetchone()[0], None)
+
+    def test_invalid_branches(self):
+        self.assertEqual(self.branch('missing', 0, 'x')[1], 404)
+        self.assertEqual(self.branch('root', 7, 'x')[1], 400)
+        self.assertEqual(self.branch('root', 2, 'root')[1], 409)
+
+    def test_deep_chain_is_flattened(self):
+        parent = 'root'
+        with patch.object(conversation_branches, 'CONVERSATION_BRANCH_MAX_DEPTH', 3):
+            for depth in range(4):
+                self.branch(parent, 6 + depth, f'd{depth}')
+                self.append(f'd{depth}', [f'a{depth}'])
+                parent = f'd{depth}'
+
+            self.assertEqual(self.read('d3'), ['q0', 'a0', 'q1', 'a1', 'q2', 'a2', 'a0', 'a1', 'a2', 'a3'])
+            # d2 的父对话链达到 3 层，复制继承的消息；d3 又从 d2 正常分支
+            self.assertEqual(len(load_chain(self.cursor, 'alice', 'd2')), 1)
+            self.assertEqual(self.stored_rows('d2'), 9)
+            self.assertEqual(len(load_chain(self.cursor, 'alice', 'd3')), 2)
+            self.assertEqual(self.stored_rows('d3'), 1)
+
+    def test_deleting_a_parent_keeps_branches_intact(self):
+        self.branch('root', 2, 'mid')
+        self.append('mid', ['q1-mid', 'a1-mid'])
+        self.branch('mid', 3, 'leaf')
+        self.append('leaf', ['a1-leaf'])
+        before = self.read('leaf')
+
+        # 删除中间层：leaf 复制 mid 自己保存的那一段，改挂到 root
+        mid = load_chain(self.cursor, 'alice', 'mid')[0]
+        self.assertEqual(detach_branches(self.cursor, 'alice', mid), [('leaf', 2, 3)])
+        self.db.execute("DELETE FROM conversations WHERE conversation_id = 'mid'")
+        self.db.execute("DELETE FROM conversation_messages WHERE conversation_id = 'mid'")
+        self.assertEqual(self.read('leaf'), before)
+        self.assertEqual(self.stored_rows('leaf'), 2)
+        self.assertEqual(load_chain(self.cursor, 'alice', 'leaf')[0]['parent_conversation_id'], 'root')
+
+        # 删除根对话：leaf 成为根对话
+        root = load_chain(self.cursor, 'alice', 'root')[0]
+        self.assertEqual(detach_branches(self.cursor, 'alice', root), [('leaf', 0, 2)])
+        self.db.execute("DELETE FROM conversation_messages WHERE conversation_id = 'root'")
+        self.assertEqual(self.read('leaf'), before)
+        self.assertEqual(load_chain(self.cursor, 'alice', 'leaf')[0]['parent_conversation_id'], None)
+
+    def test_ranges_and_reparent(self):
+        chain = [
+            {'conversation_id': 'c', 'parent_conversation_id': 'b', 'fork_seq': 3},
+            {'conversation_id': 'b', 'parent_conversation_id': 'a', 'fork_seq': 5},
+            {'conversation_id': 'a', 'parent_conversation_id': None, 'fork_seq': None},
+        ]
+        # b 自己保存的消息从 5 开始，c 只继承到 3，所以 b 这一层不参与
+        self.assertEqual(branch_ranges(chain), [('c', 3, None), ('a', 0, 3)])
+        self.assertEqual(reparent(3, chain[1]), (5, 3, 'a', 3))
+        self.assertEqual(reparent(7, chain[1]), (5, 7, 'a', 5))
+        self.assertEqual(reparent(4, chain[2]), (0, 4, None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
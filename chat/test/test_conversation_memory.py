@@ -0,0 +1,174 @@
+import unittest
+import sys
+import os
+import json
+import contextlib
+import importlib.util
+import io
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from conversation_branches import branch_ranges
+from conversation_memory import ConversationMemory, format_memories, hash_vector, turn_snippet, MEMORY_HEADER
+
+
+class InMemoryConversationMemory(ConversationMemory):
+    """用列表代替 conversation_memory 表"""
+
+    def __init__(self, **kwargs):
+        super().__init__(enabled=True, dim=256, **kwargs)
+        self.rows = []
+        self.fetches = []
+
+    def _insert_row(self, username, conversation_id, seq, content, vector):
+        if any((r['username'], r['conversation_id'], r['seq']) == (username, conversation_id, seq) for r in self.rows):
+            return
+        self.rows.append({'id': len(self.rows) + 1, 'username': username, 'conversation_id': conversation_id,
+                          'seq': seq, 'content': content, 'vector': vector})
+
+    def _fetch_rows(self, username, after_id, limit):
+        self.fetches.append(after_id)
+        rows = [r for r in self.rows if r['username'] == username and r['id'] > after_id]
+        return rows[:limit] if after_id else rows[-limit:]
+
+    def _copy_rows(self, username, source_id, target_id, start, end):
+        for r in list(self.rows):
+            if (r['username'], r['conversation_id']) == (username, source_id) and start <= r['seq'] < end:
+                self._insert_row(username, target_id, r['seq'], r['content'], r['vector'])
+
+    def _delete_rows(self, username, conversation_id):
+        self.rows = [r for r in self.rows if (r['username'], r['conversation_id']) != (username, conversation_id)]
+
+
+class TestConversationMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = InMemoryConversationMemory()
+        self.memory.add_turn('alice', 'c1', 0, '帮我写一个 Python 快速排序', '可以用递归实现 quicksort，选取基准元素分区')
+        self.memory.add_turn('alice', 'c2', 0, '周末去杭州西湖旅游怎么安排', '第一天游览西湖断桥和雷峰塔，第二天去灵隐寺')
+        self.memory.add_turn('alice', 'c3', 0, 'MySQL 索引为什么失效', '对索引列使用函数或隐式类型转换会导致索引失效')
+        self.memory.add_turn('bob', 'c9', 0, '杭州西湖有哪些景点', '断桥、苏堤、雷峰塔')
+
+    def test_hash_vector(self):
+        vector = hash_vector('杭州西湖旅游', 256)
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+        np.testing.assert_array_equal(vector, hash_vector('杭州西湖旅游', 256))
+        self.assertEqual(float(np.linalg.norm(hash_vector('', 256))), 0.0)
+        related = float(vector @ hash_vector('西湖旅游攻略', 256))
+        unrelated = float(vector @ hash_vector('python quicksort', 256))
+        self.assertGreater(related, unrelated)
+
+    def test_search_returns_relevant_turns_of_that_user(self):
+        memories = self.memory.search('alice', '上次说的西湖旅游行程再详细一点', top_k=2, min_score=0.05)
+        self.assertEqual(memories[0]['conversation_id'], 'c2')
+        self.assertIn('雷峰塔', memories[0]['content'])
+        self.assertTrue(all(m['conversation_id'] != 'c9' for m in memories))
+        self.assertEqual(memories, sorted(memories, key=lambda m: -m['score']))
+
+        # 当前对话的片段已经在上下文窗口中，不重复召回
+        excluded = self.memory.search('alice', '西湖旅游', exclude_conversation='c2', min_score=0.05)
+        self.assertNotIn('c2', [m['conversation_id'] for m in excluded])
+        self.assertEqual(self.memory.search('alice', '西湖旅游', min_score=0.99), [])
+        self.assertEqual(self.memory.search('carol', '西湖旅游'), [])
+        self.assertEqual(self.memory.search('alice', '怎么样', min_score=0), [])
+
+    def test_new_turns_are_read_incrementally(self):
+        self.memory.search('alice', '快速排序', min_score=0.05)
+        self.memory.add_turn('alice', 'c4', 0, 'Redis 缓存穿透怎么处理', '可以用布隆过滤器或缓存空值')
+        # 同一轮重复写入被忽略
+        self.memory.add_turn('alice', 'c4', 0, 'Redis 缓存穿透怎么处理', '可以用布隆过滤器或缓存空值')
+
+        memories = self.memory.search('alice', '缓存穿透 布隆过滤器', min_score=0.05)
+        self.assertEqual(memories[0]['conversation_id'], 'c4')
+        self.assertEqual(self.memory.fetches, [0, 3])
+        stats = self.memory.stats()
+        self.assertEqual((stats['full_loads'], stats['cached_items'], stats['searches']), (1, 4, 2))
+
+    def test_backfilled_rows_without_vector(self):
+        self.memory.rows.append({'id': 99, 'username': 'alice', 'conversation_id': 'old', 'seq': 4,
+                                 'content': turn_snippet('Docker 镜像太大怎么办', '使用多阶段构建'), 'vector': None})
+        memories = self.memory.search('alice', 'Docker 镜像 多阶段构建', min_score=0.05)
+        self.assertEqual((memories[0]['conversation_id'], memories[0]['seq']), ('old', 4))
+
+    def test_forget_conversation(self):
+        self.assertTrue(self.memory.search('alice', 'MySQL 索引失效', min_score=0.05))
+        self.memory.forget_conversation('alice', 'c3')
+        memories = self.memory.search('alice', 'MySQL 索引失效', min_score=0.05)
+        self.assertNotIn('c3', [m['conversation_id'] for m in memories])
+        self.assertEqual(self.memory.stats()['full_loads'], 2)
+
+    def test_branch_does_not_recall_inherited_turns(self):
+        # c2 第 2 轮之后分出 b1：c2 的前两轮已经在 b1 的历史中，第 4 轮（分叉点之后）不在
+        self.memory.add_turn('alice', 'c2', 2, '西湖附近住宿推荐', '可以住在湖滨或北山街附近')
+        self.memory.add_turn('alice', 'c2', 4, '西湖游船怎么买票', '可以在湖滨码头购买游船票')
+        chain = [{'conversation_id': 'b1', 'parent_conversation_id': 'c2', 'fork_seq': 4},
+                 {'conversation_id': 'c2', 'parent_conversation_id': None, 'fork_seq': None}]
+        ranges = branch_ranges(chain)
+
+        memories = self.memory.search('alice', '西湖旅游 住宿 游船', top_k=5, min_score=0.01, exclude_ranges=ranges)
+        self.assertEqual([(m['conversation_id'], m['seq']) for m in memories if m['conversation_id'] == 'c2'],
+                         [('c2', 4)])
+
+    def test_forget_hands_over_turns_copied_to_branches(self):
+        self.memory.add_turn('alice', 'c3', 2, 'MySQL 联合索引最左前缀', '查询条件要从联合索引的最左列开始')
+        self.memory.add_turn('alice', 'c3', 4, 'MySQL 慢查询日志怎么开', '设置 slow_query_log 参数')
+        # 删除 c3：子分支 b3 复制了 c3 的 [0, 4)
+        self.memory.forget_conversation('alice', 'c3', handover=[('b3', 0, 4)])
+        self.assertEqual(sorted((r['conversation_id'], r['seq']) for r in self.memory.rows
+                                if r['conversation_id'] in ('b3', 'c3')), [('b3', 0), ('b3', 2)])
+
+    def test_max_items_keeps_latest(self):
+        memory = InMemoryConversationMemory(max_items=2)
+        for i, topic in enumerate(['快速排序', '西湖旅游', '索引失效']):
+            memory.add_turn('alice', f'c{i}', 0, topic, topic)
+        memory.search('alice', '快速排序')
+        memory.add_turn('alice', 'c3', 0, '布隆过滤器', '布隆过滤器')
+        memory.search('alice', '快速排序')
+        self.assertEqual(memory.stats()['cached_items'], 2)
+        self.assertEqual(memory._users['alice'].conversation_ids, ['c2', 'c3'])
+
+    def test_errors_do_not_break_chat(self):
+        def broken(*args):
+            raise ConnectionError('db down')
+
+        memory = InMemoryConversationMemory()
+        memory._fetch_rows = broken
+        memory._insert_row = broken
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(memory.search('alice', '西湖旅游攻略'), [])
+            memory.add_turn('alice', 'c1', 0, 'q', 'a')
+        self.assertEqual(memory.stats()['errors'], 2)
+
+    def test_format_memories(self):
+        self.assertIsNone(format_memories([]))
+        text = format_memories([{'content': '用户: a\n助手: b'}])
+        self.assertTrue(text.startswith(MEMORY_HEADER))
+        self.assertIn('助手: b', text)
+
+
+class TestMemoryBackfill(unittest.TestCase):
+
+    def test_turns(self):
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'migrations', '0006_conversation_memory.py')
+        spec = importlib.util.spec_from_file_location('memory_migration', path)
+        migration = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(migration)
+
+        def row(seq, role, content, **extra):
+            return {'seq': seq, 'role': role, 'message': json.dumps(dict(role=role, content=content, **extra))}
+
+        rows = [
+            row(0, 'user', '查天气'),
+            row(1, 'assistant', '', tool_calls=[{'id': 'x'}]),
+            row(2, 'tool', '{"success": true}'),
+            row(3, 'assistant', '今天晴'),
+            row(4, 'user', '没有回答的问题'),
+            {'seq': 5, 'role': 'user', 'message': 'not json'},
+        ]
+        self.assertEqual(migration._turns(rows), [[0, '查天气', '今天晴']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import contextlib
+import io
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import patch
+
+import conversation_writer
+from conversation_writer import ConversationWriter, SequenceGapError, merge_pending
+
+
+class FakeStore:
+    """模拟 save_conversation_to_db 按 base_seq 写入的语义"""
+
+    def __init__(self):
+        self.rows = {}
+        self.calls = 0
+        self.fail = 0
+
+    def save(self, conversation_id, username, messages, base_seq):
+        self.calls += 1
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError('db down')
+        stored = self.rows.setdefault((username, conversation_id), [])
+        skip = 0
+        if base_seq is not None:
+            if len(stored) < base_seq:
+                raise SequenceGapError(len(stored), base_seq)
+            overlap = min(len(stored) - base_seq, len(messages))
+            skip = overlap if stored[base_seq:base_seq + overlap] == messages[:overlap] else 0
+        stored.extend(messages[skip:])
+
+
+def msg(text):
+    return {'role': 'user', 'content': text}
+
+
+class TestConversationWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = FakeStore()
+        self.writer = self.make_writer()
+
+    def tearDown(self):
+        self.writer.stop()
+        shutil.rmtree(self.directory)
+
+    def make_writer(self, **kwargs):
+        # 间隔设得很长，由测试手动 flush
+        writer = ConversationWriter(directory=self.directory, interval=60, fsync=False, **kwargs)
+        writer.configure(self.store.save)
+        return writer
+
+    def test_pending_messages_are_readable_before_flush(self):
+        self.writer.append('c1', 'alice', 0, [msg('a'), msg('b')])
+        self.writer.append('c1', 'alice', 2, [msg('c')])
+        self.assertEqual(self.store.rows, {})
+
+        pending = self.writer.pending('c1', 'alice')
+        self.assertEqual([seq for seq, _ in pending], [0, 1, 2])
+        self.assertEqual(self.writer.pending('c1', 'bob'), [])
+        self.assertEqual([m['content'] for m in merge_pending([msg('a')], pending)], ['a', 'b', 'c'])
+
+        # 同一对话的条目合并成一次写入，写入后 WAL 清空
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(self.store.calls, 1)
+        self.assertEqual([m['content'] for m in self.store.rows[('alice', 'c1')]], ['a', 'b', 'c'])
+        self.assertEqual(self.writer.pending('c1', 'alice'), [])
+        self.assertEqual(os.path.getsize(self.writer.wal_path), 0)
+
+    def test_failed_flush_keeps_entries_in_wal(self):
+        self.writer.append('c1', 'alice', 0, [msg('a')])
+        self.store.fail = 1
+        self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(len(self.writer.pending('c1', 'alice')), 1)
+        with open(self.writer.wal_path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(len(self.store.rows[('alice', 'c1')]), 1)
+        self.assertEqual(self.writer.stats()['failures'], 1)
+
+    def test_replays_wal_of_dead_process_without_duplicates(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        # 第一条在崩溃前已经写入数据库，但还没从 WAL 中移除；最后一行没写完
+        self.store.rows[('alice', 'c1')] = [msg('a')]
+        lines = [
+            json.dumps({'id': 1, 'conversation_id': 'c1', 'username': 'alice', 'base_seq': 0, 'messages': [msg('a')]}),
+            json.dumps({'id': 2, 'conversation_id': 'c1', 'username': 'alice', 'base_seq': 1, 'messages': [msg('b')]}),
+            '{"id": 3, "conversation_id": "c1", "user',
+        ]
+        with open(os.path.join(self.directory, f'{process.pid}.wal'), 'w') as f:
+            f.write('\n'.join(lines))
+
+        self.writer.start()
+        self.assertEqual(self.writer.stats()['replayed'], 2)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f'{process.pid}.wal')))
+        self.writer.flush()
+        self.assertEqual([m['content'] for m in self.store.rows[('alice', 'c1')]], ['a', 'b'])
+
+    def test_append_not_blocked_while_wal_is_compacted(self):
+        writer = ConversationWriter(directory=self.directory, interval=60, fsync=True)
+        writer.configure(self.store.save)
+        self.addCleanup(writer.stop)
+        writer.append('c1', 'alice', 0, [msg('a')])
+        writer.append('c2', 'alice', 0, [msg('b')])
+        compacting, release = threading.Event(), threading.Event()
+        real_fsync = os.fsync
+
+        def slow_fsync(fd):
+            if threading.current_thread().name == 'flush':
+                compacting.set()
+                release.wait(2)
+            real_fsync(fd)
+
+        self.store.fail = 1
+        with patch.object(conversation_writer.os, 'fsync', slow_fsync), \
+                contextlib.redirect_stdout(io.StringIO()):
+            flusher = threading.Thread(target=writer.flush, name='flush')
+            flusher.start()
+            self.assertTrue(compacting.wait(2))
+            # 整理 WAL 时追加不需要等待
+            start = time.monotonic()
+            writer.append('c3', 'alice', 0, [msg('c')])
+            self.assertLess(time.monotonic() - start, 0.5)
+            release.set()
+            flusher.join()
+
+        # 写入失败的 c1 和整理期间追加的 c3 都还在 WAL 中
+        with open(writer.wal_path) as f:
+            self.assertEqual([json.loads(line)['conversation_id'] for line in f], ['c1', 'c3'])
+
+    def test_failed_flush_does_not_rewrite_wal(self):
+        self.writer.append('c1', 'alice', 0, [msg('a')])
+        self.store.fail = 1
+        with patch.object(conversation_writer.os, 'replace') as replace, \
+                contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(self.writer.flush(), 0)
+        replace.assert_not_called()
+
+    def test_stop_flushes_remaining_entries(self):
+        self.writer.append('c1', 'alice', 0, [msg('a')])
+        self.writer.stop()
+        self.assertEqual(len(self.store.rows[('alice', 'c1')]), 1)
+
+    def test_discard(self):
+        self.writer.append('c1', 'alice', 0, [msg('a')])
+        self.writer.append('c2', 'alice', 0, [msg('b')])
+        self.assertEqual(self.writer.discard('c1', 'alice'), 1)
+        self.writer.flush()
+        self.assertEqual(list(self.store.rows), [('alice', 'c2')])
+
+    def contents(self, conversation_id='c1'):
+        return [m['content'] for m in self.store.rows[('alice', conversation_id)]]
+
+    def test_waits_for_earlier_turn_written_elsewhere(self):
+        # 两个进程各自延迟写入同一对话：后一轮先到，要等前一轮写入后才能写
+        other_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_dir)
+        other = ConversationWriter(directory=other_dir, interval=60, fsync=False)
+        other.configure(self.store.save)
+        self.addCleanup(other.stop)
+
+        other.append('c1', 'alice', 0, [msg('q1'), msg('a1')])
+        self.writer.append('c1', 'alice', 2, [msg('q2'), msg('a2')])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(self.writer.flush(), 0)
+        self.assertEqual(self.writer.stats()['gap_waits'], 1)
+
+        other.flush()
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(self.contents(), ['q1', 'a1', 'q2', 'a2'])
+
+    def test_gap_timeout_appends_at_end(self):
+        self.writer.append('c1', 'alice', 2, [msg('q2')])
+        with patch.object(conversation_writer, 'CONVERSATION_GAP_TIMEOUT', 0), \
+                contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(self.contents(), ['q2'])
+        self.assertEqual(self.writer.stats()['resequenced'], 1)
+
+    def test_conflicting_seq_is_appended_not_skipped(self):
+        # 另一个请求已经占用了 seq 0，本轮消息不能被当作重复跳过
+        self.store.rows[('alice', 'c1')] = [msg('other')]
+        self.writer.append('c1', 'alice', 0, [msg('mine')])
+        self.writer.append('c1', 'alice', 5, [msg('later')])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.writer.flush()
+        self.assertEqual(self.contents(), ['other', 'mine'])
+        # base_seq 不相接的条目不合并
+        self.assertEqual(self.store.calls, 2)
+
+    def write_peer_wal(self, *entries):
+        # 父进程一定存活，用它的 PID 模拟同一 WAL 目录下的另一个工作进程
+        path = os.path.join(self.directory, f'{os.getppid()}.wal')
+        with open(path, 'w') as f:
+            f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+            f.write('{"id": 9, "conversation_id": "c1", "user')
+        return path
+
+    def test_reads_pending_entries_of_other_workers(self):
+        # 上一轮由另一个工作进程生成，还在它的 WAL 里
+        self.writer.append('c1', 'alice', 2, [msg('q2')])
+        self.write_peer_wal(
+            {'id': 1, 'conversation_id': 'c1', 'username': 'alice', 'base_seq': 0, 'messages': [msg('q1'), msg('a1')]},
+            {'id': 2, 'conversation_id': 'c2', 'username': 'alice', 'base_seq': 0, 'messages': [msg('x')]},
+            {'id': 3, 'conversation_id': 'c1', 'username': 'bob', 'base_seq': 0, 'messages': [msg('y')]},
+        )
+        pending = self.writer.pending('c1', 'alice')
+        self.assertEqual(sorted(seq for seq, _ in pending), [0, 1, 2])
+        self.assertEqual([m['content'] for m in merge_pending([], pending)], ['q1', 'a1', 'q2'])
+        # 另一个进程已经写入数据库、还没来得及从 WAL 移除：不重复
+        self.assertEqual([m['content'] for m in merge_pending([msg('q1'), msg('a1')], pending)], ['q1', 'a1', 'q2'])
+        self.assertTrue(self.writer.enabled)
+        self.assertEqual(self.writer.stats()['peer_reads'], 1)
+
+    def test_wait_flushed_waits_for_other_workers(self):
+        self.writer.append('c1', 'alice', 2, [msg('q2')])
+        peer_wal = self.write_peer_wal(
+            {'id': 1, 'conversation_id': 'c1', 'username': 'alice', 'base_seq': 0, 'messages': [msg('q1'), msg('a1')]}
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(self.writer.wait_flushed('c1', 'alice', timeout=0.05))
+
+        # 另一个进程写入数据库后清空了它的 WAL
+        self.store.rows[('alice', 'c1')] = [msg('q1'), msg('a1')]
+        open(peer_wal, 'w').close()
+        self.assertTrue(self.writer.wait_flushed('c1', 'alice', timeout=1))
+        self.assertEqual(self.contents(), ['q1', 'a1', 'q2'])
+
+    def test_disabled_writes_synchronously(self):
+        writer = self.make_writer(enabled=False)
+        writer.append('c1', 'alice', 0, [msg('a')])
+        self.assertEqual(len(self.store.rows[('alice', 'c1')]), 1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
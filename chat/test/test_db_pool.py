@@ -0,0 +1,161 @@
+import unittest
+import sys
+import os
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import MagicMock, patch
+from flask import Flask, Response, stream_with_context
+
+import db
+from db import ConnectionPool, PoolTimeoutError
+
+
+def make_pool(**kwargs):
+    connect = MagicMock(side_effect=lambda **cfg: MagicMock())
+    options = {'max_size': 2, 'timeout': 0.2, 'idle_timeout': 0, 'recycle': 0, 'ping_interval': 0}
+    options.update(kwargs)
+    return ConnectionPool({}, connect=connect, **options), connect
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_reuses_released_connection(self):
+        pool, connect = make_pool()
+        conn = pool.acquire()
+        raw = conn._raw
+        conn.close()
+        again = pool.acquire()
+        self.assertIs(again._raw, raw)
+        self.assertEqual(connect.call_count, 1)
+        raw.rollback.assert_called_once()
+
+    def test_close_is_idempotent(self):
+        pool, _ = make_pool()
+        conn = pool.acquire()
+        conn.close()
+        conn.close()
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_bounded_size_times_out(self):
+        pool, _ = make_pool(max_size=1)
+        pool.acquire()
+        with self.assertRaises(PoolTimeoutError):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+    def test_waiter_gets_released_connection(self):
+        pool, connect = make_pool(max_size=1, timeout=2)
+        conn = pool.acquire()
+        result = {}
+
+        def worker():
+            result['conn'] = pool.acquire()
+
+        t = threading.Thread(target=worker)
+        t.start()
+        conn.close()
+        t.join(timeout=2)
+        self.assertIs(result['conn']._raw, conn._raw)
+        self.assertEqual(connect.call_count, 1)
+
+    def test_failed_health_check_replaces_connection(self):
+        pool, connect = make_pool(ping_interval=0.0001)
+        conn = pool.acquire()
+        conn._raw.ping.side_effect = Exception("gone away")
+        conn.close()
+        conn._last_used -= 1
+        fresh = pool.acquire()
+        self.assertIsNot(fresh._raw, conn._raw)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(pool.stats()['health_check_failures'], 1)
+
+    def test_idle_connections_are_recycled(self):
+        pool, connect = make_pool(idle_timeout=10)
+        conn = pool.acquire()
+        conn.close()
+        conn._last_used -= 60
+        pool.acquire()
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(pool.stats()['recycled'], 1)
+
+    def test_stats(self):
+        pool, _ = make_pool()
+        a = pool.acquire()
+        pool.acquire()
+        a.close()
+        stats = pool.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertIn('wait_time_avg_ms', stats)
+
+
+class TestRequestScope(unittest.TestCase):
+
+    def setUp(self):
+        self.pool, self.connect = make_pool(max_size=4)
+        patcher = patch('db.get_pool', return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = Flask(__name__)
+        db.init_app(self.app)
+
+    def test_helpers_share_one_connection_per_request(self):
+        seen = []
+
+        @self.app.route('/')
+        def view():
+            for _ in range(3):
+                with db.get_db_connection() as conn:
+                    seen.append(conn)
+            self.assertEqual(self.pool.stats()['in_use'], 1)
+            return 'ok'
+
+        self.app.test_client().get('/')
+        self.assertEqual(len({id(c) for c in seen}), 1)
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_nested_block_does_not_end_outer_transaction(self):
+        with self.app.test_request_context('/'):
+            with db.get_db_connection() as outer:
+                with db.get_db_connection() as inner:
+                    self.assertIs(inner, outer)
+                outer._raw.rollback.assert_not_called()
+            outer._raw.rollback.assert_called_once()
+
+    def test_streaming_response_keeps_connection_until_done(self):
+        @self.app.route('/stream')
+        def stream():
+            def generate():
+                with db.get_db_connection():
+                    yield 'a'
+                self.assertEqual(self.pool.stats()['in_use'], 1)
+                yield 'b'
+            return Response(stream_with_context(generate()))
+
+        response = self.app.test_client().get('/stream')
+        self.assertEqual(response.get_data(as_text=True), 'ab')
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_release_request_connection(self):
+        with self.app.test_request_context('/'):
+            with db.get_db_connection():
+                pass
+            db.release_request_connection()
+            self.assertEqual(self.pool.stats()['in_use'], 0)
+            with db.get_db_connection():
+                self.assertEqual(self.pool.stats()['in_use'], 1)
+
+    def test_outside_request_uses_pool_directly(self):
+        with db.get_db_connection():
+            self.assertEqual(self.pool.stats()['in_use'], 1)
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
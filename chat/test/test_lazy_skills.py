@@ -0,0 +1,83 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from skills import register_all_skills, read_skill_md_metadata
+from skills.base import LazySkill
+
+
+def quiet_register(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return register_all_skills(**kwargs)
+
+
+class TestLazySkills(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.manifest_path = os.path.join(self.tmp_dir, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_manifest_matches_eager_registry(self):
+        eager = quiet_register(lazy=False)
+        quiet_register(manifest_path=self.manifest_path)
+        registry = quiet_register(manifest_path=self.manifest_path)
+
+        self.assertEqual(sorted(registry.list_skills()), sorted(eager.list_skills()))
+        for name in registry.list_skills():
+            skill = registry.get_skill(name)
+            self.assertIsInstance(skill, LazySkill)
+            self.assertFalse(skill.loaded)
+            self.assertEqual(skill.to_function_definition(), eager.get_skill(name).to_function_definition())
+            self.assertEqual(skill.timeout, eager.get_skill(name).timeout)
+            self.assertEqual(skill.keywords, eager.get_skill(name).keywords)
+        self.assertEqual(registry.stats()['loaded'], 0)
+
+    def test_skill_imported_on_first_execution(self):
+        quiet_register(manifest_path=self.manifest_path)
+        registry = quiet_register(manifest_path=self.manifest_path)
+
+        skill = registry.get_skill('get_current_date')
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = registry.execute_skill('get_current_date', format='date')
+        self.assertTrue(result['success'])
+        self.assertTrue(skill.loaded)
+        self.assertEqual(registry.stats()['loaded'], 1)
+        self.assertIn('get_current_date', registry.stats()['load_seconds'])
+
+    def test_stale_entry_is_reimported(self):
+        quiet_register(manifest_path=self.manifest_path)
+        with open(self.manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest['skills']['get_current_date']['fingerprint'] = []
+        manifest['skills']['get_current_date']['metadata']['description'] = 'stale'
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        registry = quiet_register(manifest_path=self.manifest_path)
+        skill = registry.get_skill('get_current_date')
+        self.assertTrue(skill.loaded)
+        self.assertNotEqual(skill.description, 'stale')
+        with open(self.manifest_path, encoding='utf-8') as f:
+            self.assertNotEqual(json.load(f)['skills']['get_current_date']['metadata']['description'], 'stale')
+
+    def test_skill_md_front_matter(self):
+        metadata = read_skill_md_metadata('---\nname: demo\ndescription: "演示技能"\nmetadata:\n    author: x\n---\n# 标题\n')
+        self.assertEqual(metadata, {'name': 'demo', 'description': '演示技能'})
+        self.assertEqual(read_skill_md_metadata('# 标题\n\n正文'), {})
+        self.assertEqual(read_skill_md_metadata('---\nname: demo\n'), {})
+
+        registry = quiet_register(manifest_path=self.manifest_path)
+        self.assertTrue(registry.get_skill('frontend-design').description.startswith('Create distinctive'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from types import SimpleNamespace as NS
+
+import httpx
+
+from llm_clients import LLMClientRegistry, StreamedCompletion, _HostPool
+
+
+def chunk(content=None, tool_calls=None, finish_reason=None):
+    return NS(choices=[NS(delta=NS(content=content, tool_calls=tool_calls), finish_reason=finish_reason)])
+
+
+def tool_delta(index, id=None, name=None, arguments=None):
+    return NS(index=index, id=id, function=NS(name=name, arguments=arguments))
+
+
+class TestLLMClientRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = LLMClientRegistry()
+        self.addCleanup(self.registry.close_all)
+
+    def test_client_is_cached_per_base_url_and_key(self):
+        a = self.registry.get_client('https://api.deepseek.com/v1', 'k1')
+        self.assertIs(self.registry.get_client('https://api.deepseek.com/v1/', 'k1'), a)
+        self.assertIsNot(self.registry.get_client('https://api.deepseek.com/v1', 'k2'), a)
+        self.assertEqual(self.registry.stats()['clients'], 2)
+
+    def test_same_host_shares_connection_pool(self):
+        a = self.registry.get_client('https://api.deepseek.com', 'k')
+        b = self.registry.get_client('https://api.deepseek.com/v1', 'k')
+        c = self.registry.get_client('https://api.openai.com/v1', 'k')
+        self.assertIs(a._client, b._client)
+        self.assertIsNot(a._client, c._client)
+        self.assertEqual(len(self.registry.stats()['hosts']), 2)
+
+    def test_with_options_keeps_shared_pool(self):
+        client = self.registry.get_client('https://api.deepseek.com', 'k')
+        self.assertIs(client.with_options(timeout=120.0)._client, client._client)
+
+    def test_in_flight_tracks_streamed_responses(self):
+        host = _HostPool('http://test')
+        self.addCleanup(host.close)
+        host._transport = httpx.MockTransport(lambda request: httpx.Response(200, content=iter([b'data'])))
+        host._transport._pool = None
+
+        with host.http_client.stream('GET', 'http://test/x') as response:
+            self.assertEqual(host.stats()['in_flight'], 1)
+            response.read()
+        stats = host.stats()
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['requests'], 1)
+
+
+class TestStreamedCompletion(unittest.TestCase):
+
+    def test_forwards_content_as_it_arrives(self):
+        completion = StreamedCompletion(iter([chunk('你'), chunk('好'), chunk(finish_reason='stop')]))
+        self.assertEqual(list(completion), ['你', '好'])
+        self.assertEqual(completion.content, '你好')
+        self.assertEqual(completion.tool_calls, [])
+        self.assertEqual(completion.finish_reason, 'stop')
+
+    def test_assembles_tool_call_deltas(self):
+        completion = StreamedCompletion(iter([
+            chunk('查一下'),
+            chunk(tool_calls=[tool_delta(0, id='call_a', name='get_weather', arguments='')]),
+            chunk(tool_calls=[tool_delta(1, id='call_b', name='get_current_date', arguments='{}')]),
+            chunk(tool_calls=[tool_delta(0, arguments='{"city": ')]),
+            chunk(tool_calls=[tool_delta(0, arguments='"北京"}')]),
+            NS(choices=[]),
+            chunk(finish_reason='tool_calls'),
+        ]))
+        self.assertEqual(list(completion), ['查一下'])
+        self.assertEqual(completion.tool_calls, [
+            {'id': 'call_a', 'type': 'function', 'function': {'name': 'get_weather', 'arguments': '{"city": "北京"}'}},
+            {'id': 'call_b', 'type': 'function', 'function': {'name': 'get_current_date', 'arguments': '{}'}},
+        ])
+
+    def test_records_usage_from_final_chunk(self):
+        usage = NS(prompt_tokens=120, completion_tokens=8, prompt_cache_hit_tokens=96)
+        completion = StreamedCompletion(iter([chunk('好'), chunk(finish_reason='stop'), NS(choices=[], usage=usage)]))
+        self.assertEqual(list(completion), ['好'])
+        self.assertIs(completion.usage, usage)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import unittest
+import sys
+import os
+import time
+import threading
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+
+import llm_gateway
+from llm_gateway import (LLMGateway, CircuitBreaker, ConcurrencyLimiter, CircuitOpenError,
+                         GatewayBusyError)
+
+BASE_URL = 'https://api.example.com/v1'
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request('POST', BASE_URL))
+
+
+def bad_request():
+    response = httpx.Response(400, request=httpx.Request('POST', BASE_URL))
+    return openai.BadRequestError('bad', response=response, body=None)
+
+
+class GatewayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        for target, value in (('llm_gateway.get_openai_client', MagicMock()),
+                              ('llm_gateway.backoff_delay', MagicMock(return_value=0))):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.gateway = LLMGateway(max_retries=2, queue_timeout=0.2, hedge=True)
+
+    def provider(self):
+        return self.gateway._provider(BASE_URL)
+
+
+class TestLLMGateway(GatewayTestCase):
+
+    def test_retries_transient_errors(self):
+        fn = MagicMock(side_effect=[connection_error(), connection_error(), 'ok'])
+        self.assertEqual(self.gateway.call('m', fn, base_url=BASE_URL), 'ok')
+        self.assertEqual(fn.call_count, 3)
+        stats = self.gateway.stats()['models']['api.example.com/m']
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(self.provider().limiter.in_use, 0)
+
+    def test_does_not_retry_client_errors(self):
+        fn = MagicMock(side_effect=bad_request())
+        with self.assertRaises(openai.BadRequestError):
+            self.gateway.call('m', fn, base_url=BASE_URL)
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(self.provider().breaker.state, 'closed')
+
+    def test_circuit_opens_and_fails_fast(self):
+        self.gateway.max_retries = 0
+        fn = MagicMock(side_effect=connection_error())
+        for _ in range(llm_gateway.LLM_GATEWAY_BREAKER_THRESHOLD):
+            with self.assertRaises(openai.APIConnectionError):
+                self.gateway.call('m', fn, base_url=BASE_URL)
+        calls = fn.call_count
+        with self.assertRaises(CircuitOpenError):
+            self.gateway.call('m', fn, base_url=BASE_URL)
+        self.assertEqual(fn.call_count, calls)
+
+    def test_hedged_request_wins_over_slow_primary(self):
+        metrics = self.gateway._call_metrics('api.example.com/m')
+        metrics.hedge_delay = MagicMock(return_value=0.05)
+        calls = []
+
+        def fn(client):
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return 'slow'
+            return 'fast'
+
+        start = time.monotonic()
+        self.assertEqual(self.gateway.call('m', fn, base_url=BASE_URL, hedge=True), 'fast')
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual((metrics.hedged, metrics.hedge_wins), (1, 1))
+
+    def test_chat_completion_does_not_hedge_by_default(self):
+        metrics = self.gateway._call_metrics('api.example.com/m')
+        metrics.hedge_delay = MagicMock(return_value=0.01)
+        client = llm_gateway.get_openai_client.return_value
+        client.chat.completions.create.side_effect = lambda **kwargs: time.sleep(0.1) or 'done'
+
+        self.assertEqual(self.gateway.chat_completion('m', [], base_url=BASE_URL, max_tokens=4000), 'done')
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+        self.assertEqual(metrics.hedged, 0)
+
+    def test_stream_holds_slot_until_consumed(self):
+        client = llm_gateway.get_openai_client.return_value
+        client.chat.completions.create.return_value = iter(['a', 'b'])
+        stream = self.gateway.stream_chat_completion('m', [], base_url=BASE_URL)
+        self.assertEqual(self.provider().limiter.in_use, 1)
+        self.assertEqual(list(stream), ['a', 'b'])
+        self.assertEqual(self.provider().limiter.in_use, 0)
+        self.assertIn('ttft_p50_ms', self.gateway.stats()['models']['api.example.com/m'])
+
+    def test_stream_records_cached_prompt_tokens(self):
+        client = llm_gateway.get_openai_client.return_value
+        usage = SimpleNamespace(prompt_tokens=200, completion_tokens=10, prompt_cache_hit_tokens=150)
+        client.chat.completions.create.return_value = iter([SimpleNamespace(usage=None),
+                                                            SimpleNamespace(usage=usage)])
+        list(self.gateway.stream_chat_completion('m', [], base_url=BASE_URL))
+        stats = self.gateway.stats()['models']['api.example.com/m']
+        self.assertEqual((stats['prompt_tokens'], stats['cached_tokens']), (200, 150))
+        self.assertEqual(stats['cache_hit_ratio'], 0.75)
+
+    def half_open_provider(self):
+        provider = self.provider()
+        provider.breaker = CircuitBreaker(threshold=1, cooldown=0)
+        provider.breaker.record_failure()
+        return provider
+
+    def test_trial_released_when_admission_times_out(self):
+        provider = self.half_open_provider()
+        provider.limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1)
+        provider.limiter.acquire(0.1)
+        with self.assertRaises(GatewayBusyError):
+            self.gateway.call('m', MagicMock(return_value='ok'), base_url=BASE_URL)
+
+        provider.limiter.release()
+        self.assertEqual(self.gateway.call('m', MagicMock(return_value='ok'), base_url=BASE_URL), 'ok')
+        self.assertEqual(provider.breaker.state, 'closed')
+
+    def test_trial_released_when_stream_closed_early(self):
+        provider = self.half_open_provider()
+        client = llm_gateway.get_openai_client.return_value
+
+        # 客户端断开：生成器在读到一半时被关闭
+        client.chat.completions.create.return_value = iter(['a', 'b'])
+        chunks = iter(self.gateway.stream_chat_completion('m', [], base_url=BASE_URL))
+        self.assertEqual(next(chunks), 'a')
+        chunks.close()
+        self.assertEqual((provider.limiter.in_use, provider.breaker.state), (0, 'half_open'))
+
+        # 没有开始读就关闭
+        self.gateway.stream_chat_completion('m', [], base_url=BASE_URL).close()
+
+        client.chat.completions.create.return_value = iter(['c'])
+        self.assertEqual(list(self.gateway.stream_chat_completion('m', [], base_url=BASE_URL)), ['c'])
+        self.assertEqual(provider.breaker.state, 'closed')
+
+
+class TestPrimitives(unittest.TestCase):
+
+    def test_cached_prompt_tokens(self):
+        self.assertEqual(llm_gateway.cached_prompt_tokens(None), 0)
+        self.assertEqual(llm_gateway.cached_prompt_tokens(SimpleNamespace(prompt_cache_hit_tokens=64)), 64)
+        openai_usage = SimpleNamespace(prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+        self.assertEqual(llm_gateway.cached_prompt_tokens(openai_usage), 1024)
+        self.assertEqual(llm_gateway.cached_prompt_tokens(SimpleNamespace(prompt_tokens=10)), 0)
+
+    def test_limiter_queue_timeout(self):
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1)
+        limiter.acquire(0.1)
+        with self.assertRaises(GatewayBusyError):
+            limiter.acquire(0.05)
+
+        threading.Timer(0.05, limiter.release).start()
+        limiter.acquire(1)
+        self.assertEqual(limiter.stats()['in_use'], 1)
+
+    def test_limiter_rejects_when_queue_full(self):
+        limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=0)
+        limiter.acquire(0.1)
+        with self.assertRaises(GatewayBusyError):
+            limiter.acquire(1)
+
+    def test_breaker_half_open_allows_single_trial(self):
+        breaker = CircuitBreaker(threshold=1, cooldown=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()
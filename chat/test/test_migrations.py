@@ -0,0 +1,113 @@
+import unittest
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contextlib import contextmanager
+from unittest.mock import MagicMock, patch
+
+import migrations
+
+
+def write_migration(directory, filename, body="    cursor.execute('SELECT 1')\n"):
+    with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+        f.write("def upgrade(cursor):\n" + body)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = self.tmp.name
+        write_migration(self.dir, '0002_second.py')
+        write_migration(self.dir, '0001_first.py')
+        write_migration(self.dir, 'README.py')
+
+        self.cursor = MagicMock()
+        self.conn = MagicMock()
+        self.conn.cursor.return_value.__enter__.return_value = self.cursor
+
+        @contextmanager
+        def fake_connection():
+            yield self.conn
+
+        patcher = patch('migrations.get_db_connection', fake_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        migrations._schema_checked = False
+        self.addCleanup(setattr, migrations, '_schema_checked', False)
+
+    def test_discover_orders_by_version(self):
+        found = migrations.discover_migrations(self.dir)
+        self.assertEqual([m.version for m in found], [1, 2])
+        self.assertEqual(found[0].name, 'first')
+        self.assertEqual(migrations.latest_version(self.dir), 2)
+
+    def test_duplicate_versions_rejected(self):
+        write_migration(self.dir, '0002_again.py')
+        with self.assertRaises(ValueError):
+            migrations.discover_migrations(self.dir)
+
+    def test_run_applies_only_pending(self):
+        self.cursor.fetchone.return_value = {'locked': 1}
+        self.cursor.fetchall.return_value = [{'version': 1}]
+        applied = migrations.run_migrations(self.dir)
+        self.assertEqual(applied, [2])
+        inserts = [c for c in self.cursor.execute.call_args_list
+                   if 'INSERT INTO schema_version' in c.args[0]]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(inserts[0].args[1], (2, 'second'))
+        self.assertIn('RELEASE_LOCK', self.cursor.execute.call_args_list[-1].args[0])
+
+    def test_run_fails_without_lock(self):
+        self.cursor.fetchone.return_value = {'locked': 0}
+        with self.assertRaises(RuntimeError):
+            migrations.run_migrations(self.dir)
+
+    def test_ensure_schema_checks_once_and_skips_when_current(self):
+        with patch('migrations.get_schema_version', return_value=2) as version, \
+                patch('migrations.run_migrations') as run:
+            self.assertIsNone(migrations.ensure_schema(self.dir))
+            migrations.ensure_schema(self.dir)
+        version.assert_called_once()
+        run.assert_not_called()
+
+    def test_ensure_schema_runs_when_behind(self):
+        with patch('migrations.get_schema_version', return_value=1), \
+                patch('migrations.run_migrations', return_value=[2]) as run:
+            self.assertEqual(migrations.ensure_schema(self.dir), [2])
+        run.assert_called_once_with(self.dir)
+
+    def test_add_missing_columns_skips_existing(self):
+        # 上次迁移在加列之后失败：列和索引已经存在
+        self.cursor.fetchall.side_effect = [
+            [{'COLUMN_NAME': 'id'}, {'COLUMN_NAME': 'summary'}],
+            [{'INDEX_NAME': 'PRIMARY'}, {'INDEX_NAME': 'idx_user_parent'}],
+        ]
+        added = migrations.add_missing_columns(
+            self.cursor, 'conversations',
+            [('summary', 'TEXT NULL'), ('summary_upto', 'INT NOT NULL DEFAULT 0')],
+            indexes=[('idx_user_parent', '(username, parent_conversation_id)')]
+        )
+        self.assertEqual(added, ['summary_upto'])
+        self.assertEqual(self.cursor.execute.call_args_list[-1].args[0],
+                         "ALTER TABLE conversations ADD COLUMN summary_upto INT NOT NULL DEFAULT 0")
+
+        self.cursor.execute.reset_mock()
+        self.cursor.fetchall.side_effect = [
+            [{'COLUMN_NAME': 'summary'}, {'COLUMN_NAME': 'summary_upto'}],
+            [],
+        ]
+        self.assertEqual(migrations.add_missing_columns(
+            self.cursor, 'conversations', [('summary', 'TEXT NULL'), ('summary_upto', 'INT')]), [])
+        self.assertFalse(any('ALTER' in c.args[0] for c in self.cursor.execute.call_args_list))
+
+    def test_bundled_migrations_are_loadable(self):
+        for migration in migrations.discover_migrations():
+            self.assertTrue(callable(migrations._load_upgrade(migration)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+import sys
+import os
+import contextlib
+import io
+import threading
+import time
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+from llm_clients import StreamedCompletion
+from llm_gateway import LLMGateway
+from model_compare import ModelFanOut, usage_to_dict
+
+import app as app_module
+
+
+class FakeCompletion:
+    """按给定间隔逐段产出文本，结束后带 usage，和 StreamedCompletion 一样"""
+
+    def __init__(self, chunks, delay, fail=False, release=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.fail = fail
+        self.release = release
+        self.usage = None
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            yield chunk
+        if self.release is not None:
+            self.release.wait(2)
+        if self.fail:
+            raise ConnectionError('upstream reset')
+        self.usage = SimpleNamespace(prompt_tokens=10, completion_tokens=len(self.chunks), prompt_cache_hit_tokens=8)
+
+
+def run(fan_out):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return list(fan_out)
+
+
+class TestModelFanOut(unittest.TestCase):
+
+    def test_models_stream_concurrently(self):
+        streams = {
+            'fast': FakeCompletion(['a', 'b'], 0.02),
+            'slow': FakeCompletion(['x', 'y', 'z'], 0.1),
+        }
+        fan_out = ModelFanOut(['slow', 'fast'], lambda model: streams[model])
+        events = run(fan_out)
+
+        # 文本事件带模型标记，按到达顺序交错
+        self.assertEqual(''.join(e['content'] for e in events if e.get('model') == 'slow' and 'content' in e), 'xyz')
+        self.assertEqual([e['model'] for e in events if 'finished' in e], ['fast', 'slow'])
+        self.assertLess(events.index({'model': 'fast', 'content': 'b'}), events.index({'model': 'slow', 'content': 'y'}))
+
+        slow, fast = fan_out.results
+        self.assertEqual((slow['model'], slow['content']), ('slow', 'xyz'))
+        self.assertLess(fast['ttft_ms'], slow['ttft_ms'])
+        self.assertLessEqual(slow['ttft_ms'], slow['latency_ms'])
+        self.assertEqual(fast['usage'], {'prompt_tokens': 10, 'cached_tokens': 8, 'completion_tokens': 2})
+        # 总耗时取决于最慢的模型，而不是各模型之和
+        self.assertLess(fan_out.wall_ms, fan_out.sequential_ms)
+        self.assertGreaterEqual(fan_out.wall_ms, slow['latency_ms'])
+
+    def test_failure_and_timeout_only_affect_that_model(self):
+        release = threading.Event()
+        streams = {
+            'ok': FakeCompletion(['a'], 0),
+            'broken': FakeCompletion(['partial'], 0, fail=True),
+            'stuck': FakeCompletion(['x'], 0, release=release),
+        }
+        fan_out = ModelFanOut(['ok', 'broken', 'stuck'], lambda model: streams[model], timeout=0.3)
+        try:
+            events = run(fan_out)
+        finally:
+            release.set()
+
+        ok, broken, stuck = fan_out.results
+        self.assertIsNone(ok['error'])
+        self.assertEqual(ok['content'], 'a')
+        self.assertEqual(broken['error'], 'upstream reset')
+        self.assertEqual(broken['content'], 'partial')
+        self.assertIn('0.3', stuck['error'])
+        self.assertIsNone(stuck['latency_ms'])
+        self.assertEqual(len([e for e in events if 'finished' in e]), 3)
+        self.assertNotIn('content', events[-1]['finished'])
+
+    def test_timeout_closes_stream_and_releases_gateway_slot(self):
+        closed = threading.Event()
+
+        class HangingStream:
+            """输出一段后挂起，直到连接被关闭"""
+
+            def __iter__(self):
+                delta = SimpleNamespace(content='x', tool_calls=None)
+                yield SimpleNamespace(usage=None, choices=[SimpleNamespace(finish_reason=None, delta=delta)])
+                closed.wait(2)
+                raise httpx.ReadError('connection closed')
+
+            def close(self):
+                closed.set()
+
+        client = MagicMock()
+        client.chat.completions.create.return_value = HangingStream()
+        gateway = LLMGateway(max_retries=0, queue_timeout=0.2, hedge=False)
+        base_url = 'https://api.example.com/v1'
+        with patch('llm_gateway.get_openai_client', return_value=client):
+            fan_out = ModelFanOut(['m'], lambda model: StreamedCompletion(
+                gateway.stream_chat_completion(model, [], base_url=base_url)), timeout=0.2)
+            run(fan_out)
+
+        provider = gateway._provider(base_url)
+        self.assertTrue(closed.is_set())
+        self.assertEqual(provider.limiter.in_use, 0)
+        self.assertIn('0.2', fan_out.results[0]['error'])
+        # 主动关闭导致的读取中断不算提供方失败
+        time.sleep(0.05)
+        self.assertEqual(provider.breaker.stats()['consecutive_failures'], 0)
+        self.assertEqual(gateway.stats()['models']['api.example.com/m']['errors'], 0)
+
+    def test_open_stream_error(self):
+        def open_stream(model):
+            raise ValueError('no api key')
+
+        fan_out = ModelFanOut(['a'], open_stream)
+        events = run(fan_out)
+        self.assertEqual(events, [{'model': 'a', 'finished': fan_out.summary(fan_out.results[0])}])
+        self.assertEqual(fan_out.results[0]['error'], 'no api key')
+
+    def test_usage_to_dict(self):
+        self.assertIsNone(usage_to_dict(None))
+        details = SimpleNamespace(cached_tokens=3)
+        usage = SimpleNamespace(prompt_tokens=5, completion_tokens=None, prompt_tokens_details=details)
+        self.assertEqual(usage_to_dict(usage), {'prompt_tokens': 5, 'cached_tokens': 3, 'completion_tokens': 0})
+
+
+class TestCompareRequest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app_module.app.test_client()
+        with self.client.session_transaction() as session:
+            session['username'] = 'tester'
+
+    def test_invalid_model_lists_are_rejected(self):
+        for models, error in [('gpt-4', '列表'), ([], '不能为空'), (['gpt-4', 'unknown'], 'unknown'),
+                              (['deepseek-chat', 'deepseek-coder', 'gpt-3.5-turbo', 'gpt-4', 'gpt-5'], '最多')]:
+            response = self.client.post('/api/chat', json={'message': 'hi', 'models': models})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.get_json()['error'])
+
+    def test_duplicates_are_removed(self):
+        self.assertEqual(app_module.parse_compare_models(['gpt-4', 'deepseek-chat', 'gpt-4']),
+                         (['gpt-4', 'deepseek-chat'], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
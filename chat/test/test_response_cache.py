@@ -0,0 +1,134 @@
+import unittest
+import sys
+import os
+import time
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import MagicMock
+
+from response_cache import ResponseCache, make_cache_key, normalize_input, prompt_version
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def exists(self, key):
+        return key in self.data
+
+    def eval(self, script, numkeys, key, token):
+        # 只模拟 REDIS_UNLOCK_SCRIPT：值匹配才删除
+        if self.data.get(key) != token:
+            return 0
+        del self.data[key]
+        return 1
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_key_normalisation_and_versioning(self):
+        self.assertEqual(normalize_input('  git   rebase '), 'git rebase')
+        self.assertEqual(normalize_input('ｌｓ　-ｌ'), 'ls -l')
+        v1 = prompt_version('prompt', {'temperature': 0.7})
+        self.assertEqual(make_cache_key('linux', 'm', ' ls  -l', v1), make_cache_key('linux', 'm', 'ls -l', v1))
+        # 命令参数区分大小写
+        self.assertNotEqual(make_cache_key('linux', 'm', 'ls -L', v1), make_cache_key('linux', 'm', 'ls -l', v1))
+        self.assertNotEqual(make_cache_key('git', 'm', 'git log -S', v1), make_cache_key('git', 'm', 'git log -s', v1))
+        self.assertNotEqual(v1, prompt_version('prompt v2', {'temperature': 0.7}))
+
+    def test_hit_after_compute(self):
+        cache = ResponseCache(max_entries=10, ttl=60)
+        compute = MagicMock(return_value='content')
+        self.assertEqual(cache.get_or_compute('k', compute), 'content')
+        self.assertEqual(cache.get_or_compute('k', compute), 'content')
+        compute.assert_called_once()
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_empty_results_and_errors_are_not_cached(self):
+        cache = ResponseCache(max_entries=10, ttl=60)
+        cache.get_or_compute('k', lambda: '')
+        with self.assertRaises(ValueError):
+            cache.get_or_compute('k', MagicMock(side_effect=ValueError('upstream')))
+        self.assertEqual(cache.get_or_compute('k', lambda: 'ok'), 'ok')
+
+    def test_lru_and_ttl(self):
+        cache = ResponseCache(max_entries=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+        expired = ResponseCache(max_entries=2, ttl=0)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+    def test_single_flight(self):
+        cache = ResponseCache(max_entries=10, ttl=60)
+        calls = []
+        started = threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return 'shared'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', compute)))
+                   for _ in range(5)]
+        threads[0].start()
+        started.wait(1)
+        for t in threads[1:]:
+            t.start()
+        for t in threads:
+            t.join(2)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['shared'] * 5)
+        self.assertEqual(cache.stats()['coalesced'], 4)
+
+    def test_redis_tier_shared_between_processes(self):
+        redis_client = FakeRedis()
+        worker_a = ResponseCache(redis_client=redis_client)
+        worker_b = ResponseCache(redis_client=redis_client)
+        worker_a.get_or_compute('k', lambda: {'content': 'x'})
+        compute = MagicMock()
+        self.assertEqual(worker_b.get_or_compute('k', compute), {'content': 'x'})
+        compute.assert_not_called()
+        self.assertEqual(worker_b.stats()['redis_hits'], 1)
+
+    def test_redis_lock_released_only_by_owner(self):
+        redis_client = FakeRedis()
+        cache = ResponseCache(redis_client=redis_client)
+        lock_key = 'arc_logi_chat:resp:lock:k'
+
+        def slow_compute():
+            # 生成超过锁的有效期：锁过期后被另一个进程拿到
+            redis_client.data[lock_key] = 'other-worker'
+            return 'x'
+
+        cache.get_or_compute('k', slow_compute)
+        self.assertEqual(redis_client.data[lock_key], 'other-worker')
+
+        cache.get_or_compute('k2', lambda: 'y')
+        self.assertNotIn('arc_logi_chat:resp:lock:k2', redis_client.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
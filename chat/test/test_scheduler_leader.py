@@ -0,0 +1,145 @@
+import unittest
+import sys
+import os
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import patch
+
+from scheduler import LeaderLock, ScheduleScheduler
+
+
+class FakeLockServer:
+    """模拟 MySQL 的会话级命名锁：连接关闭时释放该连接持有的锁"""
+
+    def __init__(self):
+        self.holders = {}
+        self.next_connection_id = 1
+        self.available = True
+
+    def connect(self):
+        if not self.available:
+            raise ConnectionError('MySQL server has gone away')
+        connection = FakeConnection(self, self.next_connection_id)
+        self.next_connection_id += 1
+        return connection
+
+
+class FakeCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, args):
+        server, connection_id, name = self.connection.server, self.connection.id, args[0]
+        if self.connection.closed or not server.available:
+            raise ConnectionError('Lost connection to MySQL server')
+        if sql.startswith('SELECT GET_LOCK'):
+            value = 1 if server.holders.get(name, connection_id) == connection_id else 0
+            if value:
+                server.holders[name] = connection_id
+        elif sql.startswith('SELECT IS_USED_LOCK'):
+            value = 1 if server.holders.get(name) == connection_id else 0
+        elif sql.startswith('SELECT RELEASE_LOCK'):
+            value = 1 if server.holders.pop(name, None) == connection_id else 0
+        self.row = {'value': value}
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+
+    def __init__(self, server, connection_id):
+        self.server = server
+        self.id = connection_id
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+        for name, holder in list(self.server.holders.items()):
+            if holder == self.id:
+                del self.server.holders[name]
+
+
+class TestLeaderLock(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeLockServer()
+        self.workers = [LeaderLock('test', connect=self.server.connect) for _ in range(3)]
+
+    def test_exactly_one_leader(self):
+        results = [lock.ensure() for lock in self.workers]
+        self.assertEqual(results, [True, False, False])
+        # 再次确认时身份不变
+        self.assertEqual([lock.ensure() for lock in self.workers], [True, False, False])
+
+    def test_failover_when_leader_dies(self):
+        leader, follower = self.workers[0], self.workers[1]
+        self.assertTrue(leader.ensure())
+        self.assertFalse(follower.ensure())
+
+        # 主节点进程崩溃：连接被 MySQL 关闭，锁随之释放
+        leader._conn.close()
+        self.assertTrue(follower.ensure())
+        self.assertFalse(leader.ensure())
+        self.assertEqual(leader.losses, 1)
+
+    def test_leader_steps_down_when_database_unreachable(self):
+        leader = self.workers[0]
+        self.assertTrue(leader.ensure())
+        self.server.available = False
+        self.assertFalse(leader.ensure())
+        self.assertIsNone(leader.leader_since)
+
+    def test_release_hands_over(self):
+        self.assertTrue(self.workers[0].ensure())
+        self.workers[0].release()
+        self.assertTrue(self.workers[1].ensure())
+
+
+class TestSchedulerLeadership(unittest.TestCase):
+
+    def test_only_leader_runs_schedules(self):
+        server = FakeLockServer()
+        ran = []
+        schedulers = [ScheduleScheduler(check_interval=60, leader_lock=LeaderLock('test', connect=server.connect))
+                      for _ in range(2)]
+        for index, item in enumerate(schedulers):
+            item.initialize_schedules = lambda: None
+            item._check_and_execute_schedules = lambda index=index: ran.append(index)
+
+        with patch('scheduler.SCHEDULER_LEADER_RETRY', 0.01):
+            for item in schedulers:
+                item.start()
+            threading.Event().wait(0.1)
+            for item in schedulers:
+                item.stop()
+
+        self.assertEqual(len(set(ran)), 1)
+        leader = schedulers[ran[0]]
+        self.assertEqual(leader.stats()['acquisitions'], 1)
+        # 停止时释放锁
+        self.assertFalse(leader.leader_lock.is_leader)
+        self.assertEqual(server.holders, {})
+
+
+class TestServeWorkers(unittest.TestCase):
+
+    def test_multiple_workers_only_warn_about_stream_resume(self):
+        from serve import multi_worker_warning
+        self.assertIsNone(multi_worker_warning(1))
+        self.assertIn('断线续传', multi_worker_warning(4))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import sys
+import os
+import time
+import threading
+from unittest.mock import patch
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from skills.base import BaseSkill, SkillRegistry
+
+
+class SleepSkill(BaseSkill):
+
+    def __init__(self, name, delay, timeout=None):
+        self._name = name
+        self.delay = delay
+        self.timeout = timeout
+        super().__init__()
+
+    def get_name(self):
+        return self._name
+
+    def get_description(self):
+        return self._name
+
+    def get_parameters(self):
+        return {"type": "object", "properties": {}}
+
+    def execute(self, **kwargs):
+        time.sleep(self.delay)
+        return {"name": self._name, "thread": threading.current_thread().name}
+
+
+class TestExecuteSkills(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = SkillRegistry()
+        for skill in (SleepSkill('slow', 0.3), SleepSkill('fast', 0.05), SleepSkill('stuck', 1, timeout=0.1)):
+            self.registry.register(skill)
+
+    def test_calls_run_concurrently_and_yield_as_completed(self):
+        start = time.monotonic()
+        results = list(self.registry.execute_skills([('slow', {}), ('fast', {}), ('slow', {})]))
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual(results[0][0], 1)
+        self.assertEqual(sorted(index for index, _ in results), [0, 1, 2])
+        self.assertTrue(all(result['success'] for _, result in results))
+
+    def test_per_skill_timeout(self):
+        results = dict(self.registry.execute_skills([('stuck', {}), ('fast', {})]))
+        self.assertTrue(results[1]['success'])
+        self.assertFalse(results[0]['success'])
+        self.assertIn('超时', results[0]['error'])
+
+    def test_timeout_starts_when_skill_starts_running(self):
+        # 线程池被其他请求的技能占满：排队时间不计入 quick 的 0.2 秒超时
+        self.registry.register(SleepSkill('quick', 0.05, timeout=0.2))
+        with patch('skills.base.SKILL_MAX_WORKERS', 1):
+            busy = threading.Thread(target=lambda: list(self.registry.execute_skills([('slow', {})])))
+            busy.start()
+            time.sleep(0.02)
+            results = dict(self.registry.execute_skills([('quick', {})]))
+            busy.join()
+        self.assertTrue(results[0]['success'])
+
+    def test_queued_call_cancelled_after_queue_timeout(self):
+        with patch('skills.base.SKILL_MAX_WORKERS', 1), patch('skills.base.SKILL_QUEUE_TIMEOUT', 0.1):
+            busy = threading.Thread(target=lambda: list(self.registry.execute_skills([('slow', {})])))
+            busy.start()
+            time.sleep(0.02)
+            results = dict(self.registry.execute_skills([('fast', {})]))
+            busy.join()
+        self.assertFalse(results[0]['success'])
+        self.assertIn('排队', results[0]['error'])
+
+    def test_unknown_skill(self):
+        results = dict(self.registry.execute_skills([('missing', {})]))
+        self.assertFalse(results[0]['success'])
+
+
+if __name__ == '__main__':
+    unittest.main()
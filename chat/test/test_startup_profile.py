@@ -0,0 +1,58 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from startup_profile import StartupProfile
+
+
+class TestStartupProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for name, body in (('profiled_parent', 'import time\nimport profiled_child\ntime.sleep(0.05)\n'),
+                           ('profiled_child', 'import time\ntime.sleep(0.1)\n'),
+                           ('profiled_lazy', 'x = 1\n')):
+            with open(os.path.join(self.tmp_dir, f'{name}.py'), 'w') as f:
+                f.write(body)
+        sys.path.insert(0, self.tmp_dir)
+        self.profile = StartupProfile(enabled=True)
+
+    def tearDown(self):
+        self.profile.stop()
+        sys.path.remove(self.tmp_dir)
+        for name in ('profiled_parent', 'profiled_child', 'profiled_lazy'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_self_and_cumulative_time(self):
+        self.profile.begin()
+        import profiled_parent  # noqa: F401
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.profile.end()
+
+        parent_self, parent_total, parent_lazy = self.profile.modules['profiled_parent']
+        child_self, child_total, _ = self.profile.modules['profiled_child']
+        self.assertGreaterEqual(child_self, 0.1)
+        self.assertGreaterEqual(parent_total, 0.15)
+        self.assertLess(parent_self, 0.1)
+        self.assertFalse(parent_lazy)
+        self.assertIn('启动耗时', output.getvalue())
+        self.assertEqual(self.profile.stats()['slowest_packages'][0][0], 'profiled_child')
+
+    def test_imports_after_startup_are_lazy(self):
+        self.profile.begin()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.profile.end()
+        import profiled_lazy  # noqa: F401
+
+        self.assertTrue(self.profile.modules['profiled_lazy'][2])
+        self.assertEqual([name for name, _ in self.profile.stats()['lazy']], ['profiled_lazy'])
+
+
+if __name__ == '__main__':
+    unittest.main()
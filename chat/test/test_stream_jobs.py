@@ -0,0 +1,160 @@
+import unittest
+import sys
+import os
+import json
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_jobs import StreamJob, StreamJobLimitError, StreamJobManager, parse_last_event_id
+
+
+def parse_sse(chunks):
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(':'):
+            continue
+        id_line, data_line = chunk.strip().split('\n')
+        events.append((int(id_line[4:]), json.loads(data_line[6:])))
+    return events
+
+
+class TestStreamJobs(unittest.TestCase):
+
+    def test_resume_after_last_event_id(self):
+        job = StreamJob('alice', buffer_size=10)
+        for text in ['a', 'b', 'c']:
+            job.publish({'content': text})
+        job.finish()
+
+        manager = StreamJobManager()
+        self.assertEqual(parse_sse(manager.sse(job)), [(1, {'content': 'a'}), (2, {'content': 'b'}), (3, {'content': 'c'})])
+        self.assertEqual(parse_sse(manager.sse(job, last_event_id=2)), [(3, {'content': 'c'})])
+        self.assertEqual(parse_sse(manager.sse(job, last_event_id=99)), [])
+        self.assertEqual(manager.stats()['resumed'], 2)
+
+    def test_snapshot_when_events_fell_out_of_buffer(self):
+        job = StreamJob('alice', buffer_size=2)
+        for text in ['一', '二', '三', '四']:
+            job.publish({'content': text})
+        job.publish({'done': True})
+        job.finish()
+
+        events = parse_sse(StreamJobManager().sse(job, last_event_id=1))
+        self.assertEqual(events, [(5, {'snapshot': {'content': '一二三四'}})])
+
+    def test_snapshot_keeps_compare_models_apart(self):
+        job = StreamJob('alice', buffer_size=2)
+        for model, text in [('a', '一'), ('b', '二'), ('a', '三'), ('b', '四')]:
+            job.publish({'model': model, 'content': text})
+        job.finish()
+
+        events = parse_sse(StreamJobManager().sse(job, last_event_id=1))
+        self.assertEqual(events, [(4, {'snapshot': {'content': '', 'models': {'a': '一三', 'b': '二四'}}})])
+
+    def test_job_runs_to_completion_without_client(self):
+        release = threading.Event()
+        saved = []
+
+        def producer():
+            yield {'content': 'partial'}
+            release.wait(2)
+            saved.append('saved')
+            yield {'done': True}
+
+        manager = StreamJobManager()
+        job = manager.start('alice', producer, conversation_id='c1')
+
+        # 客户端读到第一个事件后断开
+        reader = manager.sse(job, heartbeat=0.05)
+        first = next(reader)
+        reader.close()
+        self.assertIn('partial', first)
+        self.assertEqual(job.subscribers, 0)
+
+        release.set()
+        events = parse_sse(manager.sse(job, last_event_id=1, heartbeat=0.05))
+        self.assertEqual(events, [(2, {'done': True})])
+        self.assertEqual(saved, ['saved'])
+        self.assertEqual(manager.stats()['completed'], 1)
+
+    def test_heartbeat_while_waiting(self):
+        job = StreamJob('alice')
+        reader = StreamJobManager().sse(job, heartbeat=0.01)
+        self.assertEqual(next(reader), ": keepalive\n\n")
+        job.publish({'content': 'x'})
+        self.assertTrue(next(reader).startswith('id: 1\n'))
+        job.finish()
+        self.assertEqual(list(reader), [])
+
+    def test_producer_error_and_ownership(self):
+        def producer():
+            yield {'content': 'x'}
+            raise RuntimeError('upstream failed')
+
+        manager = StreamJobManager(retention=0)
+        job = manager.start('alice', producer, conversation_id='c1')
+        events = parse_sse(manager.sse(job))
+        self.assertEqual(events[-1], (2, {'error': 'upstream failed'}))
+        self.assertIsNone(manager.get(job.id, 'bob'))
+        self.assertIs(manager.get(job.id, 'alice'), job)
+        self.assertIs(manager.find_active('alice', 'c1'), None)  # retention=0 时结束即清理
+
+    def test_running_job_reused_for_same_conversation(self):
+        release = threading.Event()
+
+        def producer():
+            release.wait(2)
+            yield {'done': True}
+
+        manager = StreamJobManager()
+        job = manager.start('alice', producer, conversation_id='c1')
+        self.assertIs(manager.start('alice', producer, conversation_id='c1'), job)
+        self.assertIs(manager.running('alice', 'c1'), job)
+        self.assertIsNone(manager.running('bob', 'c1'))
+        release.set()
+        list(manager.sse(job))
+        self.assertIsNone(manager.running('alice', 'c1'))
+        self.assertEqual((manager.stats()['started'], manager.stats()['reused']), (1, 1))
+
+    def test_running_jobs_limited_per_user_and_globally(self):
+        release = threading.Event()
+
+        def producer():
+            release.wait(2)
+            yield {'done': True}
+
+        manager = StreamJobManager(max_jobs=3, max_jobs_per_user=2)
+        jobs = [manager.start('alice', producer, conversation_id=f'a{i}') for i in range(2)]
+        with self.assertRaises(StreamJobLimitError):
+            manager.start('alice', producer, conversation_id='a2')
+        jobs.append(manager.start('bob', producer, conversation_id='b0'))
+        with self.assertRaises(StreamJobLimitError):
+            manager.check_limits('carol')
+        self.assertEqual(manager.stats()['rejected'], 2)
+
+        release.set()
+        for job in jobs:
+            list(manager.sse(job))
+        manager.check_limits('alice')
+
+    def test_jobs_share_a_bounded_thread_pool(self):
+        threads = set()
+
+        def producer():
+            threads.add(threading.current_thread().name)
+            yield {'done': True}
+
+        manager = StreamJobManager(max_jobs=2)
+        for i in range(6):
+            list(manager.sse(manager.start('alice', producer, conversation_id=f'c{i}')))
+        self.assertLessEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('stream-job') for name in threads))
+
+    def test_parse_last_event_id(self):
+        self.assertEqual(parse_last_event_id('12'), 12)
+        self.assertEqual(parse_last_event_id(None), 0)
+        self.assertEqual(parse_last_event_id('abc'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
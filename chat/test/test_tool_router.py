@@ -0,0 +1,111 @@
+import unittest
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from skills.base import BaseSkill, SkillRegistry
+from tool_router import BM25Index, ToolRouter, tokenize
+
+
+class FakeSkill(BaseSkill):
+
+    def __init__(self, name, description, skill_md='', keywords=()):
+        self._name = name
+        self._description = description
+        self.keywords = list(keywords)
+        super().__init__()
+        self.skill_md = skill_md
+
+    def get_name(self):
+        return self._name
+
+    def get_description(self):
+        return self._description
+
+    def get_parameters(self):
+        return {"type": "object", "properties": {"city": {"type": "string", "description": "城市名称"}}}
+
+    def execute(self, **kwargs):
+        return {}
+
+
+def make_registry():
+    registry = SkillRegistry()
+    for skill in (
+        FakeSkill('get_weather', '获取指定城市的当前天气信息', '查询温度、下雨、风力'),
+        FakeSkill('web_search_news', '联网搜索最新新闻和事件'),
+        FakeSkill('create_schedule', '创建定时任务', keywords=['提醒', '每天']),
+        FakeSkill('mysql_client', '连接 MySQL 数据库执行 SQL 查询'),
+        FakeSkill('random_joke', '讲一个随机笑话'),
+        FakeSkill('get_current_date', '获取当前日期和时间'),
+    ):
+        registry.register(skill)
+    tools = [{'type': 'function', 'function': registry.get_skill(n).to_function_definition()}
+             for n in registry.list_skills()]
+    return registry, tools
+
+
+def names(tools):
+    return [t['function']['name'] for t in tools]
+
+
+class TestToolRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.registry, self.tools = make_registry()
+        self.router = ToolRouter(top_k=2, pinned=['get_current_date'], enabled=True)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('查天气 MySQL'), ['查天', '天气', 'mysql'])
+
+    def test_bm25_prefers_matching_document(self):
+        index = BM25Index({'a': ['天气', '城市'], 'b': ['新闻', '搜索']})
+        scores = index.score({'天气': 1})
+        self.assertGreater(scores['a'], scores['b'])
+
+    def test_selects_relevant_and_pinned_tools(self):
+        selected = names(self.router.select(self.registry, self.tools, '北京今天天气怎么样'))
+        self.assertIn('get_weather', selected)
+        self.assertIn('get_current_date', selected)
+        self.assertNotIn('random_joke', selected)
+        self.assertLessEqual(len(selected), 3)
+
+    def test_keywords_and_recent_context(self):
+        self.assertIn('create_schedule', names(self.router.select(self.registry, self.tools, '每天提醒我喝水')))
+        selected = names(self.router.select(self.registry, self.tools, '那上海呢',
+                                            recent_messages=['北京天气怎么样']))
+        self.assertIn('get_weather', selected)
+
+    def test_recently_called_tools_are_kept(self):
+        selected = names(self.router.select(self.registry, self.tools, '再来一个',
+                                            recent_tools=['random_joke']))
+        self.assertIn('random_joke', selected)
+
+    def test_conversation_toolset_only_grows(self):
+        first = names(self.router.select(self.registry, self.tools, '北京今天天气怎么样', conversation='c1'))
+        second = names(self.router.select(self.registry, self.tools, '每天提醒我喝水', conversation='c1'))
+        # 之前发送过的技能保持原顺序在前，新选中的追加在末尾
+        self.assertEqual(second[:len(first)], first)
+        self.assertIn('create_schedule', second[len(first):])
+        third = names(self.router.select(self.registry, self.tools, '北京今天天气怎么样', conversation='c1'))
+        self.assertEqual(third, second)
+        # 其他对话互不影响
+        self.assertEqual(names(self.router.select(self.registry, self.tools, '北京今天天气怎么样',
+                                                  conversation='c2')), first)
+        self.assertEqual(self.router.stats()['toolset_extended'], 1)
+
+    def test_conversation_toolset_resets_when_too_large(self):
+        router = ToolRouter(top_k=2, pinned=['get_current_date'], enabled=True, conversation_max=2)
+        router.select(self.registry, self.tools, '北京今天天气怎么样', conversation='c1')
+        selected = names(router.select(self.registry, self.tools, '讲一个随机笑话', conversation='c1'))
+        self.assertNotIn('get_weather', selected)
+        self.assertIn('random_joke', selected)
+        self.assertEqual(router.stats()['toolset_resets'], 1)
+
+    def test_disabled_or_small_tool_lists_pass_through(self):
+        self.assertEqual(ToolRouter(enabled=False).select(self.registry, self.tools, '天气'), self.tools)
+        self.assertEqual(ToolRouter(top_k=10).select(self.registry, self.tools, '天气'), self.tools)
+
+
+if __name__ == '__main__':
+    unittest.main()
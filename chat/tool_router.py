@@ -0,0 +1,210 @@
+"""
+工具路由
+
+每次对话都把全部已启用技能的 JSON Schema 作为 tools 发送，会让提示词膨胀、拖慢每一轮。
+这里对技能描述、参数说明和 SKILL.md 建一个本地 BM25 索引，用本轮消息（以及最近几条
+用户消息）打分，只发送得分最高的 top-k 个技能，外加始终发送的固定技能。
+
+分词不依赖第三方库：英文和数字按单词切分，中文按相邻两字（bigram）切分。
+
+提供方的提示词缓存按前缀匹配，tools 排在所有消息之前：每轮换一组技能，整段对话历史都不能命中缓存。
+因此同一对话发送的技能集合只增不减、顺序不变，新选中的技能追加在末尾，几轮之后集合趋于稳定；
+超过 TOOL_ROUTER_CONVERSATION_MAX 个时才按本轮的选择重新开始（缓存失效一次）。
+集合保存在进程内（LRU），进程重启后从本轮重新开始。
+
+环境变量：
+    TOOL_ROUTER_ENABLED            是否启用，默认 1
+    TOOL_ROUTER_TOP_K              每轮最多发送的非固定技能数，默认 5
+    TOOL_ROUTER_PINNED             始终发送的技能，逗号分隔，默认 get_current_date
+    TOOL_ROUTER_CONVERSATION_MAX   同一对话累积发送的技能数上限，默认 15
+"""
+
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+TOOL_ROUTER_ENABLED = os.getenv('TOOL_ROUTER_ENABLED', '1') not in ('0', 'false', 'False', '')
+TOOL_ROUTER_TOP_K = int(os.getenv('TOOL_ROUTER_TOP_K', '5'))
+TOOL_ROUTER_PINNED = [s.strip() for s in os.getenv('TOOL_ROUTER_PINNED', 'get_current_date').split(',') if s.strip()]
+TOOL_ROUTER_CONVERSATION_MAX = int(os.getenv('TOOL_ROUTER_CONVERSATION_MAX', '15'))
+
+# 进程内最多记住多少个对话的技能集合
+CONVERSATION_TOOLSETS_SIZE = 2000
+
+# 最近的用户消息参与打分时的权重（本轮消息为 1）
+RECENT_CONTEXT_WEIGHT = 0.5
+
+_WORD_RE = re.compile(r'[a-z0-9]+|[㐀-鿿]+')
+_CODE_BLOCK_RE = re.compile(r'```.*?```', re.S)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """英文按单词、中文按 bigram 切分"""
+    if not text:
+        return []
+    tokens = []
+    for run in _WORD_RE.findall(text.lower()):
+        if run[0] < '㐀':
+            if len(run) > 1:
+                tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def skill_document(skill) -> List[str]:
+    """技能的索引文本：名称、描述和 keywords 加权，参数说明和 SKILL.md 正文（去掉代码块）各计一次"""
+    name_tokens = tokenize(skill.name.replace('_', ' ').replace('-', ' '))
+    description_tokens = tokenize(skill.description)
+
+    parameter_text = []
+    for param_name, param in (skill.parameters or {}).get('properties', {}).items():
+        parameter_text.append(param_name.replace('_', ' '))
+        if isinstance(param, dict):
+            parameter_text.append(str(param.get('description', '')))
+
+    keyword_tokens = tokenize(' '.join(getattr(skill, 'keywords', None) or []))
+    readme = _CODE_BLOCK_RE.sub(' ', skill.skill_md or '')
+    return (name_tokens * 3 + description_tokens * 3 + keyword_tokens * 3
+            + tokenize(' '.join(parameter_text)) + tokenize(readme))
+
+
+class BM25Index:
+    """简单的 BM25 索引"""
+
+    def __init__(self, documents: Dict[str, Sequence[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = {name: Counter(tokens) for name, tokens in documents.items()}
+        self._lengths = {name: len(tokens) for name, tokens in documents.items()}
+        self._avg_length = (sum(self._lengths.values()) / len(documents)) if documents else 0
+        doc_freqs = Counter()
+        for freqs in self._term_freqs.values():
+            doc_freqs.update(freqs.keys())
+        n = len(documents)
+        self._idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    def score(self, query: Dict[str, float]) -> Dict[str, float]:
+        """query 为 {词: 权重}，返回每个文档的得分"""
+        scores = {}
+        for name, freqs in self._term_freqs.items():
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[name] / (self._avg_length or 1))
+            total = 0.0
+            for term, weight in query.items():
+                tf = freqs.get(term)
+                if tf:
+                    total += weight * self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores[name] = total
+        return scores
+
+
+class ToolRouter:
+    """按相关性挑选发送给模型的 tools"""
+
+    def __init__(self, top_k: int = TOOL_ROUTER_TOP_K, pinned: Iterable[str] = TOOL_ROUTER_PINNED,
+                 enabled: bool = TOOL_ROUTER_ENABLED, conversation_max: int = TOOL_ROUTER_CONVERSATION_MAX):
+        self.top_k = top_k
+        self.pinned = set(pinned)
+        self.enabled = enabled
+        self.conversation_max = conversation_max
+        self._lock = threading.Lock()
+        self._index: Optional[BM25Index] = None
+        self._registry = None
+        self._toolsets: 'OrderedDict[Hashable, List[str]]' = OrderedDict()
+        self.toolset_extended = 0
+        self.toolset_resets = 0
+
+    def rebuild(self, registry):
+        """根据技能注册表重建索引（技能重新加载后调用）"""
+        documents = {}
+        for skill_name in registry.list_skills():
+            skill = registry.get_skill(skill_name)
+            if skill:
+                documents[skill_name] = skill_document(skill)
+        index = BM25Index(documents)
+        with self._lock:
+            self._index = index
+            self._registry = registry
+        return index
+
+    def _get_index(self, registry) -> BM25Index:
+        with self._lock:
+            if self._index is not None and self._registry is registry:
+                return self._index
+        return self.rebuild(registry)
+
+    def _extend_toolset(self, conversation: Hashable, selected: List[str], available: Iterable[str]) -> List[str]:
+        """把本轮选中的技能并入对话的技能集合：已有的保持原顺序，新的追加在末尾"""
+        available = set(available)
+        with self._lock:
+            names = [name for name in self._toolsets.get(conversation, ()) if name in available]
+            added = [name for name in selected if name not in names]
+            if names and len(names) + len(added) > self.conversation_max:
+                names, added = [], list(selected)
+                self.toolset_resets += 1
+            elif names and added:
+                self.toolset_extended += 1
+            names += added
+            self._toolsets[conversation] = names
+            self._toolsets.move_to_end(conversation)
+            while len(self._toolsets) > CONVERSATION_TOOLSETS_SIZE:
+                self._toolsets.popitem(last=False)
+            return list(names)
+
+    def select(self, registry, tools: List[Dict[str, Any]], message: str,
+               recent_messages: Sequence[str] = (), recent_tools: Iterable[str] = (),
+               conversation: Optional[Hashable] = None) -> List[Dict[str, Any]]:
+        """从 tools 中挑选与本轮消息最相关的 top-k 个（保持原有顺序）
+
+        固定技能和最近几轮刚调用过的技能（便于追问）总是包含在内，不占 top-k 名额。
+        指定 conversation 时返回该对话累积的技能集合（只增不减、顺序不变），保持提示词前缀稳定。
+        """
+        if not self.enabled or len(tools) <= self.top_k:
+            return tools
+
+        query = Counter()
+        for text in recent_messages:
+            for token in tokenize(text):
+                query[token] += RECENT_CONTEXT_WEIGHT
+        for token in tokenize(message):
+            query[token] += 1
+
+        scores = self._get_index(registry).score(query)
+        candidates = [tool['function']['name'] for tool in tools
+                      if tool['function']['name'] not in self.pinned]
+        ranked = sorted((name for name in candidates if scores.get(name, 0) > 0),
+                        key=lambda name: scores[name], reverse=True)
+        selected = set(ranked[:self.top_k]) | self.pinned | set(recent_tools)
+        chosen = [tool for tool in tools if tool['function']['name'] in selected]
+        if conversation is None:
+            return chosen
+
+        by_name = {tool['function']['name']: tool for tool in tools}
+        names = self._extend_toolset(conversation, [tool['function']['name'] for tool in chosen], by_name)
+        return [by_name[name] for name in names]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'top_k': self.top_k,
+                'conversations': len(self._toolsets),
+                'toolset_extended': self.toolset_extended,
+                'toolset_resets': self.toolset_resets,
+            }
+
+
+tool_router = ToolRouter()
+
+
+__all__ = ['BM25Index', 'ToolRouter', 'tokenize', 'skill_document', 'tool_router']